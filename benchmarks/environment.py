@@ -0,0 +1,42 @@
+"""
+Окружение бенчмарков
+
+Приложение читает конфигурацию из переменных окружения при импорте, а шаблоны сообщений и миграции
+ищет относительно `src`, поэтому `prepare` вызывается до первого импорта `app`. Бенчмарки работают
+с отдельной БД SQLite во временном каталоге.
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def configure():
+    """
+    Задает окружение приложения с БД во временном каталоге
+    """
+    data_dir = tempfile.mkdtemp(prefix="cats-bot-bench-")
+    atexit.register(shutil.rmtree, data_dir, True)
+    os.environ.update({
+        "APP_BOT_TOKEN": "1:bench",
+        "APP_BOT_ADMIN_ID": "1",
+        "APP_CHANNEL_ID": "@channel",
+        "APP_RUN_METHOD": "polling",
+        "APP_DATABASE_URL": "sqlite:///{}".format(os.path.join(data_dir, "db.db")),
+        "APP_LOG_FILENAME": os.path.join(data_dir, "app.log"),
+    })
+    os.chdir(SRC_DIR)
+    sys.path.insert(0, SRC_DIR)
+
+
+def prepare():
+    """
+    Задает окружение приложения и создает БД миграциями
+    """
+    configure()
+    from app import startup
+    startup.migrate_if_needed()
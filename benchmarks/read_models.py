@@ -0,0 +1,82 @@
+"""
+Чтения на пути голоса: сущности ORM и записи Core
+
+На каждое нажатие бот читает метаданные варианта ответа с признаком заморозки опроса, текущий голос
+пользователя, опрос с вариантами ответа и количество голосов для перерисовки кнопок. Бенчмарк выполняет
+эти чтения через сущности ORM, как до появления `app.read_repo`, и через записи `app.read_repo`, каждое
+нажатие в своей сессии, и сравнивает время и пиковую память, выделенную за одно нажатие.
+
+    python benchmarks/read_models.py [--votes 300] [--iterations 2000]
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import environment
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Чтения на пути голоса: сущности ORM и записи Core")
+    parser.add_argument("--votes", type=int, default=300, help="Количество голосов в опросе")
+    parser.add_argument("--iterations", type=int, default=2000, help="Количество нажатий")
+    args = parser.parse_args()
+    environment.prepare()
+    from app import db, read_repo, repo
+    from app.models import PollOption, PollVote
+    from app.repo import VoteMutation
+
+    @db.commit_session
+    def create_poll(session=None):
+        poll = repo.create_poll(["😺", "😿", "🙀"])
+        session.flush()
+        option_ids = [option.id for option in poll.options]
+        repo.apply_votes([VoteMutation(poll.id, user_id, option_ids[user_id % len(option_ids)])
+                          for user_id in range(args.votes)])
+        return poll.id, option_ids
+
+    @db.commit_session
+    def read_orm(option_id: int, user_id: int, session=None):
+        option = session.query(PollOption).get(option_id)
+        is_final = option.poll.is_final
+        vote = session.query(PollVote)\
+            .filter(PollVote.poll_id == option.poll_id,
+                    PollVote.user_id == user_id)\
+            .order_by(PollVote.id.desc())\
+            .first()
+        poll = repo.get_poll(option.poll_id)
+        option_votes = repo.get_votes_count_by_options(poll)
+        return is_final, vote.option_id if vote is not None else None, \
+            [(option.text, option_votes[option.id]) for option in poll.options]
+
+    @db.commit_session
+    def read_records(option_id: int, user_id: int, session=None):
+        option = read_repo.get_option_meta(option_id)
+        vote_option_id = read_repo.get_vote_option_id(option.poll_id, user_id)
+        poll = read_repo.get_poll(option.poll_id)
+        option_votes = read_repo.get_votes_count_by_options(poll)
+        return option.poll_is_final, vote_option_id, [(option.text, option_votes[option.id]) for option in poll.options]
+
+    poll_id, option_ids = create_poll()
+    taps = [(option_ids[index % len(option_ids)], index % (args.votes * 2)) for index in range(args.iterations)]
+    assert all(read_orm(*tap) == read_records(*tap) for tap in taps[:len(option_ids) * 2])
+    print("votes in poll: {}, taps: {}".format(args.votes, args.iterations))
+    for name, read in [("ORM entities", read_orm), ("Core records", read_records)]:
+        started = time.perf_counter()
+        for tap in taps:
+            read(*tap)
+        elapsed = time.perf_counter() - started
+        peaks = list()
+        tracemalloc.start()
+        for tap in taps[:min(len(taps), 200)]:
+            # Сбрасывает и текущую, и пиковую память
+            tracemalloc.clear_traces()
+            read(*tap)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        print("{}: {:.2f} ms per tap, peak {:.1f} KiB allocated per tap".format(
+            name, elapsed * 1000 / len(taps), sum(peaks) / len(peaks) / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Разбор тел запросов вебхука
+
+Сравнивает быстрый разбор `updates.peek`, которого достаточно для маршрутизации и нажатий на кнопки
+опросов, с полным разбором `json.loads` и `Update.de_json`. Тела берутся из журналов `app.capture`,
+а если журналы не указаны - из нескольких типичных обновлений: нажатия на кнопку опроса,
+команды и фото.
+
+    python benchmarks/updates.py [--iterations 20000] [журнал ...]
+"""
+
+import argparse
+import json
+import time
+
+import environment
+
+SAMPLES = [
+    {"update_id": 1, "callback_query": {
+        "id": "4382bfdwdsb323b2d9", "chat_instance": "-5188012958741253543",
+        "from": {"id": 1111111, "is_bot": False, "first_name": "Cat", "last_name": "Lover", "username": "cat_lover",
+                 "language_code": "ru"},
+        "message": {"message_id": 1365, "date": 1700000000,
+                    "chat": {"id": -1001234567890, "title": "Cats", "username": "cats", "type": "channel"},
+                    "sender_chat": {"id": -1001234567890, "title": "Cats", "username": "cats", "type": "channel"},
+                    "photo": [{"file_id": "AgACAgIAAxkBAAIBQ2", "file_unique_id": "AQADr7", "file_size": 1412,
+                               "width": 90, "height": 90},
+                              {"file_id": "AgACAgIAAxkBAAIBQ3", "file_unique_id": "AQADr8", "file_size": 71244,
+                               "width": 1280, "height": 1280}],
+                    "caption": "@cats_bot", "caption_entities": [{"offset": 0, "length": 9, "type": "mention"}],
+                    "reply_markup": {"inline_keyboard": [[
+                        {"text": "😺 12", "callback_data": "{\"a\": \"v\", \"p\": 41, \"o\": 120}"},
+                        {"text": "😿 3", "callback_data": "{\"a\": \"v\", \"p\": 41, \"o\": 121}"}]]}},
+        "data": "{\"a\": \"v\", \"p\": 41, \"o\": 120}"}},
+    {"update_id": 2, "message": {
+        "message_id": 12, "date": 1700000000, "text": "/help",
+        "from": {"id": 1111111, "is_bot": False, "first_name": "Cat", "language_code": "ru"},
+        "chat": {"id": 1111111, "first_name": "Cat", "type": "private"},
+        "entities": [{"offset": 0, "length": 5, "type": "bot_command"}]}},
+    {"update_id": 3, "message": {
+        "message_id": 13, "date": 1700000000,
+        "from": {"id": 1111111, "is_bot": False, "first_name": "Cat", "language_code": "ru"},
+        "chat": {"id": 1111111, "first_name": "Cat", "type": "private"},
+        "photo": [{"file_id": "AgACAgIAAxkBAAIBQ4", "file_unique_id": "AQADr9", "file_size": 1412,
+                   "width": 90, "height": 90},
+                  {"file_id": "AgACAgIAAxkBAAIBQ5", "file_unique_id": "AQADs0", "file_size": 21312,
+                   "width": 320, "height": 320},
+                  {"file_id": "AgACAgIAAxkBAAIBQ6", "file_unique_id": "AQADs1", "file_size": 71244,
+                   "width": 1280, "height": 1280}]}},
+]
+
+
+def measure(bodies: list, iterations: int, parse) -> float:
+    started = time.perf_counter()
+    for index in range(iterations):
+        parse(bodies[index % len(bodies)])
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Разбор тел запросов вебхука")
+    parser.add_argument("--iterations", type=int, default=20000, help="Количество разборов")
+    parser.add_argument("logs", nargs="*", help="Журналы app.capture, сжатые или нет")
+    args = parser.parse_args()
+    environment.configure()
+    from telebot.types import Update
+    from app import updates
+    from app.replay import read_log
+
+    if len(args.logs) > 0:
+        bodies = [json.dumps(update).encode("utf-8") for _, update in read_log(args.logs)]
+    else:
+        bodies = [json.dumps(update).encode("utf-8") for update in SAMPLES]
+    votes = [body for body in bodies if updates.peek(body).callback_query_id is not None]
+    print("payloads: {} ({} vote taps), parser: {}".format(len(bodies), len(votes), updates.loads.__module__))
+    for name, sample in [("all", bodies), ("vote taps", votes)]:
+        if len(sample) == 0:
+            continue
+        peek = measure(sample, args.iterations, updates.peek)
+        full = measure(sample, args.iterations, lambda body: Update.de_json(json.loads(body)))
+        print("{}: peek {:.3f} s, json.loads + Update.de_json {:.3f} s over {} iterations, {:.1f}x".format(
+            name, peek, full, args.iterations, full / peek))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Запись голосов по одному и пакетом
+
+Сравнивает `repo.add_vote` в отдельной транзакции на каждый голос, как при обычном нажатии,
+с одним вызовом `repo.apply_votes` на все голоса. Голоса распределены по нескольким опросам.
+
+    python benchmarks/votes.py [--votes 10000] [--polls 20]
+"""
+
+import argparse
+import time
+
+import environment
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запись голосов по одному и пакетом")
+    parser.add_argument("--votes", type=int, default=10000, help="Количество голосов")
+    parser.add_argument("--polls", type=int, default=20, help="Количество опросов")
+    args = parser.parse_args()
+    environment.prepare()
+    from app import db, repo
+    from app.repo import VoteMutation
+
+    @db.commit_session
+    def create_polls(session=None) -> list:
+        polls = [repo.create_poll(["😺", "😿", "🙀"]) for _ in range(args.polls)]
+        session.flush()
+        return [(poll.id, [option.id for option in poll.options]) for poll in polls]
+
+    @db.commit_session
+    def add_vote(poll_id: int, option_id: int, user_id: int, session=None):
+        repo.add_vote(poll_id, option_id, user_id)
+
+    @db.commit_session
+    def apply_votes(mutations: list, session=None):
+        repo.apply_votes(mutations)
+
+    def make_votes(polls: list, first_user_id: int) -> list:
+        return [(polls[index % len(polls)][0], polls[index % len(polls)][1][index % 3], first_user_id + index)
+                for index in range(args.votes)]
+
+    polls = create_polls()
+    single_votes = make_votes(polls, 0)
+    started = time.perf_counter()
+    for poll_id, option_id, user_id in single_votes:
+        add_vote(poll_id, option_id, user_id)
+    single = time.perf_counter() - started
+    mutations = [VoteMutation(poll_id, user_id, option_id)
+                 for poll_id, option_id, user_id in make_votes(polls, args.votes)]
+    started = time.perf_counter()
+    apply_votes(mutations)
+    batched = time.perf_counter() - started
+    print("votes: {}, polls: {}".format(args.votes, args.polls))
+    print("add_vote x{}: {:.3f} s ({:.3f} ms per vote)".format(args.votes, single, single * 1000 / args.votes))
+    print("apply_votes x1: {:.3f} s ({:.3f} ms per vote)".format(batched, batched * 1000 / args.votes))
+    print("speedup: {:.1f}x".format(single / batched))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,5 @@ if [ ! -z $X_SECRET_FILE ]; then
     export SECRET=$(cat $X_SECRET_FILE)
 fi
 
-# Ждем старта mysql
-sleep 10
-
-# Производим миграции
-alembic upgrade head
-# Запускаем приложение
+# Запускаем приложение. Ожидание БД и миграции выполняются при старте приложения
 python bot.py
@@ -13,7 +13,8 @@ config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-fileConfig(config.config_file_name)
+# Не отключаем уже созданные логгеры: миграции могут запускаться из работающего приложения
+fileConfig(config.config_file_name, disable_existing_loggers=False)
 
 # Импорт моделей приложения
 # Меняем рабочую директорию чтобы был доступен импорт моделей
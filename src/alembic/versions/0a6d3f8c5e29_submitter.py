@@ -0,0 +1,40 @@
+"""submitter
+
+Revision ID: 0a6d3f8c5e29
+Revises: f5b82d1e7a64
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a6d3f8c5e29'
+down_revision = 'f5b82d1e7a64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('submitter',
+    sa.Column('user_id', sa.String(length=255), nullable=False),
+    sa.Column('user_username', sa.String(length=255), nullable=True),
+    sa.Column('user_title', sa.String(length=255), nullable=True),
+    sa.Column('submitted', sa.Integer(), nullable=False),
+    sa.Column('accepted', sa.Integer(), nullable=False),
+    sa.Column('declined', sa.Integer(), nullable=False),
+    sa.Column('last_activity_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_index(op.f('ix_submitter_accepted'), 'submitter', ['accepted'], unique=False)
+    # История решений не сохранилась, поэтому учитываем только предложки, ожидающие решения
+    op.execute("INSERT INTO submitter (user_id, user_username, user_title, submitted, accepted, declined, "
+               "last_activity_at) "
+               "SELECT user_id, MAX(user_username), MAX(user_title), COUNT(*), 0, 0, CURRENT_TIMESTAMP "
+               "FROM suggestion WHERE user_id IS NOT NULL GROUP BY user_id")
+
+
+def downgrade():
+    op.drop_index(op.f('ix_submitter_accepted'), table_name='submitter')
+    op.drop_table('submitter')
@@ -0,0 +1,36 @@
+"""poll votes total
+
+Revision ID: 1c7e9a4f2b60
+Revises: 0a6d3f8c5e29
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1c7e9a4f2b60'
+down_revision = '0a6d3f8c5e29'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('poll', sa.Column('votes_total', sa.Integer(), nullable=False, server_default=sa.text('0')))
+    # Заполняем количество проголосовавших по голосам, а у замороженных опросов - по сводке
+    op.execute(sa.text("UPDATE poll SET votes_total = "
+                       "(SELECT COUNT(DISTINCT poll_vote.user_id) FROM poll_vote WHERE poll_vote.poll_id = poll.id) "
+                       "WHERE is_final = :is_final").bindparams(is_final=False))
+    op.execute(sa.text("UPDATE poll SET votes_total = "
+                       "(SELECT COALESCE(SUM(poll_option.final_votes), 0) FROM poll_option "
+                       "WHERE poll_option.poll_id = poll.id) "
+                       "WHERE is_final = :is_final").bindparams(is_final=True))
+    op.create_index('ix_poll_votes_total', 'poll', ['votes_total'])
+    op.create_index('ix_poll_created_at', 'poll', ['created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_poll_created_at', 'poll')
+    op.drop_index('ix_poll_votes_total', 'poll')
+    op.drop_column('poll', 'votes_total')
@@ -0,0 +1,38 @@
+"""moderators
+
+Revision ID: 2b8f0d5a6c13
+Revises: 1c7e9a4f2b60
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b8f0d5a6c13'
+down_revision = '1c7e9a4f2b60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('suggestion', sa.Column('moderator_id', sa.BigInteger(), nullable=True))
+    op.add_column('suggestion', sa.Column('assigned_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_suggestion_state_assigned_at', 'suggestion', ['state', 'assigned_at'])
+    op.create_index('ix_suggestion_moderator_id_state', 'suggestion', ['moderator_id', 'state'])
+    # Единственное состояние админа не знает, чье оно: сбрасываем его, а ожидающую эмодзи предложку
+    # возвращаем в новые, чтобы ее можно было рассмотреть заново
+    op.execute("DELETE FROM admin_state")
+    op.execute("UPDATE suggestion SET state = 'new', decision = NULL WHERE state = 'wait'")
+    op.add_column('admin_state', sa.Column('moderator_id', sa.BigInteger(), nullable=True))
+    op.create_index('uq_admin_state_moderator_id', 'admin_state', ['moderator_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_admin_state_moderator_id', 'admin_state')
+    op.drop_column('admin_state', 'moderator_id')
+    op.drop_index('ix_suggestion_moderator_id_state', 'suggestion')
+    op.drop_index('ix_suggestion_state_assigned_at', 'suggestion')
+    op.drop_column('suggestion', 'assigned_at')
+    op.drop_column('suggestion', 'moderator_id')
@@ -0,0 +1,33 @@
+"""poll message
+
+Revision ID: 3d9a6e2c8f47
+Revises: 2b8f0d5a6c13
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3d9a6e2c8f47'
+down_revision = '2b8f0d5a6c13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('poll_message',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('poll_id', sa.Integer(), nullable=True),
+    sa.Column('chat_id', sa.BigInteger(), nullable=True),
+    sa.Column('message_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['poll_id'], ['poll.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_poll_message_poll_id'), 'poll_message', ['poll_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_poll_message_poll_id'), table_name='poll_message')
+    op.drop_table('poll_message')
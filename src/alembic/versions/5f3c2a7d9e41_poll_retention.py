@@ -0,0 +1,32 @@
+"""poll retention
+
+Revision ID: 5f3c2a7d9e41
+Revises: bc4a1c942b0b
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f3c2a7d9e41'
+down_revision = 'bc4a1c942b0b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('poll', sa.Column('created_at', sa.DateTime(), nullable=True))
+    op.add_column('poll', sa.Column('is_final', sa.Boolean(), nullable=False, server_default=sa.text('0')))
+    op.add_column('poll_option', sa.Column('final_votes', sa.Integer(), nullable=True))
+    # Существующим опросам дату создания не восстановить, поэтому отсчитываем горизонт от момента миграции
+    op.execute("UPDATE poll SET created_at = CURRENT_TIMESTAMP")
+    op.create_index('ix_poll_is_final_created_at', 'poll', ['is_final', 'created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_poll_is_final_created_at', 'poll')
+    op.drop_column('poll_option', 'final_votes')
+    op.drop_column('poll', 'is_final')
+    op.drop_column('poll', 'created_at')
@@ -0,0 +1,30 @@
+"""processed update
+
+Revision ID: 8a1e4b6c2d73
+Revises: 5f3c2a7d9e41
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a1e4b6c2d73'
+down_revision = '5f3c2a7d9e41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('processed_update',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index(op.f('ix_processed_update_created_at'), 'processed_update', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_processed_update_created_at'), table_name='processed_update')
+    op.drop_table('processed_update')
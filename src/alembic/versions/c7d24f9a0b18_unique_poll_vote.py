@@ -0,0 +1,28 @@
+"""unique poll vote
+
+Revision ID: c7d24f9a0b18
+Revises: 8a1e4b6c2d73
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d24f9a0b18'
+down_revision = '8a1e4b6c2d73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Оставляем только последний голос пользователя в опросе, как это делал repo.get_vote.
+    # Подзапрос обернут в производную таблицу, иначе MySQL не позволит удалять из той же таблицы
+    op.execute("DELETE FROM poll_vote WHERE id NOT IN ("
+               "SELECT max_id FROM (SELECT MAX(id) AS max_id FROM poll_vote GROUP BY poll_id, user_id) AS last_vote"
+               ")")
+    op.create_index('uq_poll_vote_poll_id_user_id', 'poll_vote', ['poll_id', 'user_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_poll_vote_poll_id_user_id', table_name='poll_vote')
@@ -0,0 +1,28 @@
+"""polling state
+
+Revision ID: d93b5e0c6a2f
+Revises: c7d24f9a0b18
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd93b5e0c6a2f'
+down_revision = 'c7d24f9a0b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('polling_state',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('update_offset', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('polling_state')
@@ -0,0 +1,37 @@
+"""photo hash
+
+Revision ID: e41a7c9b3d58
+Revises: d93b5e0c6a2f
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41a7c9b3d58'
+down_revision = 'd93b5e0c6a2f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('photo_hash',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('hash', sa.String(length=16), nullable=True),
+    sa.Column('suggestion_id', sa.Integer(), nullable=True),
+    sa.Column('channel_post_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_photo_hash_suggestion_id'), 'photo_hash', ['suggestion_id'], unique=False)
+    op.add_column('suggestion', sa.Column('duplicate_post_id', sa.Integer(), nullable=True))
+    op.add_column('suggestion', sa.Column('duplicate_suggestion_id', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('suggestion', 'duplicate_suggestion_id')
+    op.drop_column('suggestion', 'duplicate_post_id')
+    op.drop_index(op.f('ix_photo_hash_suggestion_id'), table_name='photo_hash')
+    op.drop_table('photo_hash')
@@ -0,0 +1,23 @@
+"""suggestion state index
+
+Revision ID: f5b82d1e7a64
+Revises: e41a7c9b3d58
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5b82d1e7a64'
+down_revision = 'e41a7c9b3d58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_suggestion_state_id', 'suggestion', ['state', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_suggestion_state_id', 'suggestion')
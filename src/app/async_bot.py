@@ -0,0 +1,240 @@
+"""
+Асинхронный режим бота
+
+В асинхронном режиме самые частые обновления - нажатия на кнопки опросов и команды `/start`, `/help` -
+обрабатываются корутинами: запросы к Bot API выполняются через асинхронный клиент, а запросы к БД
+через асинхронный движок. Поэтому сотни одновременных обновлений обслуживаются одним процессом
+без потока на каждый запрос. Остальные обновления (предложка и действия админа) редкие и
+передаются синхронным обработчикам из `app.bot`.
+"""
+
+import asyncio
+import time
+from typing import Optional
+
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+from app import config, async_db, async_repo, async_read_repo, metrics, vote_cache
+from app import bot as sync_bot
+from app.logger import logger as app_logger
+from app.messages import t
+from app.updates import UpdateInfo
+from app.utils import TtlCache
+from app.vote_cache import OptionMeta
+
+if config.APP_BOT_PROXY is not None:
+    asyncio_helper.proxy = config.APP_BOT_PROXY
+
+bot = AsyncTeleBot(config.APP_BOT_TOKEN)
+
+__locks = None
+
+
+async def get_channel():
+    """
+    Возвращает канал из кэша информации о боте, админе и канале синхронного бота или из Bot API,
+    см. `app.bot.get_channel`
+    """
+    key = ("chat", config.APP_CHANNEL_ID)
+    channel = sync_bot.identity_cache.peek(key)
+    if channel is TtlCache.MISSING:
+        channel = await bot.get_chat(config.APP_CHANNEL_ID)
+        if channel is None:
+            raise Exception("Channel not found")
+        sync_bot.identity_cache.set(key, channel)
+    return channel
+
+
+@async_db.commit_session
+async def send_help(chat_id: int, session=None):
+    """
+    Отправка помощи, см. `app.bot.send_help`
+
+    :param chat_id: Чат пользователя
+    """
+    channel = await get_channel()
+    await bot.send_message(chat_id,
+                           t("app.bot.message.start",
+                             channel_title=channel.title,
+                             channel_username=channel.username),
+                           parse_mode="HTML")
+
+
+async def rerender_post_votes(poll_id: int):
+    """
+    Обновляет кнопки голосования у всех копий поста, см. `app.bot.rerender_post_votes`
+
+    :param poll_id: Идентификатор опроса
+    """
+    poll = await async_read_repo.get_poll(poll_id)
+    if poll is None:
+        raise Exception("Poll not found")
+    option_votes = await async_read_repo.get_votes_count_by_options(poll)
+    poll_markup = sync_bot.render_post_votes_markup(poll.id, poll.options, option_votes)
+    messages = sync_bot.poll_messages_cache.peek(poll.id)
+    if messages is TtlCache.MISSING:
+        messages = await async_repo.get_poll_messages(poll.id)
+        sync_bot.poll_messages_cache.set(poll.id, messages)
+    if len(messages) == 0:
+        messages = [(config.APP_CHANNEL_ID, poll.message_id)]
+    semaphore = asyncio.Semaphore(config.APP_PUBLISH_WORKERS)
+
+    async def edit(chat_id, message_id):
+        async with semaphore:
+            await bot.edit_message_reply_markup(chat_id, message_id, reply_markup=poll_markup)
+
+    results = await asyncio.gather(*[edit(chat_id, message_id) for chat_id, message_id in messages],
+                                   return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    if len(errors) == len(messages):
+        raise errors[0]
+    for (chat_id, message_id), result in zip(messages, results):
+        if isinstance(result, Exception):
+            app_logger.error("Error during post {} votes rendering in channel {}: {}".format(message_id,
+                                                                                            chat_id,
+                                                                                            str(result)))
+
+
+@async_db.commit_session
+async def load_option_meta(option_id: int, session=None) -> Optional[OptionMeta]:
+    """
+    Загружает метаданные варианта ответа из БД, см. `app.bot.load_option_meta`
+    """
+    return await async_read_repo.get_option_meta(option_id)
+
+
+async def get_option_meta(option_id: int) -> Optional[OptionMeta]:
+    """
+    Возвращает метаданные варианта ответа из кэша или из БД, см. `app.bot.get_option_meta`
+    """
+    option = vote_cache.options.peek(option_id)
+    if option is TtlCache.MISSING:
+        option = await load_option_meta(option_id)
+        if option is not None:
+            vote_cache.options.set(option_id, option)
+    return option
+
+
+@async_db.commit_session
+async def load_user_vote(poll_id: int, user_id: int, session=None) -> Optional[int]:
+    """
+    Загружает из БД вариант ответа, за который проголосовал пользователь, см. `app.bot.load_user_vote`
+    """
+    option_id = await async_read_repo.get_vote_option_id(poll_id, user_id)
+    return option_id if option_id is not None else vote_cache.NO_VOTE
+
+
+@async_db.commit_session
+async def persist_vote(poll_id: int, user_id: int, option_id: int, session=None) -> bool:
+    """
+    Записывает голос пользователя в БД, см. `app.bot.persist_vote`
+    """
+    if option_id == vote_cache.NO_VOTE:
+        return await async_repo.clear_vote(poll_id, user_id)
+    return await async_repo.add_vote(poll_id, option_id, user_id)
+
+
+@async_db.commit_session
+async def refresh_post_votes(poll_id: int, session=None):
+    """
+    Обновляет кнопки голосования у поста в отдельной сессии
+    """
+    await rerender_post_votes(poll_id)
+
+
+def get_user_lock(poll_id: int, user_id: int) -> asyncio.Lock:
+    """
+    Возвращает блокировку пары опрос-пользователь, см. `app.vote_cache.get_user_lock`
+    """
+    global __locks
+    if __locks is None:
+        # Блокировки создаем внутри работающего цикла событий
+        __locks = [asyncio.Lock() for _ in range(vote_cache.LOCK_STRIPES)]
+    return __locks[hash((poll_id, user_id)) % vote_cache.LOCK_STRIPES]
+
+
+async def process_vote(call_id: str, user_id: int, callback_data: dict):
+    """
+    Обработка нажатий на кнопки опроса: сначала ответ на нажатие, потом запись голоса,
+    см. `app.bot.process_vote`
+
+    :param call_id: Идентификатор нажатия
+    :param user_id: Идентификатор пользователя в телеграме
+    :param callback_data: Нагрузка кнопки
+    """
+    started = time.monotonic()
+    try:
+        option = await get_option_meta(callback_data['o'])
+        if option is None:
+            # Ошибка: вариант ответа опроса не найден
+            await bot.answer_callback_query(call_id, t("app.poll.vote.error"))
+            return
+        if option.poll_is_final:
+            # Опрос заморожен: голосование по нему завершено
+            await bot.answer_callback_query(call_id, t("app.poll.vote.closed"))
+            return
+        key = (option.poll_id, user_id)
+        async with get_user_lock(*key):
+            previous_option_id = vote_cache.throttle.peek(key)
+            if previous_option_id is TtlCache.MISSING:
+                previous_option_id = vote_cache.user_votes.peek(key)
+            if previous_option_id is TtlCache.MISSING:
+                previous_option_id = await load_user_vote(*key)
+            if previous_option_id is None:
+                # Ошибка чтения голоса из БД
+                await bot.answer_callback_query(call_id, t("app.poll.vote.error"))
+                return
+            if previous_option_id == option.id:
+                # Пользователь повторно нажал на кнопку - голос отменен
+                option_id = vote_cache.NO_VOTE
+                await bot.answer_callback_query(call_id, t("app.poll.vote.canceled", emoji=option.text))
+            else:
+                # Первый голос или голос за другой вариант
+                option_id = option.id
+                await bot.answer_callback_query(call_id, t("app.poll.vote.voted", emoji=option.text))
+            metrics.observe("vote_ack_seconds", time.monotonic() - started)
+            vote_cache.user_votes.set(key, option_id)
+            if not vote_cache.throttle.hit(key, started):
+                vote_cache.throttle.defer(key, option_id)
+                metrics.inc("votes_throttled")
+                return
+            if not await persist_vote(option.poll_id, user_id, option_id):
+                vote_cache.user_votes.delete(key)
+                vote_cache.options.delete(option.id)
+                return
+        await refresh_post_votes(option.poll_id)
+    except Exception as e:
+        app_logger.error("Error during async vote processing: {}".format(str(e)))
+
+
+def is_async(update: UpdateInfo) -> bool:
+    """
+    Обновление обрабатывается корутиной, а не синхронным обработчиком
+    """
+    return update.callback_action() == sync_bot.ACTION_VOTE or update.command() in ["start", "help"]
+
+
+async def process_update(update: UpdateInfo):
+    """
+    Обрабатывает обновление: частые обновления корутинами, остальные синхронными обработчиками
+
+    :param update: Ключевые поля обновления
+    """
+    if not is_async(update):
+        # Синхронный бот обрабатывает обновления в своем пуле потоков и не блокирует цикл событий
+        sync_bot.bot.process_new_updates([update.to_update()])
+    elif update.callback_action() == sync_bot.ACTION_VOTE:
+        await process_vote(update.callback_query_id, update.user_id, update.callback_data)
+    else:
+        await send_help(update.chat_id)
+
+
+async def close():
+    """
+    Закрывает соединения асинхронного клиента Bot API и асинхронного движка БД
+    """
+    # Сессия клиента создается при первом запросе к Bot API
+    if asyncio_helper.session_manager.session is not None:
+        await bot.close_session()
+    await async_db.dispose()
@@ -0,0 +1,98 @@
+"""
+Асинхронные сессии БД для асинхронного режима бота
+
+Повторяет `app.db`, но работает через асинхронный движок SQLAlchemy. Сессия привязывается
+к текущей задаче asyncio так же, как синхронная сессия привязана к потоку.
+"""
+
+import asyncio
+
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_scoped_session
+from sqlalchemy.orm import sessionmaker
+
+from app import config, db
+from app.logger import logger as app_logger
+
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+}
+"""
+Соответствие синхронных драйверов БД асинхронным
+"""
+
+
+def get_async_database_url(database_url: str):
+    """
+    Заменяет в URL подключения к БД синхронный драйвер на асинхронный
+
+    :param database_url: URL подключения к БД
+    :return: URL подключения через асинхронный драйвер
+    """
+    url = make_url(database_url)
+    if url.drivername not in ASYNC_DRIVERS:
+        raise Exception("Async driver for {} is not supported".format(url.drivername))
+    return url.set(drivername=ASYNC_DRIVERS[url.drivername])
+
+
+__engine = create_async_engine(get_async_database_url(config.APP_DATABASE_URL), pool_pre_ping=True,
+                               **db.get_pool_options(config.APP_DATABASE_URL))
+
+__SessionFactory = sessionmaker(bind=__engine, class_=AsyncSession, expire_on_commit=False)
+
+__Session = async_scoped_session(__SessionFactory, scopefunc=asyncio.current_task)
+
+
+def flush_session(func):
+    """
+    Асинхронный аналог `app.db.flush_session`. Вызывает корутину с дополнительным аргументом
+    `session` и после ее окончания вызывает `flush` сессии.
+
+    :param func: Декорируемая корутина
+    :return:
+    """
+    async def decorated(*args, **kwargs):
+        session = __Session()
+        try:
+            result = await func(*args, session=session, **kwargs)
+            await session.flush()
+            return result
+        except Exception as e:
+            app_logger.error("Error during async flush session: {}".format(str(e)))
+            await session.rollback()
+            raise
+    return decorated
+
+
+def commit_session(func):
+    """
+    Асинхронный аналог `app.db.commit_session`. Должен применяться у корутин самого верхнего уровня,
+    поскольку после окончания работы декорируемой корутины сессия завершается.
+
+    :param func:
+    :return:
+    """
+    async def decorated(*args, **kwargs):
+        session = __Session()
+        try:
+            result = await func(*args, **kwargs, session=session)
+            await session.commit()
+            return result
+        except Exception as e:
+            app_logger.error("Error during async commit session: {}".format(str(e)))
+            await session.rollback()
+        finally:
+            await session.close()
+            await __Session.remove()
+    return decorated
+
+
+async def dispose():
+    """
+    Закрывает соединения асинхронного движка
+    """
+    await __engine.dispose()
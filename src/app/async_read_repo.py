@@ -0,0 +1,49 @@
+"""
+Асинхронное чтение данных для горячих путей, см. `app.read_repo`
+"""
+
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.async_db import flush_session
+from app.read_repo import PollRecord, option_meta_query, poll_query, votes_count_query, vote_option_id_query, \
+    make_option_meta, make_poll, make_votes_count, final_votes_count
+from app.vote_cache import OptionMeta
+
+
+@flush_session
+async def get_option_meta(option_id: int, session: AsyncSession = None) -> Optional[OptionMeta]:
+    """
+    Получить метаданные варианта ответа, см. `app.read_repo.get_option_meta`
+    """
+    result = await session.execute(option_meta_query(option_id))
+    return make_option_meta(result.first())
+
+
+@flush_session
+async def get_poll(poll_id: int, session: AsyncSession = None) -> Optional[PollRecord]:
+    """
+    Получить опрос с вариантами ответа, см. `app.read_repo.get_poll`
+    """
+    result = await session.execute(poll_query(poll_id))
+    return make_poll(result.all())
+
+
+@flush_session
+async def get_votes_count_by_options(poll: PollRecord, session: AsyncSession = None) -> dict:
+    """
+    Возвращает количество голосов по вариантам ответа опроса, см. `app.read_repo.get_votes_count_by_options`
+    """
+    if poll.is_final:
+        return final_votes_count(poll)
+    return make_votes_count(poll, await session.execute(votes_count_query(poll.id)))
+
+
+@flush_session
+async def get_vote_option_id(poll_id: int, user_id: int, session: AsyncSession = None) -> Optional[int]:
+    """
+    Получить вариант ответа, за который проголосовал пользователь, см. `app.read_repo.get_vote_option_id`
+    """
+    result = await session.execute(vote_option_id_query(poll_id, user_id))
+    return result.scalar()
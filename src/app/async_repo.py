@@ -0,0 +1,110 @@
+"""
+Асинхронные операции с базой данных для асинхронного режима бота
+
+Повторяет операции записи `app.repo`, которые нужны асинхронным обработчикам. Чтение для горячих путей
+вынесено в `app.async_read_repo`.
+"""
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.async_db import flush_session
+from app.models import Poll, PollVote, PollMessage
+
+
+@flush_session
+async def lock_open_poll(poll_id: int, session: AsyncSession = None) -> bool:
+    """
+    Блокирует опрос до конца транзакции, если он не заморожен, см. `app.repo.lock_open_poll`
+
+    :param poll_id: Опрос
+    :param session:
+    :return: False, если опрос не найден или заморожен
+    """
+    result = await session.execute(select(Poll.id)
+                                   .where(Poll.id == poll_id)
+                                   .where(Poll.is_final.is_(False))
+                                   .with_for_update())
+    return result.first() is not None
+
+
+@flush_session
+async def clear_vote(poll_id: int, user_id: int, session: AsyncSession = None) -> bool:
+    """
+    Удалить голос пользователя в опросе
+
+    :param poll_id: Опрос
+    :param user_id: Идентификатор пользователя в телеграме
+    :param session:
+    :return: False, если опрос не найден или заморожен
+    """
+    if not await lock_open_poll(poll_id):
+        return False
+    result = await session.execute(PollVote.__table__.delete()
+                                   .where(PollVote.poll_id == poll_id)
+                                   .where(PollVote.user_id == user_id))
+    await change_votes_total(poll_id, -result.rowcount)
+    return True
+
+
+@flush_session
+async def add_vote(poll_id: int, option_id: int, user_id: int, session: AsyncSession = None) -> bool:
+    """
+    Добавить голос пользователя в опрос или перенести существующий голос, см. `app.repo.add_vote`
+
+    :param poll_id: Опрос
+    :param option_id: Вариант ответа
+    :param user_id: Идентификатор пользователя в телеграме
+    :param session:
+    :return: False, если опрос не найден или заморожен
+    """
+    if not await lock_open_poll(poll_id):
+        return False
+    statement = update(PollVote.__table__)\
+        .where(PollVote.poll_id == poll_id)\
+        .where(PollVote.user_id == user_id)\
+        .values(option_id=option_id)
+    result = await session.execute(statement)
+    if result.rowcount > 0:
+        return True
+    try:
+        async with session.begin_nested():
+            await session.execute(PollVote.__table__.insert(),
+                                  {"poll_id": poll_id, "option_id": option_id, "user_id": user_id})
+    except IntegrityError:
+        await session.execute(statement)
+        return True
+    await change_votes_total(poll_id, 1)
+    return True
+
+
+@flush_session
+async def change_votes_total(poll_id: int, delta: int, session: AsyncSession = None):
+    """
+    Изменяет количество проголосовавших в опросе, см. `app.repo.change_votes_totals`
+
+    :param poll_id: Опрос
+    :param delta: Разница
+    :param session:
+    """
+    if delta == 0:
+        return
+    await session.execute(update(Poll.__table__)
+                          .where(Poll.id == poll_id)
+                          .values(votes_total=Poll.votes_total + delta))
+
+
+@flush_session
+async def get_poll_messages(poll_id: int, session: AsyncSession = None) -> list:
+    """
+    Возвращает копии поста с опросом, см. `app.repo.get_poll_messages`
+
+    :param poll_id: Опрос
+    :param session:
+    :return: Массив пар (идентификатор канала, идентификатор поста)
+    """
+    rows = await session.execute(select(PollMessage.chat_id, PollMessage.message_id)
+                                 .filter(PollMessage.poll_id == poll_id)
+                                 .order_by(PollMessage.id))
+    return [(chat_id, message_id) for chat_id, message_id in rows]
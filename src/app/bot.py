@@ -4,16 +4,24 @@
 
 import json
 import logging
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional
 
 from telebot import TeleBot, apihelper, logger
 from telebot.types import Message as TelebotMessage, Chat as TelebotChat, InlineKeyboardMarkup, InlineKeyboardButton, \
     CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from app import config, repo, db, utils
+from app import config, repo, read_repo, db, utils, metrics, vote_cache, photo_hash, memory
+from app.logger import logger as app_logger
 from app.messages import t
 
 # Если конфигурация содержит прокси, то включаем прокси в телеботе
 from app.models import AdminState, Suggestion
-from app.utils import get_full_name
+from app.utils import get_full_name, TtlCache
+from app.vote_cache import OptionMeta
 
 if config.APP_BOT_PROXY is not None:
     apihelper.proxy = {"https": config.APP_BOT_PROXY}
@@ -49,10 +57,53 @@ ADMIN_SUGGESTION_ACTIONS = [ACTION_ACCEPT,
 """
 Админские действия над предложкой
 """
+ACTION_QUEUE = "q"
+"""
+Перелистнуть очередь предложек
+"""
+
 VOTE_ACTIONS = [ACTION_VOTE]
 """
 Действия с голосами
 """
+QUEUE_ACTIONS = [ACTION_QUEUE]
+"""
+Действия с очередью предложек
+"""
+
+QUEUE_PAGE_SIZE = 5
+"""
+Количество предложек на одной странице очереди
+"""
+
+STATS_TOP_SIZE = 10
+"""
+Количество отправителей в статистике
+"""
+
+TOP_POLLS_SIZE = 10
+"""
+Количество постов в рейтинге
+"""
+
+MESSAGE_MAX_LENGTH = 4096
+"""
+Максимальная длина текста сообщения в телеграме
+"""
+
+TOP_PERIODS = {
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+    "all": None,
+}
+"""
+Периоды рейтинга постов: аргумент команды `/top` и длительность периода
+"""
+
+TOP_REBUILD = "rebuild"
+"""
+Аргумент команды `/top` для пересчета рейтинга по голосам
+"""
 
 # Решения админа
 DECISION_ACCEPT = "decision_accept"
@@ -69,13 +120,157 @@ DECISION_DECLINE = "decision_decline"
 """
 
 
+IDENTITY_CACHE_TTL = 600
+"""
+Время жизни кэша информации о боте, админе и канале в секундах
+"""
+
+identity_cache = utils.TtlCache(IDENTITY_CACHE_TTL)
+"""
+Кэш информации о боте, админе и канале: она почти не меняется, а нужна почти в каждом обработчике
+"""
+
+
+EMOJI_SETS_CACHE_TTL = 3600
+"""
+Время жизни кэша последних наборов эмодзи в секундах
+"""
+
+emoji_sets_cache = utils.TtlCache(EMOJI_SETS_CACHE_TTL)
+"""
+Кэш последних использованных наборов эмодзи: сбрасывается при создании опроса
+"""
+
+
+POLL_MESSAGES_CACHE_TTL = 3600
+"""
+Время жизни кэша копий постов с опросом в секундах
+"""
+
+POLL_MESSAGES_CACHE_SIZE = 1000
+"""
+Максимальное количество опросов в кэше копий постов
+"""
+
+poll_messages_cache = utils.TtlCache(POLL_MESSAGES_CACHE_TTL, POLL_MESSAGES_CACHE_SIZE)
+"""
+Кэш копий постов с опросом: копии не меняются после публикации, а нужны при каждом голосе
+"""
+
+__publish_pool = None
+__publish_pool_lock = threading.Lock()
+
+
+def get_publish_pool() -> ThreadPoolExecutor:
+    """
+    Пул потоков для одновременной публикации и обновления кнопок в нескольких каналах
+    """
+    global __publish_pool
+    with __publish_pool_lock:
+        if __publish_pool is None:
+            __publish_pool = ThreadPoolExecutor(config.APP_PUBLISH_WORKERS, thread_name_prefix="publish")
+        return __publish_pool
+
+
+def run_in_channels(channels: list, action) -> list:
+    """
+    Выполняет запрос к Bot API для каждого канала одновременно, не более `APP_PUBLISH_WORKERS` запросов сразу
+
+    :param channels: Каналы
+    :param action: Функция от канала, выполняющая запрос
+    :return: Массив пар (результат, ошибка) в порядке каналов
+    """
+    def run(channel):
+        try:
+            return action(channel), None
+        except Exception as e:
+            return None, e
+
+    if len(channels) == 1:
+        # Один канал: не гоняем запрос через пул
+        return [run(channels[0])]
+    return list(get_publish_pool().map(run, channels))
+
+
 def get_admin_id():
-    chat = bot.get_chat(config.APP_BOT_ADMIN_ID)
+    chat = identity_cache.get(("chat", config.APP_BOT_ADMIN_ID),
+                              lambda: bot.get_chat(config.APP_BOT_ADMIN_ID))
     if chat is None:
         raise Exception("Admin fetching error")
     return chat.id
 
 
+def get_moderator_ids() -> list:
+    """
+    Возвращает идентификаторы чатов модераторов. Первый - админ
+    """
+    moderator_ids = list()
+    for moderator in config.APP_BOT_ADMIN_IDS:
+        chat = identity_cache.get(("chat", moderator), lambda: bot.get_chat(moderator))
+        if chat is None:
+            raise Exception("Moderator fetching error")
+        moderator_ids.append(chat.id)
+    return moderator_ids
+
+
+def is_moderator(chat_id: int) -> bool:
+    """
+    Чат является чатом модератора с ботом
+    """
+    return chat_id in get_moderator_ids()
+
+
+def get_suggestion_moderator_id(suggestion: Suggestion) -> int:
+    """
+    Возвращает чат модератора, в котором находится сообщение предложки. Предложки, присланные
+    до появления модераторов, находятся в чате админа
+    """
+    if suggestion.moderator_id is None:
+        return get_admin_id()
+    return suggestion.moderator_id
+
+
+def choose_moderator(user_id, exclude: int = None) -> Optional[int]:
+    """
+    Выбирает модератора для предложки: наименее загруженного. Среди одинаково загруженных
+    выбор определяется отправителем (rendezvous hashing), поэтому при равной загрузке предложки
+    одного отправителя попадают к одному модератору на всех экземплярах бота
+
+    :param user_id: Отправитель предложки
+    :param exclude: Модератор, которому предложку назначать нельзя
+    :return: Идентификатор чата модератора или None, если выбрать некого
+    """
+    moderator_ids = [moderator_id for moderator_id in get_moderator_ids() if moderator_id != exclude]
+    if len(moderator_ids) == 0:
+        return None
+    if len(moderator_ids) == 1:
+        return moderator_ids[0]
+    loads = repo.get_moderator_loads(moderator_ids)
+    return min(moderator_ids,
+               key=lambda moderator_id: (loads[moderator_id],
+                                         -zlib.crc32("{}:{}".format(moderator_id, user_id).encode("utf-8"))))
+
+
+def send_suggestion_to_moderator(suggestion: Suggestion, moderator_id: int):
+    """
+    Отправляет предложку модератору и назначает ее ему
+
+    :param suggestion: Предложка
+    :param moderator_id: Идентификатор чата модератора
+    """
+    admin_message = render_suggestion_text(suggestion)
+    markup = create_admin_reply_markup(suggestion)
+    suggestion_message = bot.send_photo(moderator_id,
+                                        suggestion.file_id,
+                                        admin_message,
+                                        reply_markup=markup,
+                                        parse_mode="HTML")
+    # Сохраняем модератора и идентификатор сообщения с предложкой
+    suggestion.moderator_id = moderator_id
+    suggestion.assigned_at = datetime.utcnow()
+    suggestion.admin_message_id = suggestion_message.message_id
+
+
 def get_channel():
     """
     Получить канал в который предлагаются посты
@@ -83,12 +278,32 @@ def get_channel():
     :return: Канал, в который предлагаются посты
     :rtype: TelegramChat
     """
-    channel = bot.get_chat(config.APP_CHANNEL_ID)
+    channel = identity_cache.get(("chat", config.APP_CHANNEL_ID),
+                                 lambda: bot.get_chat(config.APP_CHANNEL_ID))
     if channel is None:
         raise Exception("Channel not found")
     return channel
 
 
+def get_me():
+    """
+    Получить информацию о боте
+
+    :return: Бот
+    :rtype: TelebotUser
+    """
+    return identity_cache.get("me", bot.get_me)
+
+
+def get_previous_emoji_sets() -> list:
+    """
+    Возвращает последние использованные наборы эмодзи из кэша или из БД
+
+    :return: Массив строк с набором эмодзи
+    """
+    return emoji_sets_cache.get("emoji_sets", repo.get_previous_emoji_sets)
+
+
 def generate_post_link(message_id) -> str:
     """
     Генерирует ссылку на пост в канале
@@ -103,6 +318,17 @@ def generate_post_link(message_id) -> str:
     }
 
 
+def download_file(file_id: str) -> bytes:
+    """
+    Скачивает файл через Bot API
+
+    :param file_id: Идентификатор файла
+    :return: Содержимое файла
+    """
+    file_info = bot.get_file(file_id)
+    return bot.download_file(file_info.file_path)
+
+
 def render_decision(decision: str) -> str:
     """
     Создает отображение решениения с предложкой
@@ -165,6 +391,14 @@ def render_suggestion_text(suggestion: Suggestion):
             text += t("app.admin.suggestion.forwarded_from.url",
                       forwarded_user_id=suggestion.forwarded_from_username,
                       forwarded_user_title=suggestion.forwarded_from_title)
+    # Если похожий кот уже был, то предупреждаем об этом админа
+    if suggestion.duplicate_post_id is not None:
+        text += "\n\n"
+        text += t("app.admin.suggestion.duplicate.published",
+                  url=generate_post_link(suggestion.duplicate_post_id))
+    elif suggestion.duplicate_suggestion_id is not None:
+        text += "\n\n"
+        text += t("app.admin.suggestion.duplicate.pending")
     # Если по предложке уже есть решение, то отображаем его
     if suggestion.decision is not None:
         text += "\n\n"
@@ -184,10 +418,9 @@ def rerender_suggestion(suggestion: Suggestion, reply_markup: InlineKeyboardMark
     :param suggestion: Предложка
     :param reply_markup Кнопки при необходимости
     """
-    admin_id = get_admin_id()
     suggestion_text = render_suggestion_text(suggestion)
     bot.edit_message_caption(suggestion_text,
-                             admin_id,
+                             get_suggestion_moderator_id(suggestion),
                              suggestion.admin_message_id,
                              parse_mode="HTML",
                              reply_markup=reply_markup)
@@ -240,17 +473,29 @@ def create_post_votes_markup(poll_id):
     :return: Массив кнопок
     :rtype list
     """
-    poll = repo.get_poll(poll_id)
+    poll = read_repo.get_poll(poll_id)
     if poll is None:
         raise Exception("Poll not found")
+    option_votes = read_repo.get_votes_count_by_options(poll)
+    return render_post_votes_markup(poll.id, poll.options, option_votes)
+
+
+def render_post_votes_markup(poll_id: int, options: list, option_votes: dict) -> InlineKeyboardMarkup:
+    """
+    Создает кнопки опроса по уже загруженным вариантам ответа и количеству голосов
+
+    :param poll_id: Идентификатор опроса
+    :param options: Варианты ответа опроса
+    :param option_votes: Количество голосов по вариантам ответа
+    :return: Кнопки опроса
+    """
     buttons = list()
-    option_votes = poll.get_votes_by_options()
-    for poll_option in poll.options:
+    for poll_option in options:
         # Создаем кнопку. В нагрузку сохраняем идентификаторы опроса и варианта ответа
-        btn = InlineKeyboardButton("%s %d" % (poll_option.text, len(option_votes[poll_option.id])),
+        btn = InlineKeyboardButton("%s %d" % (poll_option.text, option_votes[poll_option.id]),
                                    callback_data=json.dumps({
                                        "a": ACTION_VOTE,
-                                       "p": poll.id,
+                                       "p": poll_id,
                                        "o": poll_option.id
                                    }))
         buttons.append(btn)
@@ -259,20 +504,58 @@ def create_post_votes_markup(poll_id):
     return poll_markup
 
 
+def get_poll_messages(poll) -> list:
+    """
+    Возвращает копии поста с опросом во всех каналах
+
+    Опросы, опубликованные до появления нескольких каналов, есть только в основном канале
+
+    :param poll: Опрос
+    :return: Массив пар (идентификатор канала, идентификатор поста)
+    """
+    messages = poll_messages_cache.get(poll.id, lambda: repo.get_poll_messages(poll.id))
+    if len(messages) == 0:
+        return [(config.APP_CHANNEL_ID, poll.message_id)]
+    return messages
+
+
+def edit_post_votes(messages: list, poll_markup: InlineKeyboardMarkup):
+    """
+    Заменяет кнопки голосования у всех копий поста одновременно
+
+    :param messages: Массив пар (идентификатор канала, идентификатор поста)
+    :param poll_markup: Кнопки
+    """
+    results = run_in_channels(messages,
+                              lambda message: bot.edit_message_reply_markup(message[0],
+                                                                            message[1],
+                                                                            reply_markup=poll_markup))
+    errors = [error for _, error in results if error is not None]
+    for (chat_id, message_id), (_, error) in zip(messages, results):
+        if error is not None and len(errors) < len(messages):
+            app_logger.error("Error during post {} votes rendering in channel {}: {}".format(message_id,
+                                                                                            chat_id,
+                                                                                            str(error)))
+    if len(errors) == len(messages):
+        # Не удалось обновить ни одной копии: отдаем ошибку вызывающему как раньше
+        raise errors[0]
+
+
 def rerender_post_votes(poll_id):
     """
-    Обновляет кнопки голосования у поста
+    Обновляет кнопки голосования у всех копий поста. Голоса считаются один раз, а копии
+    обновляются одновременно. Голоса читаются из основной БД: перерисовка идет сразу после
+    коммита голоса, и отстающая реплика вернула бы количество без него
 
     :param poll_id: Идентификатор поста в канале
     :return:
     """
-    poll = repo.get_poll(poll_id)
+    poll = read_repo.get_poll(poll_id, primary=True)
     if poll is None:
         raise Exception("Poll not found")
-    poll_markup = create_post_votes_markup(poll_id)
-    bot.edit_message_reply_markup(config.APP_CHANNEL_ID,
-                                  poll.message_id,
-                                  reply_markup=poll_markup)
+    option_votes = read_repo.get_votes_count_by_options(poll, primary=True)
+    poll_markup = render_post_votes_markup(poll.id, poll.options, option_votes)
+    edit_post_votes(get_poll_messages(poll), poll_markup)
 
 
 def answer_callback_decision(call: CallbackQuery, decision: str):
@@ -295,22 +578,34 @@ def answer_callback_decision(call: CallbackQuery, decision: str):
     bot.answer_callback_query(call.id, resolution_text)
 
 
-def publish_post(file_id: str, reply_markup: InlineKeyboardMarkup = None) -> TelebotMessage:
+def publish_post(file_id: str, reply_markup: InlineKeyboardMarkup = None) -> list:
     """
-    Публикует пост в канале
+    Публикует пост во всех каналах одновременно
+
+    Если не удалось опубликовать в основном канале, выбрасывается ошибка. Ошибки дополнительных
+    каналов только логируются: пост в них просто пропускается
 
     :param file_id: Идентификатор файла
     :param reply_markup: Кнопки опроса или None если не нужны
-    :return: Пост
+    :return: Опубликованные посты, первый - в основном канале
     """
-    me = bot.get_me()
-    channel_post = bot.send_photo(config.APP_CHANNEL_ID,
-                                  file_id,
-                                  caption=t("app.bot.sign",
-                                            bot_username=me.username),
-                                  parse_mode="HTML",
-                                  reply_markup=reply_markup)
-    return channel_post
+    me = get_me()
+    caption = t("app.bot.sign", bot_username=me.username)
+    results = run_in_channels(config.APP_CHANNEL_IDS,
+                              lambda channel: bot.send_photo(channel,
+                                                             file_id,
+                                                             caption=caption,
+                                                             parse_mode="HTML",
+                                                             reply_markup=reply_markup))
+    channel_posts = []
+    for channel, (channel_post, error) in zip(config.APP_CHANNEL_IDS, results):
+        if error is None:
+            channel_posts.append(channel_post)
+        elif channel == config.APP_CHANNEL_ID:
+            raise error
+        else:
+            app_logger.error("Error during publishing to channel {}: {}".format(channel, str(error)))
+    return channel_posts
 
 
 def notify_user_about_publish(suggestion: Suggestion):
@@ -331,6 +626,7 @@ def notify_user_about_publish(suggestion: Suggestion):
 
 
 @bot.message_handler(commands=["start", "help"])
+@db.query_budget(0)
 @db.commit_session
 def send_help(message: TelebotMessage, session=None):
     """
@@ -345,6 +641,7 @@ def send_help(message: TelebotMessage, session=None):
 
 
 @bot.message_handler(commands=['cancel'])
+@db.query_budget(6)
 @db.commit_session
 def catch_cancel_command(message: TelebotMessage, session=None):
     """
@@ -355,12 +652,12 @@ def catch_cancel_command(message: TelebotMessage, session=None):
      и возвращаем предложке кнопки выбора решения
 
     """
-    admin_id = get_admin_id()
-    # Принимаем команду только в чате админа
-    if message.chat.id != admin_id:
+    moderator_id = message.chat.id
+    # Принимаем команду только в чате модератора
+    if not is_moderator(moderator_id):
         return
-    admin_state = repo.get_admin_state()
-    # Если состояние чата админа пустое, ничего не делаем
+    admin_state = repo.get_admin_state(moderator_id)
+    # Если состояние чата модератора пустое, ничего не делаем
     if admin_state is None:
         return
     # Если состояние чата - ожидает кнопки, то отменяем это состояние
@@ -369,25 +666,184 @@ def catch_cancel_command(message: TelebotMessage, session=None):
         suggestion = repo.get_suggestion(admin_state['data']['suggestion_id'])
         if suggestion is None:
             raise Exception("Suggestion not found")
-        repo.clear_admin_state()
+        repo.clear_admin_state(moderator_id)
         reset_suggestion(suggestion)
         # Отправляем сообщение, что операция отменена и удаляем клавиатуру, если есть
-        bot.send_message(admin_id, t("app.bot.admin.cancel"), reply_markup=ReplyKeyboardRemove())
+        bot.send_message(moderator_id, t("app.bot.admin.cancel"), reply_markup=ReplyKeyboardRemove())
+
+
+def render_queue_page(suggestions: list, has_previous: bool, has_next: bool):
+    """
+    Создает текст и кнопки страницы очереди предложек. Кнопки решений переиспользуют
+    действия кнопок самой предложки
+
+    :param suggestions: Предложки страницы
+    :param has_previous: Есть предыдущая страница
+    :param has_next: Есть следующая страница
+    :return: Текст и кнопки
+    """
+    if len(suggestions) == 0:
+        return t("app.admin.queue.empty"), None
+    text = t("app.admin.queue.head")
+    markup = InlineKeyboardMarkup()
+    for suggestion in suggestions:
+        text += "\n"
+        if suggestion.is_new():
+            text += t("app.admin.queue.item.new", id=suggestion.id, user_title=suggestion.user_title)
+            markup.row(*[InlineKeyboardButton(t(key, id=suggestion.id),
+                                              callback_data=json.dumps({'a': action, 's': suggestion.id}))
+                         for action, key in [(ACTION_ACCEPT, "app.admin.queue.button.accept"),
+                                             (ACTION_ACCEPT_WITH_POLL, "app.admin.queue.button.accept_with_poll"),
+                                             (ACTION_DECLINE, "app.admin.queue.button.decline")]])
+        else:
+            text += t("app.admin.queue.item.wait", id=suggestion.id, user_title=suggestion.user_title)
+    navigation = list()
+    if has_previous:
+        navigation.append(InlineKeyboardButton(t("app.admin.queue.button.previous"),
+                                               callback_data=json.dumps({'a': ACTION_QUEUE,
+                                                                         'b': suggestions[0].id})))
+    # Обновить текущую страницу: начинаем с той же предложки
+    navigation.append(InlineKeyboardButton(t("app.admin.queue.button.refresh"),
+                                           callback_data=json.dumps({'a': ACTION_QUEUE,
+                                                                     'n': suggestions[0].id - 1})))
+    if has_next:
+        navigation.append(InlineKeyboardButton(t("app.admin.queue.button.next"),
+                                               callback_data=json.dumps({'a': ACTION_QUEUE,
+                                                                         'n': suggestions[-1].id})))
+    markup.row(*navigation)
+    return text, markup
+
+
+def create_queue_page(moderator_id: int, after_id: int = None, before_id: int = None):
+    """
+    Загружает страницу очереди предложек модератора и создает ее текст и кнопки
+
+    :param moderator_id: Идентификатор чата модератора
+    :param after_id: Страница после указанной предложки
+    :param before_id: Страница перед указанной предложкой
+    :return: Текст и кнопки
+    """
+    suggestions = repo.get_pending_suggestions(moderator_id, QUEUE_PAGE_SIZE, after_id=after_id, before_id=before_id)
+    if len(suggestions) == 0 and before_id is None and after_id is not None:
+        # Страница опустела, пока ее смотрели: показываем очередь с начала
+        suggestions = repo.get_pending_suggestions(moderator_id, QUEUE_PAGE_SIZE)
+    if len(suggestions) == 0:
+        return render_queue_page(suggestions, False, False)
+    has_previous = repo.has_pending_suggestions(moderator_id, before_id=suggestions[0].id)
+    has_next = repo.has_pending_suggestions(moderator_id, after_id=suggestions[-1].id)
+    return render_queue_page(suggestions, has_previous, has_next)
+
+
+@bot.message_handler(commands=['queue'])
+@db.query_budget(5)
+@db.commit_session
+def catch_queue_command(message: TelebotMessage, session=None):
+    """
+    Обработка команды Очередь (`\\\\queue`): показывает модератору назначенные ему предложки,
+    ожидающие решения
+    """
+    moderator_id = message.chat.id
+    # Принимаем команду только в чате модератора
+    if not is_moderator(moderator_id):
+        return
+    text, markup = create_queue_page(moderator_id)
+    bot.send_message(moderator_id, text, parse_mode="HTML", reply_markup=markup)
+
+
+@bot.message_handler(commands=['stats'])
+@db.query_budget(2)
+@db.commit_session
+def catch_stats_command(message: TelebotMessage, session=None):
+    """
+    Обработка команды Статистика (`\\\\stats`): показывает админу отправителей
+    с наибольшим количеством опубликованных котов
+    """
+    moderator_id = message.chat.id
+    # Принимаем команду только в чате модератора
+    if not is_moderator(moderator_id):
+        return
+    submitters = repo.get_top_submitters(STATS_TOP_SIZE)
+    if len(submitters) == 0:
+        bot.send_message(moderator_id, t("app.admin.stats.empty"))
+        return
+    text = t("app.admin.stats.head")
+    for position, submitter in enumerate(submitters, start=1):
+        text += "\n"
+        text += t("app.admin.stats.item",
+                  position=position,
+                  user_id=submitter.user_id,
+                  user_title=submitter.user_title,
+                  submitted=submitter.submitted,
+                  accepted=submitter.accepted,
+                  declined=submitter.declined)
+    bot.send_message(moderator_id, text, parse_mode="HTML")
+
+
+@bot.message_handler(commands=['top'])
+@db.query_budget(3)
+@db.commit_session
+def catch_top_command(message: TelebotMessage, session=None):
+    """
+    Обработка команды Рейтинг (`\\\\top [day|week|all]`): показывает админу посты с наибольшим
+    количеством проголосовавших за период. `\\\\top rebuild` пересчитывает рейтинг по голосам
+    """
+    moderator_id = message.chat.id
+    # Принимаем команду только в чате модератора
+    if not is_moderator(moderator_id):
+        return
+    arguments = message.text.split()[1:]
+    argument = arguments[0].lower() if len(arguments) > 0 else "all"
+    if argument == TOP_REBUILD:
+        repo.rebuild_votes_totals()
+        bot.send_message(moderator_id, t("app.admin.top.rebuilt"))
+        return
+    if argument not in TOP_PERIODS:
+        bot.send_message(moderator_id, t("app.admin.top.usage"))
+        return
+    period = TOP_PERIODS[argument]
+    since = datetime.utcnow() - period if period is not None else None
+    polls = repo.get_top_polls(TOP_POLLS_SIZE, since)
+    if len(polls) == 0:
+        bot.send_message(moderator_id, t("app.admin.top.empty"))
+        return
+    text = t("app.admin.top.head." + argument)
+    for position, poll in enumerate(polls, start=1):
+        text += "\n"
+        text += t("app.admin.top.item",
+                  position=position,
+                  url=generate_post_link(int(poll.message_id)),
+                  date=poll.created_at.strftime("%d.%m.%Y") if poll.created_at is not None else "",
+                  votes=poll.votes_total)
+    bot.send_message(moderator_id, text, parse_mode="HTML", disable_web_page_preview=True)
+
+
+@bot.message_handler(commands=['mem'])
+def catch_memory_command(message: TelebotMessage):
+    """
+    Обработка команды Память (`\\\\mem start|snapshot|top|diff|gc|stop`): профилирование памяти процесса,
+    см. `app.memory`. Доступна только админу
+    """
+    if message.chat.id != get_admin_id():
+        return
+    report = memory.run_command(message.text.split()[1:])
+    bot.send_message(message.chat.id, report[:MESSAGE_MAX_LENGTH])
 
 
 @bot.message_handler(content_types=['text'])
+@db.query_budget(20)
 @db.commit_session
 def catch_text_message(message: TelebotMessage, session=None):
-    admin_id = get_admin_id()
-    if message.chat.id != admin_id:
+    moderator_id = message.chat.id
+    if not is_moderator(moderator_id):
         bot.send_message(message.chat.id, t("app.bot.user.wrong_content"))
-    admin_state = repo.get_admin_state()
+        return
+    admin_state = repo.get_admin_state(moderator_id)
     if admin_state is None:
         # Когда админ в пустом состоянии считаем его обычным пользователем
         bot.send_message(message.chat.id, t("app.bot.user.wrong_content"))
         return
     if admin_state['state'] == AdminState.STATE_WAIT_BUTTONS:
-        suggestion = repo.get_suggestion(admin_state['data']['suggestion_id'])
+        suggestion = repo.get_suggestion(admin_state['data']['suggestion_id'], for_update=True)
         if suggestion is None:
             raise Exception("Suggestion not found")
         # Находим эмодзи в тексте
@@ -399,21 +855,26 @@ def catch_text_message(message: TelebotMessage, session=None):
             return
         # Создаем опрос в БД
         poll = repo.create_poll(emoji_chars)
+        emoji_sets_cache.clear()
         poll_markup = create_post_votes_markup(poll.id)
         # Публикуем пост
-        channel_post = publish_post(suggestion.file_id, poll_markup)
-        # Записываем в опрос идентификатор сообщения в канале
+        channel_posts = publish_post(suggestion.file_id, poll_markup)
+        channel_post = channel_posts[0]
+        # Записываем в опрос идентификатор сообщения в основном канале и копии во всех каналах
         poll.message_id = channel_post.message_id
-        # Очищаем состояние админа
-        repo.clear_admin_state()
+        repo.add_poll_messages(poll.id, [(post.chat.id, post.message_id) for post in channel_posts])
+        # Очищаем состояние модератора
+        repo.clear_admin_state(moderator_id)
         # Отправляем админу отбивку, что пост опубликован + очищаем клавиатуру (предложенные наборы эмодзи)
-        bot.send_message(admin_id,
+        bot.send_message(moderator_id,
                          t("app.bot.admin.poll_posted"),
                          reply_to_message_id=suggestion.admin_message_id,
                          reply_markup=ReplyKeyboardRemove())
         # Обновляем предложку
         suggestion.decision = DECISION_ACCEPT_WITH_POLL
         suggestion.channel_post_id = channel_post.message_id
+        repo.publish_photo_hash(suggestion.id, channel_post.message_id)
+        repo.count_decision(suggestion.user_id, accepted=True)
         rerender_suggestion(suggestion)
         # Отправляем пользователю информацию, что пост опубликован
         notify_user_about_publish(suggestion)
@@ -422,12 +883,18 @@ def catch_text_message(message: TelebotMessage, session=None):
 
 
 @bot.message_handler(content_types=['photo'])
+@db.query_budget(10)
 @db.commit_session
 def catch_photo(message: TelebotMessage, session=None):
     # Проверяем, что сообщение содержит изображение
     if len(message.photo) == 0:
         bot.send_message(message.chat.id, t("app.bot.user.wrong_content"))
         return
+    # Для поиска повторов скачиваем самую маленькую копию фото: для хэша ее достаточно.
+    # Скачивание и подсчет хэша идут в пуле потоков, пока заполняется предложка
+    hash_future = None
+    if photo_hash.is_enabled():
+        hash_future = photo_hash.submit(lambda: download_file(message.photo[0].file_id))
     # Создаем новую предложку
     suggestion = Suggestion()
     suggestion.state = Suggestion.STATE_NEW
@@ -455,22 +922,55 @@ def catch_photo(message: TelebotMessage, session=None):
     # Сохраняем предложку в базе
     session.add(suggestion)
     session.flush()
-    # Создаем текст и кнопки для предложки
-    admin_message = render_suggestion_text(suggestion)
-    markup = create_admin_reply_markup(suggestion)
-    # Отправляем предложку админу
-    suggestion_message = bot.send_photo(config.APP_BOT_ADMIN_ID,
-                                        suggestion.file_id,
-                                        admin_message,
-                                        reply_markup=markup,
-                                        parse_mode="HTML")
-    # Сохраняем идентификатор сообщения с предложкой
-    suggestion.admin_message_id = suggestion_message.message_id
+    repo.count_submission(suggestion.user_id, suggestion.user_username, suggestion.user_title)
+    # Отправляем предложку наименее загруженному модератору
+    send_suggestion_to_moderator(suggestion, choose_moderator(suggestion.user_id))
     # Отправляем пользователю сообщение о том, что его предложка отправлена
     bot.send_message(message.chat.id, t("app.bot.user.posted"))
+    if hash_future is not None:
+        # Хэш не ждем: похожего кота ищем, когда хэш посчитан, а предложка уже в БД
+        suggestion_id = suggestion.id
+        chat_id = message.chat.id
+        db.after_commit(session, lambda: photo_hash.then(
+            hash_future, lambda hash_value: check_duplicate(suggestion_id, chat_id, hash_value)))
+
+
+@db.query_budget(8)
+@db.commit_session
+def check_duplicate(suggestion_id: int, chat_id: int, hash_value: Optional[int], session=None):
+    """
+    Ищет похожего кота среди опубликованных и ожидающих решения и отмечает повтор в сообщении предложки
+    у модератора. С `APP_PHOTO_DUPLICATE_REJECT` повтор сразу отклоняется
+
+    :param suggestion_id: Идентификатор предложки
+    :param chat_id: Чат пользователя, приславшего кота
+    :param hash_value: Хэш фото или None, если его не удалось посчитать
+    """
+    if hash_value is None:
+        return
+    suggestion = repo.get_suggestion(suggestion_id, for_update=True)
+    if suggestion is None:
+        # По предложке уже вынесено решение
+        return
+    duplicate = photo_hash.find_duplicate(hash_value)
+    if duplicate is not None:
+        suggestion.duplicate_post_id = duplicate.channel_post_id
+        suggestion.duplicate_suggestion_id = duplicate.suggestion_id
+        # Если модератор уже публикует кота с опросом, повтор отобразится при следующем обновлении предложки
+        if suggestion.is_new():
+            if config.APP_PHOTO_DUPLICATE_REJECT:
+                suggestion.decision = DECISION_DECLINE
+                rerender_suggestion(suggestion)
+                repo.count_decision(suggestion.user_id, accepted=False)
+                bot.send_message(chat_id, t("app.bot.user.duplicate"))
+                session.delete(suggestion)
+                return
+            rerender_suggestion(suggestion, create_admin_reply_markup(suggestion))
+    photo_hash.add(hash_value, suggestion.id)
 
 
 @bot.message_handler(func=lambda message: True, content_types=None)
+@db.query_budget(0)
 @db.commit_session
 def catch_any_message(message: TelebotMessage, session=None):
     """
@@ -487,6 +987,12 @@ def call_is_on_admin_suggestion(call: CallbackQuery):
     return callback_action in ADMIN_SUGGESTION_ACTIONS
 
 
+def call_is_on_queue(call: CallbackQuery):
+    callback_data = json.loads(call.data)
+    callback_action = callback_data['a']
+    return callback_action in QUEUE_ACTIONS
+
+
 def call_is_on_vote(call: CallbackQuery):
     callback_data = json.loads(call.data)
     callback_action = callback_data['a']
@@ -494,6 +1000,7 @@ def call_is_on_vote(call: CallbackQuery):
 
 
 @bot.callback_query_handler(func=call_is_on_admin_suggestion)
+@db.query_budget(10)
 @db.commit_session
 def call_on_admin_suggestion(call: CallbackQuery, session=None):
     """
@@ -504,11 +1011,15 @@ def call_on_admin_suggestion(call: CallbackQuery, session=None):
     """
     callback_data = json.loads(call.data)
     callback_action = callback_data['a']
+    moderator_id = call.message.chat.id
+    suggestion = repo.get_suggestion(callback_data['s'], for_update=True)
+    if suggestion is None:
+        raise Exception("Suggestion not found")
+    if get_suggestion_moderator_id(suggestion) != moderator_id:
+        # Предложку уже передали другому модератору
+        bot.answer_callback_query(call.id, t("app.bot.admin.error.decision.reassigned"))
+        return
     if callback_action == ACTION_DECLINE:
-        callback_suggestion_id = callback_data['s']
-        suggestion = repo.get_suggestion(callback_suggestion_id)
-        if suggestion is None:
-            raise Exception("Suggestion not found")
         if not suggestion.is_new():
             # Для это действия предложка должна быть только что опубликованной
             bot.answer_callback_query(call.id, t("bot.admin.error.decision.wrong_state"))
@@ -516,26 +1027,27 @@ def call_on_admin_suggestion(call: CallbackQuery, session=None):
         # Обновляем сообщение предложки и удаляем кнопки
         suggestion.decision = DECISION_DECLINE
         rerender_suggestion(suggestion)
+        # Отклоненный кот не считается повтором для следующих предложек
+        repo.delete_photo_hash(suggestion.id)
+        repo.count_decision(suggestion.user_id, accepted=False)
         # Отображаем плашку с отменой
         answer_callback_decision(call, DECISION_DECLINE)
         # После вынесения решения удаляем предложку из базы
         session.delete(suggestion)
         return
     elif callback_action == ACTION_ACCEPT:
-        callback_suggestion_id = callback_data['s']
-        suggestion = repo.get_suggestion(callback_suggestion_id)
-        if suggestion is None:
-            raise Exception("Suggestion not found")
         if not suggestion.is_new():
             # Для это действия предложка должна быть только что опубликованной
             return
         # Отображаем плашку с ответом
         answer_callback_decision(call, DECISION_ACCEPT)
         # Публикуем пост в канале
-        channel_post = publish_post(suggestion.file_id)
+        channel_post = publish_post(suggestion.file_id)[0]
         # Обновляем предложку
         suggestion.decision = DECISION_ACCEPT
         suggestion.channel_post_id = channel_post.message_id
+        repo.publish_photo_hash(suggestion.id, channel_post.message_id)
+        repo.count_decision(suggestion.user_id, accepted=True)
         # Обновляем сообщение предложки и удаляем кнопки
         rerender_suggestion(suggestion)
         # Отправляем пользователю информацию, что пост одобрен
@@ -543,12 +1055,8 @@ def call_on_admin_suggestion(call: CallbackQuery, session=None):
         # После вынесения решения удаляем предложку из базы
         session.delete(suggestion)
     elif callback_action == ACTION_ACCEPT_WITH_POLL:
-        callback_suggestion_id = callback_data['s']
-        suggestion = repo.get_suggestion(callback_suggestion_id)
-        if suggestion is None:
-            raise Exception("Suggestion not found")
-        # Сохраняем состояние чата админа с ботом
-        admin_state = repo.get_admin_state()
+        # Сохраняем состояние чата модератора с ботом
+        admin_state = repo.get_admin_state(moderator_id)
         if admin_state is not None and admin_state['state'] == AdminState.STATE_WAIT_BUTTONS:
             # Если другое сообщение уже ожидает эмодзи от пользователя, то возобновляем
             # кнопки в том сообщении
@@ -556,14 +1064,13 @@ def call_on_admin_suggestion(call: CallbackQuery, session=None):
             if other_suggestion is None:
                 raise Exception("Suggestion not found")
             reset_suggestion(other_suggestion)
-            admin_id = get_admin_id()
             # Отправляем сообщение о том, что предыдущая операция отменена + удаляем кнопки если есть
             # TODO попробовать совместить с /cancel
-            bot.send_message(admin_id,
+            bot.send_message(moderator_id,
                              t("app.bot.admin.previous_action_canceled"),
                              reply_to_message_id=other_suggestion.admin_message_id,
                              reply_markup=ReplyKeyboardRemove())
-        repo.set_admin_state(AdminState.STATE_WAIT_BUTTONS, {"suggestion_id": suggestion.id})
+        repo.set_admin_state(moderator_id, AdminState.STATE_WAIT_BUTTONS, {"suggestion_id": suggestion.id})
         # Показываем плашку о том, что решение принято
         answer_callback_decision(call, DECISION_ACCEPT_WITH_POLL)
         # Удаляем кнопки
@@ -571,7 +1078,7 @@ def call_on_admin_suggestion(call: CallbackQuery, session=None):
         # Отправляем сообщение о том, что ждем эмодзи
         suggested_emoji_set_markup = ReplyKeyboardMarkup()
         # К сообщению прикрепляем последние 5 использованных уникальных наборов эмодзи
-        previous_emoji_sets = repo.get_previous_emoji_sets()
+        previous_emoji_sets = get_previous_emoji_sets()
         for emoji_set in previous_emoji_sets:
             suggested_emoji_set_markup.add(KeyboardButton(emoji_set))
         bot.send_message(call.message.chat.id,
@@ -582,53 +1089,169 @@ def call_on_admin_suggestion(call: CallbackQuery, session=None):
         suggestion.state = Suggestion.STATE_WAIT
 
 
-@bot.callback_query_handler(func=call_is_on_vote)
+@bot.callback_query_handler(func=call_is_on_queue)
+@db.query_budget(5)
 @db.commit_session
-def callback_handler(call: CallbackQuery, session=None):
+def call_on_queue(call: CallbackQuery, session=None):
     """
-    Обработка нажатий на кнопках опроса
+    Перелистывание очереди предложек
 
     :param call:
     :param session:
     """
     callback_data = json.loads(call.data)
-    callback_action = callback_data['a']
-    if callback_action == ACTION_VOTE:
-        # Сценарии голосования:
-        # 1) Первое нажание на кнопку любую кнопку - добавляем голос
-        # 2) Повтороное нажание на кнопку, по которой уже отдан голос - снимаем голос
-        # 3) Нажание на другую кнопку, отличную от той по которой отдан лолос - снимаем голос, добавляем новый
-        user_id = call.from_user.id
-        callback_poll_id = callback_data['p']
-        callback_option_id = callback_data['o']
-        option = repo.get_option(callback_option_id)
+    text, markup = create_queue_page(call.message.chat.id,
+                                     after_id=callback_data.get('n'),
+                                     before_id=callback_data.get('b'))
+    bot.answer_callback_query(call.id)
+    bot.edit_message_text(text,
+                          call.message.chat.id,
+                          call.message.message_id,
+                          parse_mode="HTML",
+                          reply_markup=markup)
+
+
+@bot.callback_query_handler(func=call_is_on_vote)
+def callback_handler(call: CallbackQuery):
+    """
+    Обработка нажатий на кнопках опроса
+
+    :param call:
+    """
+    process_vote(call.id, call.from_user.id, json.loads(call.data))
+
+
+@db.commit_session
+def load_option_meta(option_id: int, session=None) -> Optional[OptionMeta]:
+    """
+    Загружает метаданные варианта ответа из БД
+
+    :param option_id: Идентификатор варианта ответа
+    :param session:
+    :return: Метаданные или None, если вариант ответа не найден
+    """
+    return read_repo.get_option_meta(option_id)
+
+
+def get_option_meta(option_id: int) -> Optional[OptionMeta]:
+    """
+    Возвращает метаданные варианта ответа из кэша или из БД
+
+    :param option_id: Идентификатор варианта ответа
+    :return: Метаданные или None, если вариант ответа не найден
+    """
+    option = vote_cache.options.peek(option_id)
+    if option is TtlCache.MISSING:
+        option = load_option_meta(option_id)
+        if option is not None:
+            vote_cache.options.set(option_id, option)
+    return option
+
+
+@db.commit_session
+def load_user_vote(poll_id: int, user_id: int, session=None) -> Optional[int]:
+    """
+    Загружает из БД вариант ответа, за который проголосовал пользователь
+
+    :param poll_id: Опрос
+    :param user_id: Идентификатор пользователя в телеграме
+    :param session:
+    :return: Идентификатор варианта ответа или `vote_cache.NO_VOTE`
+    """
+    option_id = read_repo.get_vote_option_id(poll_id, user_id)
+    return option_id if option_id is not None else vote_cache.NO_VOTE
+
+
+@db.commit_session
+def persist_vote(poll_id: int, user_id: int, option_id: int, session=None) -> bool:
+    """
+    Записывает голос пользователя в БД
+
+    :param poll_id: Опрос
+    :param user_id: Идентификатор пользователя в телеграме
+    :param option_id: Вариант ответа или `vote_cache.NO_VOTE`, если голос снят
+    :param session:
+    :return: True, если голос записан, и False, если опрос заморожен
+    """
+    if option_id == vote_cache.NO_VOTE:
+        return repo.clear_vote(poll_id, user_id)
+    return repo.add_vote(poll_id, option_id, user_id)
+
+
+@db.commit_session
+def refresh_post_votes(poll_id: int, session=None):
+    """
+    Обновляет кнопки голосования у поста в отдельной сессии
+
+    :param poll_id: Идентификатор опроса
+    :param session:
+    """
+    rerender_post_votes(poll_id)
+
+
+@db.query_budget(11)
+def process_vote(call_id: str, user_id: int, callback_data: dict):
+    """
+    Обработка нажатия на кнопку опроса по ключевым полям нажатия. Вызывается как из обработчика
+    телебота, так и напрямую из вебхука, минуя построение полного объекта обновления
+
+    Сначала пользователю отправляется ответ на нажатие, посчитанный по кэшу вариантов ответа
+    и известному предыдущему голосу пользователя, и только потом голос записывается в БД
+    и обновляются кнопки поста. Время от нажатия до ответа замеряется в метрике `vote_ack_seconds`.
+
+    :param call_id: Идентификатор нажатия
+    :param user_id: Идентификатор пользователя в телеграме
+    :param callback_data: Нагрузка кнопки
+    """
+    if callback_data['a'] != ACTION_VOTE:
+        return
+    # Сценарии голосования:
+    # 1) Первое нажание на кнопку любую кнопку - добавляем голос
+    # 2) Повтороное нажание на кнопку, по которой уже отдан голос - снимаем голос
+    # 3) Нажание на другую кнопку, отличную от той по которой отдан лолос - переносим голос
+    started = time.monotonic()
+    try:
+        option = get_option_meta(callback_data['o'])
         if option is None:
             # Ошибка: вариант ответа опроса не найден
-            bot.answer_callback_query(call.id, t("app.poll.vote.error"))
-            return
-        vote = repo.get_vote(callback_poll_id, user_id)
-        poll = option.poll
-        if vote is None:
-            # Пользователь сделал первый голос
-            repo.add_vote(poll.id, callback_option_id, user_id)
-            bot.answer_callback_query(call.id, t("app.poll.vote.voted", emoji=option.text))
-            rerender_post_votes(poll.id)
+            bot.answer_callback_query(call_id, t("app.poll.vote.error"))
             return
-        elif vote.option.id == option.id:
-            # Пользователь повторно нажал на кнопку - голос отменен
-            repo.clear_vote(poll.id, user_id)
-            bot.answer_callback_query(call.id, t("app.poll.vote.canceled", emoji=option.text))
-            rerender_post_votes(poll.id)
-            return
-        elif vote.option.id != option.id:
-            # Пользователь проголосовал за другой вариант
-            repo.clear_vote(poll.id, user_id)
-            repo.add_vote(poll.id, option.id, user_id)
-            bot.answer_callback_query(call.id, t("app.poll.vote.voted", emoji=option.text))
-            rerender_post_votes(poll.id)
-            return
-        else:
-            # Ошибка: что-то пошло не так
-            bot.answer_callback_query(call.id, t("app.poll.vote.error"))
+        if option.poll_is_final:
+            # Опрос заморожен: голосование по нему завершено
+            bot.answer_callback_query(call_id, t("app.poll.vote.closed"))
             return
-        pass
+        key = (option.poll_id, user_id)
+        # Нажатия одного пользователя обрабатываем по очереди, чтобы голоса записывались в порядке нажатий
+        with vote_cache.get_user_lock(*key):
+            # Итоговый голос сдержанных нажатий новее кэша и БД
+            previous_option_id = vote_cache.throttle.peek(key)
+            if previous_option_id is TtlCache.MISSING:
+                previous_option_id = vote_cache.user_votes.peek(key)
+            if previous_option_id is TtlCache.MISSING:
+                previous_option_id = load_user_vote(*key)
+            if previous_option_id is None:
+                # Ошибка чтения голоса из БД
+                bot.answer_callback_query(call_id, t("app.poll.vote.error"))
+                return
+            if previous_option_id == option.id:
+                option_id = vote_cache.NO_VOTE
+                bot.answer_callback_query(call_id, t("app.poll.vote.canceled", emoji=option.text))
+            else:
+                option_id = option.id
+                bot.answer_callback_query(call_id, t("app.poll.vote.voted", emoji=option.text))
+            metrics.observe("vote_ack_seconds", time.monotonic() - started)
+            vote_cache.user_votes.set(key, option_id)
+            if not vote_cache.throttle.hit(key, started):
+                # Слишком частые нажатия: итоговый голос запишется пакетом, см. `app.vote_throttle`
+                vote_cache.throttle.defer(key, option_id)
+                metrics.inc("votes_throttled")
+                return
+            if not persist_vote(option.poll_id, user_id, option_id):
+                # Голос не записан: кэш больше не соответствует БД, а опрос могли заморозить,
+                # поэтому метаданные варианта ответа перечитаем при следующем нажатии
+                vote_cache.user_votes.delete(key)
+                vote_cache.options.delete(option.id)
+                return
+        refresh_post_votes(option.poll_id)
+    except Exception as e:
+        app_logger.error("Error during vote processing: {}".format(str(e)))
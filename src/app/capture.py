@@ -0,0 +1,205 @@
+"""
+Запись входящих обновлений для воспроизведения
+
+Синтетическая нагрузка не повторяет форму настоящего трафика: всплески голосов сразу после публикации,
+наплывы альбомов. Поэтому входящие обновления можно записывать в журнал и потом воспроизводить
+утилитой `replay.py`. Каждое обновление записывается строкой JSON вместе со временем получения
+в сжатый gzip файл в каталоге `APP_CAPTURE_DIR`. Когда в файл записано `APP_CAPTURE_FILE_SIZE` байт
+несжатого текста, начинается новый файл.
+
+Идентификаторы пользователей и личных чатов заменяются ключевым хэшем от токена бота: один пользователь
+во всем журнале получает один и тот же идентификатор, но настоящий идентификатор по журналу не узнать.
+Имена пользователей заменяются заглушкой, а фамилии и юзернеймы удаляются.
+
+Запись идет в отдельном потоке через ограниченную очередь, чтобы не задерживать обработку. Если очередь
+переполнена, обновление не записывается и считается в метрике `capture_dropped`.
+"""
+
+import atexit
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+from app import config, metrics
+from app.logger import logger as app_logger
+
+
+QUEUE_SIZE = 10000
+"""
+Максимальное количество обновлений, ожидающих записи
+"""
+
+FLUSH_INTERVAL = 1
+"""
+Как часто записанные обновления сбрасываются на диск в секундах
+"""
+
+SCRUBBED_ID_BASE = 10 ** 12
+"""
+Заменные идентификаторы начинаются с этого числа, чтобы не совпадать с настоящими
+"""
+
+USER_KEYS = {"from", "user", "forward_from", "left_chat_member"}
+"""
+Ключи обновления, под которыми лежат пользователи
+"""
+
+CHAT_KEYS = {"chat", "sender_chat", "forward_from_chat"}
+"""
+Ключи обновления, под которыми лежат чаты. Заменяются только идентификаторы личных чатов:
+они совпадают с идентификаторами пользователей
+"""
+
+PERSONAL_FIELDS = ["last_name", "username"]
+"""
+Поля пользователей и личных чатов, которые удаляются из журнала
+"""
+
+SCRUBBED_NAME = "user"
+"""
+Имя, которым заменяются имена пользователей: без имени телебот не разберет пользователя
+"""
+
+
+def scrub_id(value: int) -> int:
+    digest = hmac.new(config.APP_BOT_TOKEN.encode("utf-8"), str(value).encode("utf-8"), hashlib.sha256).hexdigest()
+    return SCRUBBED_ID_BASE + int(digest[:12], 16) % SCRUBBED_ID_BASE
+
+
+def scrub_person(person: dict):
+    if isinstance(person.get("id"), int):
+        person["id"] = scrub_id(person["id"])
+    if "first_name" in person:
+        person["first_name"] = SCRUBBED_NAME
+    for field in PERSONAL_FIELDS:
+        person.pop(field, None)
+
+
+def scrub(value):
+    """
+    Заменяет идентификаторы пользователей и удаляет их имена на месте
+
+    :param value: Обновление или его часть
+    """
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in USER_KEYS and isinstance(item, dict):
+                scrub_person(item)
+            elif key in CHAT_KEYS and isinstance(item, dict) and item.get("type") == "private":
+                scrub_person(item)
+            elif key == "new_chat_members" and isinstance(item, list):
+                for person in item:
+                    scrub_person(person)
+            elif key == "user_id" and isinstance(item, int):
+                value[key] = scrub_id(item)
+            scrub(item)
+    elif isinstance(value, list):
+        for item in value:
+            scrub(item)
+
+
+class CaptureWriter:
+    """
+    Фоновая запись обновлений в сжатые файлы с ротацией по размеру
+    """
+
+    def __init__(self, directory: str, file_size: int):
+        self.directory = directory
+        self.file_size = file_size
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.file = None
+        self.written = 0
+        # Номер файла: при частой ротации время в имени файла может совпасть
+        self.file_number = 0
+        self.thread = None
+
+    def open_file(self):
+        self.file_number += 1
+        name = "updates-{}-{}-{:04d}.jsonl.gz".format(time.strftime("%Y%m%d-%H%M%S"), os.getpid(), self.file_number)
+        self.file = gzip.open(os.path.join(self.directory, name), "wt", encoding="utf-8")
+        self.written = 0
+
+    def close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def write(self, received_at: float, raw: dict):
+        if self.file is None or self.written >= self.file_size:
+            self.close_file()
+            self.open_file()
+        line = json.dumps({"ts": received_at, "update": raw}, ensure_ascii=False) + "\n"
+        self.file.write(line)
+        self.written += len(line)
+
+    def run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                item = False
+            if item is None:
+                self.close_file()
+                return
+            try:
+                if item:
+                    self.write(*item)
+                if self.file is not None and time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                    self.file.flush()
+                    last_flush = time.monotonic()
+            except Exception as e:
+                app_logger.error("Error during update capture: {}".format(str(e)))
+                self.file = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, name="capture", daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        # Дописываем очередь и закрываем файл, чтобы gzip был целым
+        self.queue.put(None)
+        self.thread.join(FLUSH_INTERVAL * 5)
+
+
+__writer = None  # type: Optional[CaptureWriter]
+
+
+def start() -> Optional[CaptureWriter]:
+    """
+    Включает запись обновлений, если задан каталог журнала
+
+    :return: Запись или None, если она выключена
+    """
+    global __writer
+    if config.APP_CAPTURE_DIR is None:
+        return None
+    __writer = CaptureWriter(config.APP_CAPTURE_DIR, config.APP_CAPTURE_FILE_SIZE)
+    __writer.start()
+    return __writer
+
+
+def record(raw: dict):
+    """
+    Ставит входящее обновление в очередь записи. Обновление копируется, поэтому обработчики
+    получают его без изменений
+
+    :param raw: Обновление в виде словаря
+    """
+    if __writer is None:
+        return
+    received_at = time.time()
+    try:
+        scrubbed = json.loads(json.dumps(raw))
+        scrub(scrubbed)
+        __writer.queue.put_nowait((received_at, scrubbed))
+    except queue.Full:
+        metrics.inc("capture_dropped")
@@ -12,6 +12,13 @@ URL-подключения к БД, который можно использов
 if ENV_VAR_DB_URL in os.environ:
     APP_DATABASE_URL = os.environ[ENV_VAR_DB_URL]
 
+APP_DATABASE_READ_URL = None
+"""
+URL-подключения к реплике БД для чтения. Если `None`, то все запросы идут в основную БД
+"""
+if ENV_VAR_DB_READ_URL in os.environ:
+    APP_DATABASE_READ_URL = os.environ[ENV_VAR_DB_READ_URL]
+
 if ENV_VAR_BOT_TOKEN not in os.environ:
     raise Exception("Не задан токен бота")
 APP_BOT_TOKEN = os.environ[ENV_VAR_BOT_TOKEN]
@@ -26,6 +33,15 @@ APP_BOT_ADMIN_ID = os.environ[ENV_VAR_BOT_ADMIN_ID]
 Идентификатор или юзернейм админа, которому пересылается предложка
 """
 
+APP_BOT_ADMIN_IDS = [APP_BOT_ADMIN_ID]
+"""
+Идентификаторы или юзернеймы модераторов, между которыми распределяются предложки. Первый - админ
+"""
+if ENV_VAR_BOT_ADMIN_IDS in os.environ:
+    for moderator in os.environ[ENV_VAR_BOT_ADMIN_IDS].split(","):
+        if moderator.strip() != "" and moderator.strip() not in APP_BOT_ADMIN_IDS:
+            APP_BOT_ADMIN_IDS.append(moderator.strip())
+
 APP_BOT_PROXY = None
 """
 Прокси для бота. Если `None`, то прокси не используется
@@ -40,6 +56,15 @@ APP_CHANNEL_ID = os.environ[ENV_VAR_CHANNEL_ID]
 Идентификатор или юзернейм канала
 """
 
+APP_CHANNEL_IDS = [APP_CHANNEL_ID]
+"""
+Идентификаторы или юзернеймы каналов, в которых публикуются посты. Первый - основной канал
+"""
+if ENV_VAR_CHANNEL_IDS in os.environ:
+    for channel in os.environ[ENV_VAR_CHANNEL_IDS].split(","):
+        if channel.strip() != "" and channel.strip() not in APP_CHANNEL_IDS:
+            APP_CHANNEL_IDS.append(channel.strip())
+
 if ENV_VAR_APP_RUN_METHOD not in os.environ:
     raise Exception("Не задан способ запуска бота")
 APP_RUN_METHOD = os.environ[ENV_VAR_APP_RUN_METHOD]
@@ -51,3 +76,217 @@ if ENV_VAR_LOG_FILENAME not in os.environ:
     APP_LOG_FILENAME = "app.log"
 else:
     APP_LOG_FILENAME = os.environ[ENV_VAR_LOG_FILENAME]
+
+APP_POLL_RETENTION_DAYS = None
+"""
+Горизонт хранения голосов опросов в днях. Если `None`, то опросы не архивируются
+"""
+if ENV_VAR_POLL_RETENTION_DAYS in os.environ:
+    APP_POLL_RETENTION_DAYS = int(os.environ[ENV_VAR_POLL_RETENTION_DAYS])
+
+APP_RETENTION_INTERVAL = 3600
+"""
+Интервал между запусками архивации опросов в секундах
+"""
+if ENV_VAR_RETENTION_INTERVAL in os.environ:
+    APP_RETENTION_INTERVAL = int(os.environ[ENV_VAR_RETENTION_INTERVAL])
+
+APP_RETENTION_BATCH_SIZE = 500
+"""
+Количество голосов, удаляемых за один запрос при архивации
+"""
+if ENV_VAR_RETENTION_BATCH_SIZE in os.environ:
+    APP_RETENTION_BATCH_SIZE = int(os.environ[ENV_VAR_RETENTION_BATCH_SIZE])
+
+APP_RETENTION_BATCH_PAUSE = 0.5
+"""
+Пауза между удалениями пачек голосов в секундах
+"""
+if ENV_VAR_RETENTION_BATCH_PAUSE in os.environ:
+    APP_RETENTION_BATCH_PAUSE = float(os.environ[ENV_VAR_RETENTION_BATCH_PAUSE])
+
+APP_DEDUP_WINDOW_SIZE = 10000
+"""
+Количество идентификаторов обновлений, которые бот помнит для отсева повторных доставок
+"""
+if ENV_VAR_DEDUP_WINDOW_SIZE in os.environ:
+    APP_DEDUP_WINDOW_SIZE = int(os.environ[ENV_VAR_DEDUP_WINDOW_SIZE])
+
+APP_DEDUP_WINDOW_TTL = 600
+"""
+Время в секундах, в течение которого обновление считается повторным
+"""
+if ENV_VAR_DEDUP_WINDOW_TTL in os.environ:
+    APP_DEDUP_WINDOW_TTL = int(os.environ[ENV_VAR_DEDUP_WINDOW_TTL])
+
+APP_DEDUP_SHARED = os.environ.get(ENV_VAR_DEDUP_SHARED) == "1"
+"""
+Хранить обработанные обновления в БД, общей для всех экземпляров бота
+"""
+
+APP_ASYNC = os.environ.get(ENV_VAR_ASYNC) == "1"
+"""
+Асинхронный режим вебхука
+"""
+
+APP_DB_WAIT_TIMEOUT = 60
+"""
+Сколько секунд при старте ждать, пока БД станет доступна
+"""
+if ENV_VAR_DB_WAIT_TIMEOUT in os.environ:
+    APP_DB_WAIT_TIMEOUT = int(os.environ[ENV_VAR_DB_WAIT_TIMEOUT])
+
+APP_POLLING_BATCH_SIZE = 100
+"""
+Максимальное количество обновлений, получаемых одним запросом при поллинге
+"""
+if ENV_VAR_POLLING_BATCH_SIZE in os.environ:
+    APP_POLLING_BATCH_SIZE = int(os.environ[ENV_VAR_POLLING_BATCH_SIZE])
+
+APP_POLLING_TIMEOUT = 30
+"""
+Время ожидания новых обновлений одним запросом при поллинге в секундах
+"""
+if ENV_VAR_POLLING_TIMEOUT in os.environ:
+    APP_POLLING_TIMEOUT = int(os.environ[ENV_VAR_POLLING_TIMEOUT])
+
+APP_POLLING_WORKERS = 4
+"""
+Количество потоков, обрабатывающих обновления при поллинге
+"""
+if ENV_VAR_POLLING_WORKERS in os.environ:
+    APP_POLLING_WORKERS = int(os.environ[ENV_VAR_POLLING_WORKERS])
+
+APP_SNAPSHOT_FILE = None
+"""
+Путь к файлу снимка кэшей процесса. Если `None`, то снимки не сохраняются
+"""
+if ENV_VAR_SNAPSHOT_FILE in os.environ:
+    APP_SNAPSHOT_FILE = os.environ[ENV_VAR_SNAPSHOT_FILE]
+
+APP_SNAPSHOT_INTERVAL = 60
+"""
+Интервал сохранения снимка кэшей в секундах
+"""
+if ENV_VAR_SNAPSHOT_INTERVAL in os.environ:
+    APP_SNAPSHOT_INTERVAL = int(os.environ[ENV_VAR_SNAPSHOT_INTERVAL])
+
+APP_SNAPSHOT_MAX_AGE = 600
+"""
+Максимальный возраст снимка кэшей в секундах, при котором он загружается при старте
+"""
+if ENV_VAR_SNAPSHOT_MAX_AGE in os.environ:
+    APP_SNAPSHOT_MAX_AGE = int(os.environ[ENV_VAR_SNAPSHOT_MAX_AGE])
+
+APP_PHOTO_HASH = os.environ.get(ENV_VAR_PHOTO_HASH) == "1"
+"""
+Искать повторы среди присланных фото
+"""
+
+APP_PHOTO_HASH_DISTANCE = 7
+"""
+Максимальное количество различающихся бит перцептивных хэшей, при котором фото считаются повтором
+"""
+if ENV_VAR_PHOTO_HASH_DISTANCE in os.environ:
+    APP_PHOTO_HASH_DISTANCE = int(os.environ[ENV_VAR_PHOTO_HASH_DISTANCE])
+
+APP_PHOTO_HASH_WORKERS = 2
+"""
+Количество потоков, в которых скачиваются фото и считаются их хэши
+"""
+if ENV_VAR_PHOTO_HASH_WORKERS in os.environ:
+    APP_PHOTO_HASH_WORKERS = int(os.environ[ENV_VAR_PHOTO_HASH_WORKERS])
+
+APP_PHOTO_DUPLICATE_REJECT = os.environ.get(ENV_VAR_PHOTO_DUPLICATE_REJECT) == "1"
+"""
+Отклонять повторы сразу, не отправляя их админу
+"""
+
+APP_MODERATION_TIMEOUT = 3600
+"""
+Сколько секунд предложка может ждать решения модератора, прежде чем ее передадут другому модератору
+"""
+if ENV_VAR_MODERATION_TIMEOUT in os.environ:
+    APP_MODERATION_TIMEOUT = int(os.environ[ENV_VAR_MODERATION_TIMEOUT])
+
+APP_PUBLISH_WORKERS = 4
+"""
+Сколько запросов публикации и обновления кнопок в разные каналы выполняется одновременно
+"""
+if ENV_VAR_PUBLISH_WORKERS in os.environ:
+    APP_PUBLISH_WORKERS = int(os.environ[ENV_VAR_PUBLISH_WORKERS])
+
+APP_VOTE_THROTTLE_LIMIT = 3
+"""
+Сколько нажатий одного пользователя на кнопки одного опроса в окне обрабатывается сразу. `0` - без ограничения
+"""
+if ENV_VAR_VOTE_THROTTLE_LIMIT in os.environ:
+    APP_VOTE_THROTTLE_LIMIT = int(os.environ[ENV_VAR_VOTE_THROTTLE_LIMIT])
+
+APP_VOTE_THROTTLE_WINDOW = 5.0
+"""
+Длина скользящего окна подсчета нажатий в секундах
+"""
+if ENV_VAR_VOTE_THROTTLE_WINDOW in os.environ:
+    APP_VOTE_THROTTLE_WINDOW = float(os.environ[ENV_VAR_VOTE_THROTTLE_WINDOW])
+
+APP_CAPTURE_DIR = None
+"""
+Каталог журнала входящих обновлений. Если `None`, то обновления не записываются
+"""
+if ENV_VAR_CAPTURE_DIR in os.environ:
+    APP_CAPTURE_DIR = os.environ[ENV_VAR_CAPTURE_DIR]
+
+APP_CAPTURE_FILE_SIZE = 64 * 1024 * 1024
+"""
+Сколько байт несжатого текста записывается в один файл журнала
+"""
+if ENV_VAR_CAPTURE_FILE_SIZE in os.environ:
+    APP_CAPTURE_FILE_SIZE = int(os.environ[ENV_VAR_CAPTURE_FILE_SIZE])
+
+APP_QUERY_BUDGET_STRICT = os.environ.get(ENV_VAR_QUERY_BUDGET_STRICT) == "1"
+"""
+Выбрасывать исключение, если обработчик превысил бюджет запросов к БД
+"""
+
+APP_DATABASE_POOL_SIZE = None
+"""
+Сколько подключений к БД держат все процессы бота вместе. Если `None`, то размер пула по умолчанию
+"""
+if ENV_VAR_DB_POOL_SIZE in os.environ:
+    APP_DATABASE_POOL_SIZE = int(os.environ[ENV_VAR_DB_POOL_SIZE])
+
+APP_WEBHOOK_WORKERS = 1
+"""
+Количество процессов, обслуживающих вебхук
+"""
+if ENV_VAR_WEBHOOK_WORKERS in os.environ:
+    APP_WEBHOOK_WORKERS = int(os.environ[ENV_VAR_WEBHOOK_WORKERS])
+
+APP_WEBHOOK_FORWARD_PORT = 8500
+"""
+Первый внутренний порт пересылки обновлений между процессами вебхука
+"""
+if ENV_VAR_WEBHOOK_FORWARD_PORT in os.environ:
+    APP_WEBHOOK_FORWARD_PORT = int(os.environ[ENV_VAR_WEBHOOK_FORWARD_PORT])
+
+APP_SPOOL_DIR = None
+"""
+Каталог надежного журнала входящих обновлений вебхука. Если `None`, то журнал не ведется
+"""
+if ENV_VAR_SPOOL_DIR in os.environ:
+    APP_SPOOL_DIR = os.environ[ENV_VAR_SPOOL_DIR]
+
+APP_SPOOL_SEGMENT_SIZE = 16 * 1024 * 1024
+"""
+Размер файла журнала обновлений в байтах, после которого начинается новый файл
+"""
+if ENV_VAR_SPOOL_SEGMENT_SIZE in os.environ:
+    APP_SPOOL_SEGMENT_SIZE = int(os.environ[ENV_VAR_SPOOL_SEGMENT_SIZE])
+
+APP_SPOOL_WORKERS = 4
+"""
+Количество потоков, обрабатывающих обновления из журнала
+"""
+if ENV_VAR_SPOOL_WORKERS in os.environ:
+    APP_SPOOL_WORKERS = int(os.environ[ENV_VAR_SPOOL_WORKERS])
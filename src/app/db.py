@@ -1,21 +1,181 @@
 """
 Низкоуровневые взаимодействия с базой данных. Сессии
+
+Если задан `APP_DATABASE_READ_URL`, то функции, отмеченные `read_session`, читают из реплики через
+отдельный пул подключений и не конкурируют с записью голосов за подключения и блокировки основной БД.
+Если в текущей единице работы (сессии `commit_session`) уже что-то записано, чтение идет из основной БД,
+чтобы функция увидела записанное. Для SQLite репликой служит тот же файл: основная БД переводится
+в режим WAL, а чтение идет через подключения только для чтения, которые не блокируют запись.
+
+Запросы к БД считаются отдельно в каждом потоке. Обработчики обновлений объявляют бюджет запросов
+декоратором `query_budget`. Если обработчик выполнил больше запросов, это логируется и считается
+в метрике `query_budget_exceeded`, а при `APP_QUERY_BUDGET_STRICT` выбрасывается исключение.
 """
 
+import functools
+import os
+import threading
 from contextlib import contextmanager
-from sqlalchemy import create_engine
+from typing import Callable
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import sessionmaker, scoped_session
 
-from app import config
+from app import config, metrics
 from app.logger import logger as app_logger
 
 
-__engine = create_engine(config.APP_DATABASE_URL, pool_pre_ping=True)
+WROTE = "wrote"
+"""
+Ключ в `Session.info`: в сессии уже выполнялась запись
+"""
+
+
+def is_sqlite(database_url: str) -> bool:
+    return make_url(database_url).get_backend_name() == "sqlite"
+
+
+def create_read_engine(database_url: str):
+    """
+    Создает движок для чтения из реплики. К файлу SQLite подключается только для чтения
+
+    :param database_url: URL-подключения к реплике
+    """
+    if not is_sqlite(database_url):
+        return create_engine(database_url, pool_pre_ping=True, **get_pool_options(database_url))
+    path = os.path.abspath(make_url(database_url).database)
+    return create_engine("sqlite:///file:{}?mode=ro&uri=true".format(path))
+
+
+def get_pool_options(database_url: str) -> dict:
+    """
+    Параметры пула подключений процесса. `APP_DATABASE_POOL_SIZE` делится поровну между процессами вебхука,
+    чтобы все процессы вместе не открыли больше подключений. У SQLite пула нет
+    """
+    if config.APP_DATABASE_POOL_SIZE is None or is_sqlite(database_url):
+        return dict()
+    processes = config.APP_WEBHOOK_WORKERS if config.APP_RUN_METHOD == "webhook" else 1
+    return {"pool_size": max(1, config.APP_DATABASE_POOL_SIZE // processes), "max_overflow": 0}
+
+
+def enable_wal(dbapi_connection, connection_record):
+    # Режим WAL хранится в самом файле БД, но включить его может только пишущее подключение
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+__engine = create_engine(config.APP_DATABASE_URL, pool_pre_ping=True, **get_pool_options(config.APP_DATABASE_URL))
 
 __SessionFactory = sessionmaker(bind=__engine)
 
 __Session = scoped_session(__SessionFactory)
 
+__read_engine = None
+
+__ReadSession = None
+
+if config.APP_DATABASE_READ_URL is not None:
+    if is_sqlite(config.APP_DATABASE_URL):
+        event.listen(__engine, "connect", enable_wal)
+    __read_engine = create_read_engine(config.APP_DATABASE_READ_URL)
+    __ReadSession = scoped_session(sessionmaker(bind=__read_engine))
+
+
+__statements = threading.local()
+
+
+def count_statement(connection, cursor, statement, parameters, context, executemany):
+    __statements.count = getattr(__statements, "count", 0) + 1
+
+
+event.listen(__engine, "before_cursor_execute", count_statement)
+if __read_engine is not None:
+    event.listen(__read_engine, "before_cursor_execute", count_statement)
+
+
+def get_statement_count() -> int:
+    """
+    Возвращает количество запросов к БД, выполненных текущим потоком с его запуска
+    """
+    return getattr(__statements, "count", 0)
+
+
+class QueryBudgetExceeded(Exception):
+    """
+    Обработчик выполнил больше запросов к БД, чем объявлено в его бюджете
+    """
+
+
+def query_budget(limit: int):
+    """
+    Декоратор, объявляющий максимальное количество запросов к БД за один вызов функции.
+    Применяется поверх `commit_session`, чтобы учитывался и сам коммит
+
+    :param limit: Максимальное количество запросов
+    :return:
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def decorated(*args, **kwargs):
+            started = get_statement_count()
+            result = func(*args, **kwargs)
+            used = get_statement_count() - started
+            if used > limit:
+                metrics.inc("query_budget_exceeded")
+                message = "Query budget of {} exceeded: {} of {} statements".format(func.__name__, used, limit)
+                app_logger.error(message)
+                if config.APP_QUERY_BUDGET_STRICT:
+                    raise QueryBudgetExceeded(message)
+            return result
+        decorated.query_budget = limit
+        return decorated
+    return decorator
+
+
+@event.listens_for(__SessionFactory, "after_flush")
+def mark_flushed(session, flush_context):
+    session.info[WROTE] = True
+
+
+@event.listens_for(__SessionFactory, "do_orm_execute")
+def mark_executed(orm_execute_state):
+    # Пакетные INSERT, UPDATE и DELETE идут мимо flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info[WROTE] = True
+
+
+def ping():
+    """
+    Проверяет подключение к БД. Если БД недоступна, выбрасывает исключение
+    """
+    with __engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+
+def get_engine():
+    """
+    Возвращает движок БД приложения
+    """
+    return __engine
+
+
+def reset_after_fork():
+    """
+    Забывает подключения, унаследованные от родительского процесса, не закрывая их.
+    Вызывается в процессе сразу после fork
+    """
+    __engine.dispose(close=False)
+    if __read_engine is not None:
+        __read_engine.dispose(close=False)
+
+
+def get_read_engine():
+    """
+    Возвращает движок для чтения: реплику, если она задана, иначе основную БД
+    """
+    return __read_engine if __read_engine is not None else __engine
+
 
 @contextmanager
 def get_flush_session():
@@ -38,12 +198,52 @@ def flush_session(func):
     :param func: Декорируемая функция
     :return:
     """
+    @functools.wraps(func)
     def decorated(*args, **kwargs):
         with get_flush_session() as session:
             return func(*args, session=session, **kwargs)
     return decorated
 
 
+def has_writes(session) -> bool:
+    """
+    В сессии есть записанные или ожидающие записи изменения
+    """
+    return session.info.get(WROTE, False) or len(session.new) > 0 or len(session.dirty) > 0 \
+        or len(session.deleted) > 0
+
+
+def read_session(func):
+    """
+    Декоратор для функций, которые только читают из БД. Вызывает функцию с дополнительным аргументом
+    `session`: сессией реплики, если она задана и в текущей единице работы еще ничего не записано,
+    иначе сессией основной БД, как `flush_session`. Сессия реплики закрывается сразу после функции,
+    поэтому функция должна возвращать данные, которые не подгружаются лениво.
+
+    Вызов с `primary=True` всегда читает из основной БД: так читают данные, только что записанные
+    в уже закоммиченной сессии, которые реплика могла еще не получить.
+
+    :param func: Декорируемая функция
+    :return:
+    """
+    @functools.wraps(func)
+    def decorated(*args, primary: bool = False, **kwargs):
+        if __ReadSession is None or primary or has_writes(__Session()):
+            with get_flush_session() as session:
+                return func(*args, session=session, **kwargs)
+        session = __ReadSession()
+        try:
+            return func(*args, session=session, **kwargs)
+        except Exception as e:
+            app_logger.error("Error during read session: {}".format(str(e)))
+            raise
+        finally:
+            # Подключение сразу возвращается в пул: чтения не держат транзакцию на реплике
+            session.close()
+            __ReadSession.remove()
+    return decorated
+
+
 @contextmanager
 def get_commit_session():
     session = __Session()
@@ -69,7 +269,18 @@ def commit_session(func):
     :param func:
     :return:
     """
+    @functools.wraps(func)
     def decorated(*args, **kwargs):
         with get_commit_session() as session:
             return func(*args, **kwargs, session=session)
     return decorated
+
+
+def after_commit(session, callback: Callable[[], None]):
+    """
+    Вызывает функцию после успешного коммита сессии. Если сессия откатится, функция не вызывается
+
+    :param session: Сессия текущей единицы работы
+    :param callback: Функция без аргументов
+    """
+    event.listen(session, "after_commit", lambda committed_session: callback(), once=True)
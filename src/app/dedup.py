@@ -0,0 +1,206 @@
+"""
+Отсев повторно доставленных обновлений
+
+Если вебхук отвечает медленно, телеграм доставляет то же обновление повторно. Обработчики
+не идемпотентны: повторная обработка приводит к дублям предложки у админа и к отмене голоса
+пользователя. Поэтому перед обработкой ключи обновления проверяются по окну недавно
+обработанных обновлений. Обновление отмечается до обработки, то есть обрабатывается не более одного раза.
+
+Записи журнала обновлений `app.spool` проверяются через `mark_after_processing`: обновление отмечается
+только после обработки. Иначе запись, которую обрабатывали в момент падения, после перезапуска отсеялась бы
+как повтор по отметке в общей БД или в окне из снимка. Повторные доставки одного обновления попадают
+к одному потоку-читателю журнала и обрабатываются по очереди, поэтому проверка до обработки их отсеивает.
+
+В цикле событий вебхука используется `is_duplicate_async`: окно в памяти проверяется прямо в цикле,
+а отметка в общей БД при `APP_DEDUP_SHARED` выполняется в пуле потоков и не задерживает другие соединения.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable
+
+from app import config, db, repo
+
+
+SHARED_CLEANUP_INTERVAL = 60
+"""
+Интервал очистки устаревших отметок в БД в секундах
+"""
+
+
+def get_update_keys(update: dict) -> list:
+    """
+    Возвращает ключи обновления: идентификатор обновления и, для нажатий на кнопки,
+    идентификатор нажатия, который не меняется при повторной доставке
+
+    :param update: Обновление в виде словаря
+    :return: Массив ключей
+    """
+    keys = list()
+    if "update_id" in update:
+        keys.append("u:%d" % update["update_id"])
+    callback_query = update.get("callback_query")
+    if callback_query is not None and "id" in callback_query:
+        keys.append("c:%s" % callback_query["id"])
+    return keys
+
+
+class UpdateWindow:
+    """
+    Ограниченное окно недавно обработанных ключей обновлений. Ключи вытесняются
+    по возрасту и при превышении размера окна
+    """
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float):
+        while len(self._keys) > 0:
+            key, seen_at = next(iter(self._keys.items()))
+            if len(self._keys) <= self.size and now - seen_at <= self.ttl:
+                break
+            del self._keys[key]
+
+    def check_and_add(self, keys: list) -> bool:
+        """
+        Проверяет, что ни один из ключей еще не встречался, и запоминает ключи
+
+        :param keys: Ключи обновления
+        :return: True, если обновление новое
+        """
+        now = time.monotonic()
+        with self._lock:
+            is_new = all(key not in self._keys or now - self._keys[key] > self.ttl for key in keys)
+            for key in keys:
+                self._keys[key] = now
+                self._keys.move_to_end(key)
+            self._evict(now)
+            return is_new
+
+    def contains(self, keys: list) -> bool:
+        """
+        Проверяет, что хотя бы один из ключей уже встречался, не запоминая ключи
+
+        :param keys: Ключи обновления
+        """
+        now = time.monotonic()
+        with self._lock:
+            return any(key in self._keys and now - self._keys[key] <= self.ttl for key in keys)
+
+    def dump(self) -> list:
+        """
+        Возвращает ключи окна вместе с их возрастом
+
+        :return: Массив пар (ключ, возраст в секундах)
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [(key, now - seen_at) for key, seen_at in self._keys.items() if now - seen_at <= self.ttl]
+
+    def load(self, entries: list):
+        """
+        Загружает ключи в окно с сохранением их возраста
+
+        :param entries: Массив пар (ключ, возраст в секундах) от старых к новым
+        """
+        now = time.monotonic()
+        with self._lock:
+            for key, age in entries:
+                self._keys[key] = now - age
+                self._keys.move_to_end(key)
+            self._evict(now)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+window = UpdateWindow(config.APP_DEDUP_WINDOW_SIZE, config.APP_DEDUP_WINDOW_TTL)
+"""
+Окно обработанных обновлений текущего процесса
+"""
+
+__last_shared_cleanup = 0.0
+
+
+@db.commit_session
+def _mark_shared(keys: list, session=None) -> bool:
+    global __last_shared_cleanup
+    now = time.monotonic()
+    if now - __last_shared_cleanup > SHARED_CLEANUP_INTERVAL:
+        __last_shared_cleanup = now
+        repo.delete_processed_updates(datetime.utcnow() - timedelta(seconds=config.APP_DEDUP_WINDOW_TTL))
+    return repo.mark_updates_processed(keys)
+
+
+def is_duplicate(update: dict) -> bool:
+    """
+    Проверяет, что обновление уже обрабатывалось, и отмечает его обработанным
+
+    :param update: Обновление в виде словаря
+    :return: True, если обновление нужно пропустить
+    """
+    keys = get_update_keys(update)
+    if len(keys) == 0:
+        return False
+    if not window.check_and_add(keys):
+        return True
+    if config.APP_DEDUP_SHARED:
+        # При ошибке БД сессия откатывается и возвращается None: такое обновление обрабатываем
+        return _mark_shared(keys) is False
+    return False
+
+
+async def is_duplicate_async(update: dict) -> bool:
+    """
+    Проверяет, что обновление уже обрабатывалось, и отмечает его обработанным, не блокируя цикл событий,
+    см. `is_duplicate`
+
+    :param update: Обновление в виде словаря
+    :return: True, если обновление нужно пропустить
+    """
+    keys = get_update_keys(update)
+    if len(keys) == 0:
+        return False
+    if not window.check_and_add(keys):
+        return True
+    if config.APP_DEDUP_SHARED:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, _mark_shared, keys) is False
+    return False
+
+
+@db.commit_session
+def _has_shared(keys: list, session=None) -> bool:
+    return repo.has_processed_updates(keys)
+
+
+def mark_after_processing(process: Callable) -> Callable:
+    """
+    Оборачивает функцию обработки обновления: повтор проверяется до обработки, а обновление отмечается
+    обработанным только после нее. Если процесс упадет посреди обработки, отметки не останется,
+    и после перезапуска обновление обработается заново
+
+    :param process: Функция обработки обновления, принимает `updates.UpdateInfo`
+    :return: Функция с той же сигнатурой
+    """
+    def process_once(update):
+        keys = get_update_keys(update.raw)
+        if len(keys) == 0:
+            process(update)
+            return
+        # При ошибке БД сессия откатывается и возвращается None: такое обновление обрабатываем
+        if window.contains(keys) or (config.APP_DEDUP_SHARED and _has_shared(keys) is True):
+            return
+        try:
+            process(update)
+        finally:
+            window.check_and_add(keys)
+            if config.APP_DEDUP_SHARED:
+                _mark_shared(keys)
+    return process_once
@@ -11,6 +11,15 @@ URL-подключения к БД, который можно использов
 ```sqlite:///../data/db.db```
 """
 
+ENV_VAR_DB_READ_URL = "APP_DATABASE_READ_URL"
+"""
+URL-подключения к реплике БД, в которую направляются запросы только на чтение. Для SQLite можно указать
+тот же файл, что и в `APP_DATABASE_URL`: тогда чтение идет через отдельные подключения только для чтения,
+а БД переводится в режим WAL
+
+**Необязательная**: Если не задана, то все запросы идут в основную БД
+"""
+
 ENV_VAR_BOT_TOKEN = "APP_BOT_TOKEN"
 """
 Переменная окружения содержащая токен бота
@@ -48,3 +57,253 @@ ENV_VAR_LOG_FILENAME = "APP_LOG_FILENAME"
 """
 Путь к файлу-логу
 """
+
+ENV_VAR_POLL_RETENTION_DAYS = "APP_POLL_RETENTION_DAYS"
+"""
+Горизонт хранения голосов опросов в днях. Опросы старше горизонта замораживаются: количество голосов
+по вариантам сохраняется в сводку, а сами голоса удаляются
+
+**Необязательная**: Если не задана, то опросы хранятся вечно
+"""
+
+ENV_VAR_RETENTION_INTERVAL = "APP_RETENTION_INTERVAL"
+"""
+Интервал между запусками архивации опросов в секундах
+
+**Необязательная**: По умолчанию `3600`
+"""
+
+ENV_VAR_RETENTION_BATCH_SIZE = "APP_RETENTION_BATCH_SIZE"
+"""
+Количество голосов, удаляемых за один запрос при архивации
+
+**Необязательная**: По умолчанию `500`
+"""
+
+ENV_VAR_RETENTION_BATCH_PAUSE = "APP_RETENTION_BATCH_PAUSE"
+"""
+Пауза между удалениями пачек голосов в секундах, чтобы не нагружать БД
+
+**Необязательная**: По умолчанию `0.5`
+"""
+
+ENV_VAR_DEDUP_WINDOW_SIZE = "APP_DEDUP_WINDOW_SIZE"
+"""
+Количество идентификаторов обновлений, которые бот помнит, чтобы не обрабатывать повторно доставленные обновления
+
+**Необязательная**: По умолчанию `10000`
+"""
+
+ENV_VAR_DEDUP_WINDOW_TTL = "APP_DEDUP_WINDOW_TTL"
+"""
+Время в секундах, в течение которого обновление считается повторным
+
+**Необязательная**: По умолчанию `600`
+"""
+
+ENV_VAR_DEDUP_SHARED = "APP_DEDUP_SHARED"
+"""
+Хранить обработанные обновления в БД, чтобы несколько экземпляров бота не обрабатывали одно обновление дважды
+
+**Необязательная**: По умолчанию выключено. Включается значением `1`
+"""
+
+ENV_VAR_ASYNC = "APP_ASYNC"
+"""
+Асинхронный режим вебхука: нажатия на кнопки опросов и команды помощи обрабатываются корутинами
+через асинхронные клиент Bot API и движок БД
+
+**Необязательная**: По умолчанию выключено. Включается значением `1`. Работает только при запуске через webhook
+"""
+
+ENV_VAR_DB_WAIT_TIMEOUT = "APP_DB_WAIT_TIMEOUT"
+"""
+Сколько секунд при старте ждать, пока БД станет доступна
+
+**Необязательная**: По умолчанию `60`
+"""
+
+ENV_VAR_POLLING_BATCH_SIZE = "APP_POLLING_BATCH_SIZE"
+"""
+Максимальное количество обновлений, получаемых одним запросом при поллинге
+
+**Необязательная**: По умолчанию `100`
+"""
+
+ENV_VAR_POLLING_TIMEOUT = "APP_POLLING_TIMEOUT"
+"""
+Время ожидания новых обновлений одним запросом при поллинге в секундах
+
+**Необязательная**: По умолчанию `30`
+"""
+
+ENV_VAR_POLLING_WORKERS = "APP_POLLING_WORKERS"
+"""
+Количество потоков, обрабатывающих обновления при поллинге
+
+**Необязательная**: По умолчанию `4`
+"""
+
+ENV_VAR_SNAPSHOT_FILE = "APP_SNAPSHOT_FILE"
+"""
+Путь к файлу снимка кэшей процесса. Снимок сохраняется периодически и при остановке, а при старте
+загружается, чтобы бот не начинал работу с пустыми кэшами
+
+**Необязательная**: Если не задана, то снимки не сохраняются
+"""
+
+ENV_VAR_SNAPSHOT_INTERVAL = "APP_SNAPSHOT_INTERVAL"
+"""
+Интервал сохранения снимка кэшей в секундах
+
+**Необязательная**: По умолчанию `60`
+"""
+
+ENV_VAR_SNAPSHOT_MAX_AGE = "APP_SNAPSHOT_MAX_AGE"
+"""
+Максимальный возраст снимка кэшей в секундах, при котором он загружается при старте
+
+**Необязательная**: По умолчанию `600`
+"""
+
+ENV_VAR_PHOTO_HASH = "APP_PHOTO_HASH"
+"""
+Искать среди присланных фото повторы уже опубликованных и ожидающих решения котов.
+Требуется установленный `Pillow`
+
+**Необязательная**: Если `1`, то поиск включен
+"""
+
+ENV_VAR_PHOTO_HASH_DISTANCE = "APP_PHOTO_HASH_DISTANCE"
+"""
+Максимальное количество различающихся бит перцептивных хэшей, при котором фото считаются повтором
+
+**Необязательная**: По умолчанию `7`
+"""
+
+ENV_VAR_PHOTO_HASH_WORKERS = "APP_PHOTO_HASH_WORKERS"
+"""
+Количество потоков, в которых скачиваются фото и считаются их хэши
+
+**Необязательная**: По умолчанию `2`
+"""
+
+ENV_VAR_PHOTO_DUPLICATE_REJECT = "APP_PHOTO_DUPLICATE_REJECT"
+"""
+Отклонять повторы сразу, не отправляя их админу
+
+**Необязательная**: Если `1`, то повторы отклоняются, иначе отмечаются в предложке
+"""
+
+ENV_VAR_BOT_ADMIN_IDS = "APP_BOT_ADMIN_IDS"
+"""
+Идентификаторы или юзернеймы дополнительных модераторов через запятую. Предложки распределяются
+между админом и модераторами
+
+**Необязательная**: Если не задана, то все предложки получает админ
+"""
+
+ENV_VAR_MODERATION_TIMEOUT = "APP_MODERATION_TIMEOUT"
+"""
+Сколько секунд предложка может ждать решения модератора, прежде чем ее передадут другому модератору
+
+**Необязательная**: По умолчанию `3600`
+"""
+
+ENV_VAR_CHANNEL_IDS = "APP_CHANNEL_IDS"
+"""
+Идентификаторы или юзернеймы дополнительных каналов через запятую. Одобренные посты публикуются
+во всех каналах, а голоса у копий поста общие
+
+**Необязательная**: Если не задана, то посты публикуются только в основном канале
+"""
+
+ENV_VAR_PUBLISH_WORKERS = "APP_PUBLISH_WORKERS"
+"""
+Сколько запросов публикации и обновления кнопок в разные каналы выполняется одновременно
+
+**Необязательная**: По умолчанию `4`
+"""
+
+ENV_VAR_VOTE_THROTTLE_LIMIT = "APP_VOTE_THROTTLE_LIMIT"
+"""
+Сколько нажатий одного пользователя на кнопки одного опроса в окне обрабатывается сразу.
+Остальные нажатия получают ответ из памяти, а в БД записывается только итоговый голос.
+`0` выключает сдерживание
+
+**Необязательная**: По умолчанию `3`
+"""
+
+ENV_VAR_VOTE_THROTTLE_WINDOW = "APP_VOTE_THROTTLE_WINDOW"
+"""
+Длина скользящего окна подсчета нажатий в секундах
+
+**Необязательная**: По умолчанию `5`
+"""
+
+ENV_VAR_CAPTURE_DIR = "APP_CAPTURE_DIR"
+"""
+Каталог журнала входящих обновлений для воспроизведения утилитой `replay.py`
+
+**Необязательная**: Если не задана, то обновления не записываются
+"""
+
+ENV_VAR_CAPTURE_FILE_SIZE = "APP_CAPTURE_FILE_SIZE"
+"""
+Сколько байт несжатого текста записывается в один файл журнала, прежде чем начнется новый
+
+**Необязательная**: По умолчанию `67108864`
+"""
+
+ENV_VAR_QUERY_BUDGET_STRICT = "APP_QUERY_BUDGET_STRICT"
+"""
+Если установлена в `1`, то обработчик, превысивший бюджет запросов к БД, выбрасывает исключение.
+Удобно при локальной проверке и воспроизведении трафика
+
+**Необязательная**: По умолчанию превышение только логируется
+"""
+
+ENV_VAR_DB_POOL_SIZE = "APP_DATABASE_POOL_SIZE"
+"""
+Сколько подключений к БД держат все процессы бота вместе. В режиме вебхука делится поровну
+между процессами-обработчиками. Для SQLite не используется
+
+**Необязательная**: По умолчанию у каждого процесса пул SQLAlchemy по умолчанию
+"""
+
+ENV_VAR_WEBHOOK_WORKERS = "APP_WEBHOOK_WORKERS"
+"""
+Количество процессов, обслуживающих вебхук
+
+**Необязательная**: По умолчанию `1`
+"""
+
+ENV_VAR_WEBHOOK_FORWARD_PORT = "APP_WEBHOOK_FORWARD_PORT"
+"""
+Первый внутренний порт, на котором процессы вебхука принимают обновления друг от друга.
+Процесс с номером `n` слушает порт `APP_WEBHOOK_FORWARD_PORT + n` на `127.0.0.1`
+
+**Необязательная**: По умолчанию `8500`
+"""
+
+ENV_VAR_SPOOL_DIR = "APP_SPOOL_DIR"
+"""
+Каталог надежного журнала входящих обновлений вебхука. Вебхук отвечает телеграму, как только
+обновление записано в журнал, а обрабатывается оно потоками-читателями журнала
+
+**Необязательная**: Если не задана, то обновления обрабатываются без журнала
+"""
+
+ENV_VAR_SPOOL_SEGMENT_SIZE = "APP_SPOOL_SEGMENT_SIZE"
+"""
+Размер файла журнала обновлений в байтах, после которого начинается новый файл
+
+**Необязательная**: По умолчанию `16777216`
+"""
+
+ENV_VAR_SPOOL_WORKERS = "APP_SPOOL_WORKERS"
+"""
+Количество потоков, обрабатывающих обновления из журнала
+
+**Необязательная**: По умолчанию `4`
+"""
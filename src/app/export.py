@@ -0,0 +1,139 @@
+"""
+Выгрузка результатов опросов
+
+Результаты выгружаются потоково: запрос выполняется с курсором на стороне сервера, строки читаются
+пачками по `EXPORT_CHUNK_SIZE`, и каждая пачка сразу превращается в кусок текста CSV или JSONL.
+Поэтому выгрузка миллионов голосов занимает постоянный объем памяти, а куски можно сразу
+отправлять в файл или в HTTP-ответ.
+"""
+
+import csv
+import io
+import json
+
+from sqlalchemy import select, func, distinct, case
+
+from app import db
+from app.models import Poll, PollOption, PollVote
+
+
+EXPORT_CHUNK_SIZE = 1000
+"""
+Количество строк, читаемых из БД и превращаемых в текст за один раз
+"""
+
+KIND_POLLS = "polls"
+"""
+Опросы и варианты ответа с количеством голосов
+"""
+KIND_VOTES = "votes"
+"""
+Отдельные голоса
+"""
+
+FORMAT_CSV = "csv"
+FORMAT_JSONL = "jsonl"
+
+CONTENT_TYPES = {
+    FORMAT_CSV: "text/csv",
+    FORMAT_JSONL: "application/x-ndjson",
+}
+"""
+Типы содержимого выгрузки по формату
+"""
+
+
+def polls_query():
+    """
+    Запрос опросов с вариантами ответа и количеством голосов по каждому варианту.
+    У замороженных опросов количество берется из сводки
+    """
+    counts = select(PollVote.option_id, func.count(distinct(PollVote.user_id)).label("votes"))\
+        .group_by(PollVote.option_id)\
+        .subquery()
+    votes = case((Poll.is_final, PollOption.final_votes), else_=func.coalesce(counts.c.votes, 0))
+    return select(Poll.id.label("poll_id"),
+                  Poll.message_id,
+                  Poll.created_at,
+                  Poll.is_final,
+                  PollOption.id.label("option_id"),
+                  PollOption.text.label("option_text"),
+                  votes.label("votes"))\
+        .select_from(Poll)\
+        .join(PollOption, PollOption.poll_id == Poll.id)\
+        .outerjoin(counts, counts.c.option_id == PollOption.id)\
+        .order_by(Poll.id, PollOption.id)
+
+
+def votes_query():
+    """
+    Запрос отдельных голосов
+    """
+    return select(PollVote.poll_id, PollVote.option_id, PollVote.user_id)\
+        .order_by(PollVote.id)
+
+
+QUERIES = {
+    KIND_POLLS: polls_query,
+    KIND_VOTES: votes_query,
+}
+"""
+Запросы выгрузки по виду
+"""
+
+
+def serialize(value):
+    # Даты выгружаем в ISO 8601, чтобы CSV и JSONL совпадали
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def render_csv(columns: list, rows: list, with_header: bool) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if with_header:
+        writer.writerow(columns)
+    writer.writerows([[serialize(value) for value in row] for row in rows])
+    return buffer.getvalue()
+
+
+def render_jsonl(columns: list, rows: list, with_header: bool) -> str:
+    return "".join(json.dumps({column: serialize(value) for column, value in zip(columns, row)},
+                              ensure_ascii=False) + "\n"
+                   for row in rows)
+
+
+RENDERERS = {
+    FORMAT_CSV: render_csv,
+    FORMAT_JSONL: render_jsonl,
+}
+"""
+Функции превращения пачки строк в текст по формату
+"""
+
+
+def export(kind: str, export_format: str):
+    """
+    Выгружает результаты опросов по кускам
+
+    :param kind: Что выгружать: `polls` или `votes`
+    :param export_format: Формат: `csv` или `jsonl`
+    :return: Генератор кусков текста
+    """
+    if kind not in QUERIES:
+        raise ValueError("Unknown export kind: {}".format(kind))
+    if export_format not in RENDERERS:
+        raise ValueError("Unknown export format: {}".format(export_format))
+    render = RENDERERS[export_format]
+    # Выгрузка читает много строк, поэтому идет из реплики, если она задана
+    with db.get_read_engine().connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(QUERIES[kind]())
+        columns = list(result.keys())
+        with_header = True
+        for rows in result.partitions(EXPORT_CHUNK_SIZE):
+            yield render(columns, rows, with_header)
+            with_header = False
+        if with_header and export_format == FORMAT_CSV:
+            # Пустая выгрузка: отдаем хотя бы заголовок
+            yield render(columns, [], True)
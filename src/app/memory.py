@@ -0,0 +1,197 @@
+"""
+Профилирование памяти работающего процесса
+
+Трассировка выделений памяти `tracemalloc` включается и выключается по команде, без перезапуска.
+Снимки выделений хранятся в памяти процесса, последние `MAX_SNAPSHOTS` штук: по снимку можно узнать
+места с наибольшим объемом выделенной памяти, а по двум снимкам - где память выросла между ними.
+Отдельно считаются объекты, которые видит сборщик мусора, по типам: так видно, например, что в памяти
+скопились голоса опросов или объекты сессий.
+
+Команды одинаковы для команды бота `/mem` и адреса `/<токен бота>/memory` в режиме вебхука.
+"""
+
+import gc
+import threading
+import tracemalloc
+from collections import Counter
+
+from app.messages import t
+
+
+DEFAULT_FRAMES = 5
+"""
+Глубина стека, сохраняемого для каждого выделения памяти, по умолчанию
+"""
+
+MAX_SNAPSHOTS = 4
+"""
+Сколько последних снимков хранится
+"""
+
+DEFAULT_LIMIT = 15
+"""
+Количество строк отчета по умолчанию
+"""
+
+MAX_LIMIT = 50
+"""
+Максимальное количество строк отчета: отчет должен поместиться в одно сообщение
+"""
+
+KEY_TYPES = ["lineno", "filename", "traceback"]
+"""
+Способы группировки выделений памяти в отчете
+"""
+
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+"""
+Выделения памяти самим профилированием и импортом модулей в отчет не попадают
+"""
+
+__lock = threading.Lock()
+__snapshots = list()
+__snapshot_number = 0
+
+
+def format_size(size: int) -> str:
+    return "%.1f KiB" % (size / 1024)
+
+
+def parse_limit(arguments: list, position: int) -> int:
+    if len(arguments) > position and arguments[position].isdigit():
+        return max(1, min(int(arguments[position]), MAX_LIMIT))
+    return DEFAULT_LIMIT
+
+
+def start(arguments: list) -> str:
+    frames = int(arguments[0]) if len(arguments) > 0 and arguments[0].isdigit() else DEFAULT_FRAMES
+    if tracemalloc.is_tracing():
+        return t("app.admin.memory.already_started", frames=tracemalloc.get_traceback_limit())
+    tracemalloc.start(max(1, frames))
+    return t("app.admin.memory.started", frames=tracemalloc.get_traceback_limit())
+
+
+def stop(arguments: list) -> str:
+    with __lock:
+        __snapshots.clear()
+    tracemalloc.stop()
+    return t("app.admin.memory.stopped")
+
+
+def take_snapshot() -> tuple:
+    """
+    Снимает и сохраняет снимок выделений памяти
+
+    :return: Пара (номер снимка, снимок)
+    """
+    global __snapshot_number
+    snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+    with __lock:
+        __snapshot_number += 1
+        __snapshots.append((__snapshot_number, snapshot))
+        del __snapshots[:-MAX_SNAPSHOTS]
+        return __snapshot_number, snapshot
+
+
+def find_snapshot(number: int):
+    with __lock:
+        for snapshot_number, snapshot in __snapshots:
+            if snapshot_number == number:
+                return snapshot
+    return None
+
+
+def snapshot(arguments: list) -> str:
+    if not tracemalloc.is_tracing():
+        return t("app.admin.memory.not_started")
+    number, _ = take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    return t("app.admin.memory.snapshot", number=number, current=format_size(current), peak=format_size(peak))
+
+
+def render_stats(stats: list, limit: int, key_type: str) -> str:
+    lines = list()
+    for stat in stats[:limit]:
+        lines.append(str(stat))
+        if key_type == "traceback":
+            lines.extend("    " + line for line in stat.traceback.format())
+    return "\n".join(lines)
+
+
+def top(arguments: list) -> str:
+    """
+    Места с наибольшим объемом выделенной памяти по последнему снимку: `top [количество] [группировка]`
+    """
+    if not tracemalloc.is_tracing():
+        return t("app.admin.memory.not_started")
+    key_type = arguments[1] if len(arguments) > 1 and arguments[1] in KEY_TYPES else "lineno"
+    with __lock:
+        latest = __snapshots[-1] if len(__snapshots) > 0 else None
+    if latest is None:
+        latest = take_snapshot()
+    number, latest_snapshot = latest
+    stats = latest_snapshot.statistics(key_type)
+    return t("app.admin.memory.top", number=number) + "\n" + render_stats(stats, parse_limit(arguments, 0), key_type)
+
+
+def diff(arguments: list) -> str:
+    """
+    Рост памяти между двумя снимками: `diff [первый второй]`, по умолчанию между двумя последними
+    """
+    if not tracemalloc.is_tracing():
+        return t("app.admin.memory.not_started")
+    if len(arguments) >= 2 and arguments[0].isdigit() and arguments[1].isdigit():
+        first_number, second_number = int(arguments[0]), int(arguments[1])
+    else:
+        with __lock:
+            if len(__snapshots) < 2:
+                return t("app.admin.memory.no_snapshots")
+            first_number, second_number = __snapshots[-2][0], __snapshots[-1][0]
+    first, second = find_snapshot(first_number), find_snapshot(second_number)
+    if first is None or second is None:
+        return t("app.admin.memory.no_snapshots")
+    stats = second.compare_to(first, "lineno")
+    limit = parse_limit(arguments, 2)
+    return t("app.admin.memory.diff", first=first_number, second=second_number) + "\n" + \
+        "\n".join(str(stat) for stat in stats[:limit])
+
+
+def gc_counts(arguments: list) -> str:
+    """
+    Количество объектов, которые видит сборщик мусора, по типам: `gc [количество]`
+    """
+    counts = Counter(type(value).__name__ for value in gc.get_objects())
+    lines = ["%s %d" % (name, number) for name, number in counts.most_common(parse_limit(arguments, 0))]
+    return t("app.admin.memory.gc",
+             total=sum(counts.values()),
+             garbage=len(gc.garbage),
+             generations=" / ".join(str(number) for number in gc.get_count())) + "\n" + "\n".join(lines)
+
+
+COMMANDS = {
+    "start": start,
+    "stop": stop,
+    "snapshot": snapshot,
+    "top": top,
+    "diff": diff,
+    "gc": gc_counts,
+}
+"""
+Команды профилирования
+"""
+
+
+def run_command(arguments: list) -> str:
+    """
+    Выполняет команду профилирования
+
+    :param arguments: Название команды и ее аргументы
+    :return: Отчет
+    """
+    if len(arguments) == 0 or arguments[0] not in COMMANDS:
+        return t("app.admin.memory.usage")
+    return COMMANDS[arguments[0]](arguments[1:])
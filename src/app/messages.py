@@ -1,6 +1,8 @@
 import emoji
 import i18n
+import yaml
 from i18n import t as _t
+from i18n.translator import TranslationFormatter
 
 
 # Устанавливаем язык
@@ -9,10 +11,72 @@ i18n.set('locale', 'ru')
 i18n.set('skip_locale_root_data', True)
 i18n.load_path.append('app/translations')
 
+TRANSLATIONS_FILE = 'app/translations/app.ru.yml'
+"""
+Файл сообщений приложения
+"""
 
-def t(*args, **kwargs):
+UNCACHED_ARGUMENTS = ("count", "locale", "default")
+"""
+Аргументы `i18n.t`, меняющие выбор перевода: с ними шаблон из кэша не подходит
+"""
+
+__templates = dict()
+
+
+def get_template(key: str) -> TranslationFormatter:
+    """
+    Возвращает шаблон сообщения с уже преобразованными эмодзи-кодами. Шаблоны кэшируются,
+    поэтому эмодзи-коды преобразуются один раз на сообщение, а не при каждой отправке
+
+    :param key: Ключ сообщения
+    :return: Шаблон сообщения
     """
-    Функция получения сообщений, дополнительно преобразующая найденные в тексте эмодзи-коды в эмодзи
+    template = __templates.get(key)
+    if template is None:
+        template = TranslationFormatter(emoji.emojize(_t(key)))
+        __templates[key] = template
+    return template
+
+
+def t(key: str, *args, **kwargs):
+    """
+    Функция получения сообщений, дополнительно преобразующая найденные в тексте эмодзи-коды в эмодзи.
+    Эмодзи-коды в подставленных значениях тоже преобразуются. Вызовы с `count`, `locale`, `default`
+    или дополнительными позиционными аргументами идут мимо кэша шаблонов прямо в `i18n.t`
     :return: Сообщение
     """
-    return emoji.emojize(_t(*args, **kwargs))
+    if len(args) > 0 or any(name in kwargs for name in UNCACHED_ARGUMENTS):
+        return emoji.emojize(_t(key, *args, **kwargs))
+    text = get_template(key).format(**kwargs)
+    if any(isinstance(value, str) and ":" in value for value in kwargs.values()):
+        # Значение может содержать эмодзи-код: преобразуем еще раз весь текст, как без кэша
+        text = emoji.emojize(text)
+    return text
+
+
+def get_keys(tree: dict, prefix: str) -> list:
+    """
+    Возвращает ключи всех сообщений дерева переводов
+
+    :param tree: Дерево переводов
+    :param prefix: Префикс ключей
+    :return: Массив ключей
+    """
+    keys = list()
+    for name, value in tree.items():
+        if isinstance(value, dict):
+            keys.extend(get_keys(value, prefix + name + "."))
+        else:
+            keys.append(prefix + name)
+    return keys
+
+
+def warm_up():
+    """
+    Заранее загружает и кэширует шаблоны всех сообщений приложения
+    """
+    with open(TRANSLATIONS_FILE, encoding="utf-8") as translations_file:
+        tree = yaml.safe_load(translations_file)
+    for key in get_keys(tree, "app."):
+        get_template(key)
@@ -0,0 +1,101 @@
+"""
+Метрики приложения
+
+Простые счетчики и замеры времени, которые хранятся в памяти процесса и отдаются
+в текстовом виде через эндпоинт метрик вебхука.
+"""
+
+import threading
+from collections import deque
+
+
+SUMMARY_WINDOW = 1000
+"""
+Количество последних замеров, по которым считаются перцентили
+"""
+
+
+class Summary:
+    """
+    Сводка замеров: количество, сумма, максимум и перцентили по последним замерам
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=SUMMARY_WINDOW)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def quantile(self, q: float) -> float:
+        """
+        Перцентиль по последним замерам
+
+        :param q: Перцентиль от 0 до 1
+        """
+        if len(self.recent) == 0:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+
+__lock = threading.Lock()
+__counters = dict()
+__summaries = dict()
+
+
+def inc(name: str, value: int = 1):
+    """
+    Увеличивает счетчик
+
+    :param name: Имя счетчика
+    :param value: На сколько увеличить
+    """
+    with __lock:
+        __counters[name] = __counters.get(name, 0) + value
+
+
+def observe(name: str, value: float):
+    """
+    Добавляет замер в сводку
+
+    :param name: Имя сводки
+    :param value: Значение замера, для времени - в секундах
+    """
+    with __lock:
+        summary = __summaries.get(name)
+        if summary is None:
+            summary = Summary()
+            __summaries[name] = summary
+        summary.observe(value)
+
+
+def get_counter(name: str) -> int:
+    """
+    Возвращает значение счетчика
+    """
+    with __lock:
+        return __counters.get(name, 0)
+
+
+def render() -> str:
+    """
+    Возвращает все метрики в текстовом виде: по одной метрике в строке
+    """
+    lines = list()
+    with __lock:
+        for name in sorted(__counters.keys()):
+            lines.append("%s %d" % (name, __counters[name]))
+        for name in sorted(__summaries.keys()):
+            summary = __summaries[name]
+            lines.append("%s_count %d" % (name, summary.count))
+            lines.append("%s_sum %f" % (name, summary.total))
+            lines.append("%s_max %f" % (name, summary.max))
+            for q in [0.5, 0.9, 0.99]:
+                lines.append("%s{quantile=\"%s\"} %f" % (name, q, summary.quantile(q)))
+    return "\n".join(lines) + "\n"
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, ForeignKey, String, Text, Boolean
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, BigInteger, ForeignKey, String, Text, Boolean, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -18,6 +20,14 @@ class Suggestion(Base):
     переиспользование кода.
     """
     __tablename__ = "suggestion"
+    __table_args__ = (
+        # Для постраничного просмотра очереди предложек
+        Index("ix_suggestion_state_id", "state", "id"),
+        # Для поиска предложек, которые модератор долго не рассматривает
+        Index("ix_suggestion_state_assigned_at", "state", "assigned_at"),
+        # Для подсчета загрузки модераторов
+        Index("ix_suggestion_moderator_id_state", "moderator_id", "state"),
+    )
 
     id = Column(Integer, primary_key=True)
     state = Column(String(30))
@@ -35,12 +45,20 @@ class Suggestion(Base):
     forwarded_from_id = Column(String(255))
     forwarded_from_username = Column(String(255))
     forwarded_from_title = Column(String(255))
-    # Идентификатор предложки в чате админа с ботом
+    # Модератор, которому назначена предложка: идентификатор его чата с ботом
+    moderator_id = Column(BigInteger)
+    # Дата назначения модератора
+    assigned_at = Column(DateTime)
+    # Идентификатор предложки в чате модератора с ботом
     admin_message_id = Column(Integer)
     # Решение
     decision = Column(String(30))
     # Идентификатор поста в канале
     channel_post_id = Column(Integer)
+    # Похожий кот уже опубликован: идентификатор поста в канале
+    duplicate_post_id = Column(Integer)
+    # Похожий кот ожидает решения: идентификатор предложки
+    duplicate_suggestion_id = Column(Integer)
 
     STATE_NEW = "new"
     """
@@ -93,37 +111,29 @@ class Poll(Base):
     Опрос
     """
     __tablename__ = "poll"
+    __table_args__ = (
+        Index("ix_poll_is_final_created_at", "is_final", "created_at"),
+        # Для рейтинга постов
+        Index("ix_poll_votes_total", "votes_total"),
+        Index("ix_poll_created_at", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True)
     # Идентификатор сообщения c опросом в телеграме
     message_id = Column(String(255))
-    options = relationship("PollOption", cascade="all, delete-orphan")
-    votes = relationship("PollVote", cascade="all, delete-orphan")
-
-    def get_unique_votes(self):
-        """
-        Возвращем только последние голоса пользователя
-
-        :return:
-        """
-        unique = dict()
-        for vote in self.votes:
-            unique[vote.user_id] = vote
-        vts = list(unique.values())
-        return vts
-
-    def get_votes_by_options(self):
-        """
-        Получаем словарь голосов по вариантам ответа
-        :return:
-        """
-        unique_votes = self.get_unique_votes()
-        result = dict()
-        for option in self.options:
-            result[option.id] = list()
-        for vote in unique_votes:
-            result[vote.option_id].append(vote)
-        return result
+    # Дата создания опроса: по ней определяется, когда опрос уходит в архив
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Опрос заморожен: голоса подсчитаны в сводку вариантов ответа, сами голоса удалены
+    is_final = Column(Boolean, nullable=False, default=False)
+    # Количество проголосовавших: меняется вместе с каждым голосом, чтобы рейтинг не считать по голосам
+    votes_total = Column(Integer, nullable=False, default=0)
+    # Варианты ответа нужны почти везде, где нужен опрос: загружаем их сразу одним запросом на все опросы
+    options = relationship("PollOption", back_populates="poll", cascade="all, delete-orphan",
+                           lazy="selectin", order_by="PollOption.id")
+    # Голосов могут быть тысячи: их считают запросами с группировкой, а загрузка всей коллекции - ошибка.
+    # При удалении опроса голоса удаляет сама БД
+    votes = relationship("PollVote", back_populates="poll", cascade="all, delete-orphan",
+                         lazy="raise_on_sql", passive_deletes=True)
 
 
 class PollOption(Base):
@@ -134,10 +144,13 @@ class PollOption(Base):
 
     id = Column(Integer, primary_key=True)
     poll_id = Column(Integer, ForeignKey("poll.id", ondelete="CASCADE"))
-    poll = relationship("Poll")
+    poll = relationship("Poll", back_populates="options")
     # Текст кнопки-ответа (должен быть эмодзи)
     text = Column(String(4))
-    votes = relationship("PollVote", cascade="all, delete-orphan")
+    # Количество голосов на момент заморозки опроса. Заполняется только у замороженных опросов
+    final_votes = Column(Integer)
+    votes = relationship("PollVote", back_populates="option", cascade="all, delete-orphan",
+                         lazy="raise_on_sql", passive_deletes=True)
 
 
 class PollVote(Base):
@@ -145,23 +158,34 @@ class PollVote(Base):
     Результаты голосования
     """
     __tablename__ = "poll_vote"
+    __table_args__ = (
+        # Пользователь может отдать только один голос в опросе
+        Index("uq_poll_vote_poll_id_user_id", "poll_id", "user_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     poll_id = Column(Integer, ForeignKey("poll.id", ondelete="CASCADE"))
-    poll = relationship("Poll")
+    poll = relationship("Poll", back_populates="votes")
     option_id = Column(Integer, ForeignKey("poll_option.id", ondelete="CASCADE"))
-    option = relationship("PollOption")
+    option = relationship("PollOption", back_populates="votes")
     # Идентификатор пользователя телеграм оставившего голос
     user_id = Column(Integer)
 
 
 class AdminState(Base):
     """
-    Информация о состоянии чата бота с админом: нужна для фичи создания опросов
+    Информация о состоянии чата бота с модератором: нужна для фичи создания опросов.
+    У каждого модератора свое состояние
     """
     __tablename__ = "admin_state"
+    __table_args__ = (
+        Index("uq_admin_state_moderator_id", "moderator_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
+    # Модератор: идентификатор его чата с ботом. Уникален, поэтому если два экземпляра бота
+    # одновременно создадут состояние модератора, то одна из вставок упадет
+    moderator_id = Column(BigInteger)
     # Состояние
     state = Column(String(255))
     # Связанные с состоянием данные
@@ -172,3 +196,84 @@ class AdminState(Base):
     Ожидаю эмодзи для кнопок - Бот ожидает пока админ пришлет кнопки
     """
 
+
+class ProcessedUpdate(Base):
+    """
+    Обработанное обновление телеграма. Нужно для отсева повторных доставок, когда запущено
+    несколько экземпляров бота
+    """
+    __tablename__ = "processed_update"
+
+    # Ключ обновления: идентификатор обновления или идентификатор нажатия на кнопку
+    key = Column(String(64), primary_key=True)
+    created_at = Column(DateTime, index=True)
+
+
+class PollingState(Base):
+    """
+    Состояние поллинга: смещение, до которого обновления телеграма уже обработаны.
+    Нужно, чтобы после перезапуска не обрабатывать обновления повторно и не терять их
+    """
+    __tablename__ = "polling_state"
+
+    id = Column(Integer, primary_key=True)
+    # Идентификатор первого необработанного обновления
+    update_offset = Column(Integer)
+
+    ROW_ID = 1
+    """
+    Идентификатор единственной строки состояния
+    """
+
+
+class PhotoHash(Base):
+    """
+    Перцептивный хэш фото опубликованной или ожидающей решения предложки. Нужен для поиска
+    повторно присланных котов: пересжатые и слегка обрезанные копии дают близкие хэши
+    """
+    __tablename__ = "photo_hash"
+
+    id = Column(Integer, primary_key=True)
+    # 64-битный хэш в шестнадцатеричном виде
+    hash = Column(String(16))
+    # Предложка, пока она ожидает решения
+    suggestion_id = Column(Integer, index=True)
+    # Идентификатор поста в канале, после публикации
+    channel_post_id = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class Submitter(Base):
+    """
+    Отправитель предложек со статистикой. Предложки удаляются после решения, поэтому счетчики
+    увеличиваются сразу при отправке предложки и вынесении решения, а не считаются по истории
+    """
+    __tablename__ = "submitter"
+
+    # Идентификатор пользователя в телеграме
+    user_id = Column(String(255), primary_key=True)
+    user_username = Column(String(255))
+    user_title = Column(String(255))
+    # Количество присланных предложек
+    submitted = Column(Integer, nullable=False, default=0)
+    # Количество опубликованных предложек
+    accepted = Column(Integer, nullable=False, default=0, index=True)
+    # Количество отклоненных предложек
+    declined = Column(Integer, nullable=False, default=0)
+    # Дата последней предложки или решения по ней
+    last_activity_at = Column(DateTime)
+
+
+class PollMessage(Base):
+    """
+    Копия поста с опросом в одном из каналов. Голоса у всех копий общие, поэтому кнопки
+    обновляются у всех копий сразу
+    """
+    __tablename__ = "poll_message"
+
+    id = Column(Integer, primary_key=True)
+    poll_id = Column(Integer, ForeignKey("poll.id", ondelete="CASCADE"), index=True)
+    # Идентификатор канала
+    chat_id = Column(BigInteger)
+    # Идентификатор поста в канале
+    message_id = Column(Integer)
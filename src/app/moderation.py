@@ -0,0 +1,118 @@
+"""
+Переназначение предложек между модераторами
+
+Предложка назначается наименее загруженному модератору. Если модератор не рассматривает ее дольше
+`APP_MODERATION_TIMEOUT` секунд, предложка передается другому модератору: ему приходит новое сообщение
+с кнопками, а у прежнего модератора кнопки убираются. Предложки модераторов, которых убрали из
+конфигурации, передаются сразу. Предложки, ожидающие эмодзи для кнопок, не переназначаются:
+модератор уже занимается ими.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from telebot.apihelper import ApiException
+
+from app import config, db, repo
+from app.bot import bot, choose_moderator, get_admin_id, get_moderator_ids, render_suggestion_text, \
+    send_suggestion_to_moderator
+from app.logger import logger as app_logger
+from app.messages import t
+from app.models import Suggestion
+
+
+REASSIGN_INTERVAL = 60
+"""
+Интервал между проверками просроченных предложек в секундах
+"""
+
+REASSIGN_BATCH_SIZE = 50
+"""
+Количество предложек, выбираемых для переназначения за один запрос
+"""
+
+
+@db.commit_session
+def get_suggestion_ids_to_reassign(after_id: int, session=None) -> Optional[list]:
+    assigned_before = datetime.utcnow() - timedelta(seconds=config.APP_MODERATION_TIMEOUT)
+    return repo.get_suggestion_ids_to_reassign(get_moderator_ids(), assigned_before, after_id, REASSIGN_BATCH_SIZE)
+
+
+@db.commit_session
+def reassign_suggestion(suggestion_id: int, session=None):
+    """
+    Передает предложку другому модератору. Предложка блокируется и проверяется заново,
+    поэтому ее не переназначат дважды на разных экземплярах бота
+    """
+    suggestion = repo.get_suggestion(suggestion_id, for_update=True)
+    if suggestion is None or suggestion.state != Suggestion.STATE_NEW:
+        return
+    moderator_ids = get_moderator_ids()
+    assigned_before = datetime.utcnow() - timedelta(seconds=config.APP_MODERATION_TIMEOUT)
+    if suggestion.moderator_id is None:
+        # Предложка прислана до появления модераторов: ее сообщение уже в чате админа
+        suggestion.moderator_id = get_admin_id()
+        suggestion.assigned_at = datetime.utcnow()
+        return
+    if suggestion.moderator_id in moderator_ids \
+            and suggestion.assigned_at is not None and suggestion.assigned_at >= assigned_before:
+        return
+    previous_moderator_id = suggestion.moderator_id
+    previous_message_id = suggestion.admin_message_id
+    moderator_id = choose_moderator(suggestion.user_id, exclude=previous_moderator_id)
+    if moderator_id is None:
+        # Передать некому: продлеваем назначение, чтобы не проверять предложку на каждом проходе
+        suggestion.assigned_at = datetime.utcnow()
+        return
+    send_suggestion_to_moderator(suggestion, moderator_id)
+    try:
+        # У прежнего модератора убираем кнопки и отмечаем, что предложку передали
+        bot.edit_message_caption(render_suggestion_text(suggestion) + "\n\n" + t("app.admin.suggestion.reassigned"),
+                                 previous_moderator_id,
+                                 previous_message_id,
+                                 parse_mode="HTML")
+    except ApiException as e:
+        # Прежний модератор мог удалить сообщение или заблокировать бота
+        app_logger.error("Error during reassigned suggestion {} rendering: {}".format(suggestion_id, str(e)))
+
+
+def reassign_suggestions():
+    """
+    Переназначает все просроченные предложки
+    """
+    # Идем по возрастанию идентификатора, чтобы предложка, которую не удалось передать, не выбиралась снова
+    after_id = 0
+    while True:
+        suggestion_ids = get_suggestion_ids_to_reassign(after_id)
+        if suggestion_ids is None or len(suggestion_ids) == 0:
+            return
+        for suggestion_id in suggestion_ids:
+            reassign_suggestion(suggestion_id)
+        if len(suggestion_ids) < REASSIGN_BATCH_SIZE:
+            return
+        after_id = suggestion_ids[-1]
+
+
+def run_forever():
+    """
+    Периодически переназначает просроченные предложки
+    """
+    while True:
+        try:
+            reassign_suggestions()
+        except Exception as e:
+            app_logger.error("Error during suggestions reassignment: {}".format(str(e)))
+        time.sleep(REASSIGN_INTERVAL)
+
+
+def start_worker() -> threading.Thread:
+    """
+    Запускает переназначение предложек в фоновом потоке
+
+    :return: Поток переназначения
+    """
+    worker = threading.Thread(target=run_forever, name="moderation", daemon=True)
+    worker.start()
+    return worker
@@ -0,0 +1,268 @@
+"""
+Поиск повторно присланных котов по перцептивному хэшу
+
+Для каждой присланной картинки скачивается самая маленькая копия фото и по ней считается
+64-битный разностный хэш (dHash): картинка сжимается до 9x8 оттенков серого, и каждый бит хэша
+показывает, ярче ли пиксель своего правого соседа. Пересжатые, уменьшенные и слегка обрезанные
+копии дают хэши, отличающиеся в нескольких битах. Скачивание и подсчет идут в отдельном пуле потоков,
+чтобы декодирование картинок не занимало потоки обработчиков без ограничения.
+
+Хэши опубликованных и ожидающих решения котов хранятся в БД и в памяти в многоиндексной хэш-таблице:
+хэш делится на 4 части по 16 бит, и по каждой части строится отдельный словарь. Если хэши отличаются
+не более чем в `d` битах, то хотя бы одна из частей отличается не более чем в `d // 4` битах, поэтому
+достаточно проверить несколько соседних значений каждой части вместо перебора всех хэшей.
+Хэши своего процесса попадают в индекс сразу, а хэши других экземпляров бота догружаются из БД
+не чаще раза в `INDEX_REFRESH_INTERVAL` секунд.
+"""
+
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from itertools import combinations
+from typing import Callable, Optional
+
+from app import config, repo
+from app.logger import logger as app_logger
+from app.models import PhotoHash
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+HASH_SIZE = 8
+"""
+Сторона сетки хэша: хэш состоит из HASH_SIZE * HASH_SIZE бит
+"""
+
+CHUNK_COUNT = 4
+"""
+Количество частей, на которые делится хэш в индексе
+"""
+
+CHUNK_BITS = HASH_SIZE * HASH_SIZE // CHUNK_COUNT
+"""
+Количество бит в одной части хэша
+"""
+
+INDEX_REFRESH_INTERVAL = 5
+"""
+Как часто догружать в индекс хэши, сохраненные другими экземплярами бота, в секундах
+"""
+
+LOAD_BATCH_SIZE = 10000
+"""
+Количество хэшей, загружаемых из БД одним запросом
+"""
+
+
+def is_enabled() -> bool:
+    """
+    Поиск повторов включен и `Pillow` установлен
+    """
+    return config.APP_PHOTO_HASH and Image is not None
+
+
+def dhash(data: bytes) -> int:
+    """
+    Считает разностный хэш картинки
+
+    :param data: Содержимое файла картинки
+    :return: 64-битный хэш
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        # Для JPEG декодируем сразу в уменьшенном размере и в оттенках серого
+        image.draft("L", (HASH_SIZE * 4, HASH_SIZE * 4))
+        pixels = list(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for column in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return value
+
+
+def distance(a: int, b: int) -> int:
+    """
+    Количество различающихся бит двух хэшей
+    """
+    return bin(a ^ b).count("1")
+
+
+def split(value: int) -> list:
+    """
+    Делит хэш на части для индекса
+    """
+    mask = (1 << CHUNK_BITS) - 1
+    return [(value >> (CHUNK_BITS * i)) & mask for i in range(CHUNK_COUNT)]
+
+
+def neighbours(chunk: int, radius: int):
+    """
+    Перебирает значения части хэша, отличающиеся от нее не более чем в `radius` битах
+    """
+    yield chunk
+    for bit_count in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), bit_count):
+            flipped = chunk
+            for bit in bits:
+                flipped ^= 1 << bit
+            yield flipped
+
+
+class HashIndex:
+    """
+    Многоиндексная хэш-таблица для поиска хэшей по расстоянию Хэмминга
+    """
+
+    def __init__(self):
+        self.hashes = dict()
+        self.tables = [dict() for _ in range(CHUNK_COUNT)]
+        # Идентификатор последнего загруженного из БД хэша. Хэши своего процесса его не сдвигают:
+        # хэши других экземпляров с меньшими идентификаторами еще могут быть не загружены
+        self.last_id = 0
+        # Время последней догрузки по `time.monotonic`
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+
+    def add(self, hash_id: int, value: int):
+        with self.lock:
+            self.hashes[hash_id] = value
+            for table, chunk in zip(self.tables, split(value)):
+                table.setdefault(chunk, set()).add(hash_id)
+
+    def remove(self, hash_id: int):
+        with self.lock:
+            value = self.hashes.pop(hash_id, None)
+            if value is None:
+                return
+            for table, chunk in zip(self.tables, split(value)):
+                bucket = table.get(chunk)
+                bucket.discard(hash_id)
+                if len(bucket) == 0:
+                    del table[chunk]
+
+    def search(self, value: int, max_distance: int) -> list:
+        """
+        Ищет хэши, отличающиеся от указанного не более чем в `max_distance` битах
+
+        :return: Массив пар (расстояние, идентификатор) по возрастанию расстояния
+        """
+        radius = max_distance // CHUNK_COUNT
+        found = dict()
+        with self.lock:
+            for table, chunk in zip(self.tables, split(value)):
+                for probe in neighbours(chunk, radius):
+                    for hash_id in table.get(probe, ()):
+                        if hash_id not in found:
+                            found[hash_id] = distance(value, self.hashes[hash_id])
+        return sorted((hash_distance, hash_id) for hash_id, hash_distance in found.items()
+                      if hash_distance <= max_distance)
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+index = HashIndex()
+"""
+Хэши опубликованных и ожидающих решения котов
+"""
+
+__pool = None
+__pool_lock = threading.Lock()
+
+
+def get_pool() -> ThreadPoolExecutor:
+    global __pool
+    with __pool_lock:
+        if __pool is None:
+            __pool = ThreadPoolExecutor(config.APP_PHOTO_HASH_WORKERS, thread_name_prefix="photo_hash")
+        return __pool
+
+
+def submit(download: Callable[[], bytes]) -> Future:
+    """
+    Скачивает картинку и считает ее хэш в пуле потоков
+
+    :param download: Функция, возвращающая содержимое файла картинки
+    :return: Future с хэшем
+    """
+    return get_pool().submit(lambda: dhash(download()))
+
+
+def get_result(future: Future) -> Optional[int]:
+    """
+    Возвращает хэш картинки из завершенного Future. Если хэш не удалось посчитать, возвращает None:
+    проверка на повтор не должна мешать присылать котов
+    """
+    try:
+        return future.result(0)
+    except Exception as e:
+        app_logger.error("Error during photo hashing: {}".format(str(e)))
+        return None
+
+
+def then(future: Future, callback: Callable[[Optional[int]], None]):
+    """
+    Когда хэш посчитан, вызывает функцию с ним в пуле потоков хэшей. Функция всегда вызывается отдельной
+    задачей пула, а не в потоке, завершившем Future, поэтому может открывать свою сессию БД
+
+    :param future: Future с хэшем
+    :param callback: Функция, принимающая хэш или None, если его не удалось посчитать
+    """
+    future.add_done_callback(lambda done: get_pool().submit(callback, get_result(done)))
+
+
+def refresh_index():
+    """
+    Догружает в индекс хэши, сохраненные после последней загрузки, в том числе другими экземплярами бота
+    """
+    index.refreshed_at = time.monotonic()
+    while True:
+        rows = repo.get_photo_hashes(index.last_id, LOAD_BATCH_SIZE)
+        for hash_id, value in rows:
+            index.add(hash_id, value)
+        if len(rows) > 0:
+            index.last_id = rows[-1][0]
+        if len(rows) < LOAD_BATCH_SIZE:
+            return
+
+
+def refresh_index_if_stale():
+    """
+    Догружает индекс, если с прошлой догрузки прошло больше `INDEX_REFRESH_INTERVAL` секунд
+    """
+    if index.refreshed_at is None or time.monotonic() - index.refreshed_at >= INDEX_REFRESH_INTERVAL:
+        refresh_index()
+
+
+def add(value: int, suggestion_id: int):
+    """
+    Сохраняет хэш фото предложки в БД и сразу добавляет его в индекс
+
+    :param value: Хэш фото
+    :param suggestion_id: Идентификатор предложки
+    """
+    index.add(repo.add_photo_hash(value, suggestion_id), value)
+
+
+def find_duplicate(value: int) -> Optional[PhotoHash]:
+    """
+    Ищет ближайший сохраненный хэш, отличающийся от указанного не больше чем на `APP_PHOTO_HASH_DISTANCE` бит
+
+    :param value: Хэш присланного фото
+    :return: Сохраненный хэш или None, если повтор не найден
+    """
+    refresh_index_if_stale()
+    candidates = index.search(value, config.APP_PHOTO_HASH_DISTANCE)
+    if len(candidates) == 0:
+        return None
+    rows = {row.id: row for row in repo.get_photo_hashes_by_ids([hash_id for _, hash_id in candidates])}
+    for _, hash_id in candidates:
+        if hash_id in rows:
+            return rows[hash_id]
+        # Хэш отклоненной предложки удален из БД, возможно, другим экземпляром бота
+        index.remove(hash_id)
+    return None
@@ -0,0 +1,201 @@
+"""
+Конвейерный поллинг обновлений
+
+Стандартный поллинг телебота получает пачку обновлений, обрабатывает ее и только потом запрашивает
+следующую, а смещение хранит только в памяти. Здесь следующий запрос `getUpdates` отправляется,
+пока обрабатывается текущая пачка, а обновления обрабатываются пулом потоков. Обновления одного
+чата и нажатия одного пользователя всегда попадают в один поток, поэтому порядок их обработки сохраняется.
+
+Телеграму подтверждаются только обработанные обновления: в запросе передается смещение первого
+необработанного обновления. Поэтому в ответе могут снова прийти обновления, которые еще
+обрабатываются, - они пропускаются. Смещение сохраняется в БД после каждого продвижения, поэтому
+после перезапуска обработка продолжается с первого необработанного обновления. Сохранения идут
+по одному и только вперед: смещение, посчитанное раньше, не перезапишет более новое.
+
+Телеграм отдает не больше `APP_POLLING_BATCH_SIZE` обновлений начиная со смещения, поэтому
+одновременно обрабатывается не больше одной пачки обновлений. Долгая обработка одного обновления
+задерживает остальные потоки (они дообрабатывают уже полученные обновления), но новые обновления
+после пачки запрашиваются, только когда это обновление обработано. Такие ожидания считаются
+в метрике `polling_head_of_line_waits`.
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+
+from telebot import apihelper
+
+from app import capture, config, db, dedup, metrics, repo, updates
+from app.bot import bot, process_vote, VOTE_ACTIONS
+from app.logger import logger as app_logger
+
+
+ERROR_DELAY = 3
+"""
+Пауза после ошибки запроса обновлений в секундах
+"""
+
+
+@db.commit_session
+def load_offset(session=None):
+    return repo.get_polling_offset()
+
+
+@db.commit_session
+def save_offset(offset: int, session=None) -> bool:
+    repo.set_polling_offset(offset)
+    return True
+
+
+def process_update(update: updates.UpdateInfo):
+    """
+    Обрабатывает одно обновление в потоке обработчика
+
+    :param update: Ключевые поля обновления
+    """
+    if dedup.is_duplicate(update.raw):
+        return
+    handle_update(update)
+
+
+def handle_update(update: updates.UpdateInfo):
+    """
+    Обрабатывает одно обновление без отсева повторов
+
+    :param update: Ключевые поля обновления
+    """
+    if update.callback_action() in VOTE_ACTIONS:
+        process_vote(update.callback_query_id, update.user_id, update.callback_data)
+    else:
+        bot.process_new_updates([update.to_update()])
+
+
+class Poller:
+    """
+    Конвейерный поллинг с пулом обработчиков и сохранением смещения
+    """
+
+    def __init__(self, batch_size: int, timeout: int, workers: int):
+        """
+        :param batch_size: Максимальное количество обновлений в одном запросе
+        :param timeout: Время ожидания новых обновлений одним запросом в секундах
+        :param workers: Количество потоков обработки
+        """
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.queues = [queue.Queue() for _ in range(workers)]
+        # Смещение первого необработанного обновления
+        self.offset = None
+        # Смещение, сохраненное в БД
+        self.saved_offset = None
+        # Идентификатор последнего полученного обновления
+        self.last_fetched_id = None
+        # Идентификаторы полученных обновлений по возрастанию, начиная с первого необработанного
+        self.in_flight = deque()
+        # Обработанные обновления из `in_flight`, перед которыми есть необработанные
+        self.completed = set()
+        self.condition = threading.Condition()
+        self.save_lock = threading.Lock()
+
+    def start_workers(self):
+        for worker_queue in self.queues:
+            worker = threading.Thread(target=self.work, args=(worker_queue,), daemon=True)
+            worker.start()
+
+    def work(self, worker_queue: queue.Queue):
+        while True:
+            update = worker_queue.get()
+            try:
+                process_update(update)
+            except Exception as e:
+                app_logger.error("Error during update {} processing: {}".format(update.update_id, str(e)))
+            self.complete(update.update_id)
+
+    def dispatch(self, update: updates.UpdateInfo):
+        """
+        Передает обновление в поток обработки: обновления одного чата и нажатия одного пользователя
+        всегда в один поток
+        """
+        self.queues[update.partition_key() % len(self.queues)].put(update)
+
+    def complete(self, update_id: int):
+        """
+        Отмечает обновление обработанным и продвигает смещение, если все более ранние обновления обработаны
+        """
+        with self.condition:
+            self.completed.add(update_id)
+            # Обновления получены по возрастанию, поэтому первое необработанное всегда в начале
+            while len(self.in_flight) > 0 and self.in_flight[0] in self.completed:
+                self.completed.discard(self.in_flight.popleft())
+            offset = self.in_flight[0] if len(self.in_flight) > 0 else self.last_fetched_id + 1
+            advanced = offset > self.offset
+            if advanced:
+                self.offset = offset
+                self.condition.notify_all()
+        if advanced:
+            self.save_progress()
+
+    def save_progress(self):
+        """
+        Сохраняет текущее смещение, если оно новее сохраненного. Потоки сохраняют смещение по очереди,
+        и каждый сохраняет самое новое на момент сохранения, поэтому в БД смещение только растет
+        """
+        with self.save_lock:
+            with self.condition:
+                offset = self.offset
+            if self.saved_offset is not None and offset <= self.saved_offset:
+                return
+            if save_offset(offset):
+                self.saved_offset = offset
+
+    def fetch(self) -> list:
+        """
+        Запрашивает обновления начиная с первого необработанного
+        """
+        return apihelper.get_updates(bot.token,
+                                     offset=self.offset,
+                                     limit=self.batch_size,
+                                     timeout=self.timeout,
+                                     long_polling_timeout=self.timeout)
+
+    def run(self):
+        """
+        Запускает поллинг. Блокирует текущий поток
+        """
+        self.offset = self.saved_offset = load_offset() or 0
+        self.last_fetched_id = self.offset - 1
+        # Обработчики телебота вызываются прямо в наших потоках, чтобы знать, когда обновление обработано
+        bot.threaded = False
+        self.start_workers()
+        while True:
+            try:
+                raw_updates = self.fetch()
+            except Exception as e:
+                app_logger.error("Error during updates fetching: {}".format(str(e)))
+                time.sleep(ERROR_DELAY)
+                continue
+            with self.condition:
+                new_updates = [raw for raw in raw_updates if raw["update_id"] > self.last_fetched_id]
+                if len(new_updates) == 0 and len(raw_updates) > 0:
+                    # Пришли только обрабатываемые обновления: ждем продвижения смещения,
+                    # чтобы не запрашивать их снова и снова
+                    metrics.inc("polling_head_of_line_waits")
+                    self.condition.wait(self.timeout)
+                    continue
+                for raw in new_updates:
+                    self.in_flight.append(raw["update_id"])
+                    self.last_fetched_id = raw["update_id"]
+                if len(new_updates) > 0 and self.offset == 0:
+                    # Смещение еще ни разу не сохранялось: начинаем с первого полученного обновления
+                    self.offset = new_updates[0]["update_id"]
+            for raw in new_updates:
+                capture.record(raw)
+                self.dispatch(updates.UpdateInfo(raw))
+
+
+def run():
+    """
+    Запускает конвейерный поллинг с настройками из конфигурации
+    """
+    Poller(config.APP_POLLING_BATCH_SIZE, config.APP_POLLING_TIMEOUT, config.APP_POLLING_WORKERS).run()
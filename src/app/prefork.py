@@ -0,0 +1,228 @@
+"""
+Вебхук в нескольких процессах
+
+При `APP_WEBHOOK_WORKERS` больше 1 главный процесс подготавливает БД и порождает через fork указанное
+количество процессов-обработчиков. Каждый обработчик слушает порт вебхука с `SO_REUSEPORT`, поэтому ядро
+само распределяет соединения телеграма между процессами, а цикл событий обработчика работает на `uvloop`,
+если он установлен.
+
+Кэши голосов, сдерживание нажатий и отсев повторных доставок живут в памяти процесса, поэтому каждое
+обновление обрабатывается процессом-владельцем: номер владельца - ключ распределения обновления по модулю
+количества процессов. Обновление, пришедшее в чужой процесс, пересылается владельцу на его внутренний порт
+`APP_WEBHOOK_FORWARD_PORT + номер` на `127.0.0.1`. Так сообщения одного чата и нажатия одного пользователя
+всегда обрабатываются одним процессом по порядку. Если процесс-обработчик завершился, главный процесс
+запускает его заново с тем же номером.
+
+Общие фоновые задачи над БД (архивация опросов и переназначение предложек) выполняет только процесс
+с номером 0, чтобы процессы не обрабатывали одни и те же строки. Запись сдержанных голосов работает
+в каждом процессе: сдержанные голоса живут в его памяти.
+"""
+
+import asyncio
+import os
+import signal
+import time
+from typing import Callable
+
+import aiohttp
+from aiohttp import web
+from telebot import util
+
+from app import config, db, metrics, startup
+from app.bot import bot
+from app.logger import logger as app_logger
+from app.updates import UpdateInfo
+
+try:
+    # uvloop необязателен: если он не установлен, используется стандартный цикл событий
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+RESPAWN_DELAY = 1
+"""
+Пауза перед перезапуском завершившегося процесса-обработчика в секундах
+"""
+
+FORWARD_TIMEOUT = 60
+"""
+Сколько секунд ждать, пока процесс-владелец обработает пересланное обновление
+"""
+
+worker_index = None
+"""
+Номер текущего процесса-обработчика. None в главном процессе и при работе в одном процессе
+"""
+
+__forward_session = None
+
+
+def is_enabled() -> bool:
+    """
+    Вебхук обслуживается несколькими процессами
+    """
+    return config.APP_WEBHOOK_WORKERS > 1
+
+
+def install_event_loop():
+    """
+    Включает `uvloop` для циклов событий, создаваемых после вызова, если он установлен
+    """
+    if uvloop is not None:
+        uvloop.install()
+
+
+def runs_shared_tasks() -> bool:
+    """
+    Текущий процесс выполняет общие фоновые задачи: процесс-обработчик с номером 0
+    или единственный процесс бота
+    """
+    return worker_index is None or worker_index == 0
+
+
+def get_owner(update: UpdateInfo) -> int:
+    """
+    Номер процесса, который обрабатывает обновление
+    """
+    return update.partition_key() % config.APP_WEBHOOK_WORKERS
+
+
+def is_owner(update: UpdateInfo) -> bool:
+    """
+    Обновление обрабатывается текущим процессом
+    """
+    return not is_enabled() or get_owner(update) == worker_index
+
+
+def get_forward_port(index: int) -> int:
+    return config.APP_WEBHOOK_FORWARD_PORT + index
+
+
+async def forward(update: UpdateInfo, body: bytes) -> web.Response:
+    """
+    Пересылает обновление процессу-владельцу и возвращает его ответ. Если владелец недоступен,
+    отвечает 503: телеграм повторит доставку, и порядок обновлений чата не нарушится
+
+    :param update: Ключевые поля обновления
+    :param body: Тело запроса вебхука
+    """
+    global __forward_session
+    if __forward_session is None:
+        __forward_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=FORWARD_TIMEOUT))
+    owner = get_owner(update)
+    url = "http://127.0.0.1:{}/{}/".format(get_forward_port(owner), bot.token)
+    try:
+        async with __forward_session.post(url, data=body) as response:
+            metrics.inc("prefork_forwarded")
+            return web.Response(status=response.status)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        metrics.inc("prefork_forward_failed")
+        app_logger.error("Error during update {} forwarding to worker {}: {}".format(update.update_id, owner, str(e)))
+        return web.Response(status=503)
+
+
+def serve_forwarded(application: web.Application, handle: Callable):
+    """
+    Запускает вместе с приложением внутренний сервер, принимающий обновления от других процессов
+
+    :param application: Приложение вебхука
+    :param handle: Обработчик запроса вебхука
+    """
+    forwarded = web.Application()
+    forwarded.router.add_post('/{token}/', handle)
+    runner = web.AppRunner(forwarded, access_log=None)
+
+    async def start(app):
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", get_forward_port(worker_index)).start()
+
+    async def stop(app):
+        global __forward_session
+        await runner.cleanup()
+        if __forward_session is not None:
+            await __forward_session.close()
+            __forward_session = None
+
+    application.on_startup.append(start)
+    application.on_cleanup.append(stop)
+
+
+def start_worker(index: int):
+    """
+    Готовит к работе только что порожденный процесс-обработчик
+
+    :param index: Номер процесса
+    """
+    global worker_index
+    worker_index = index
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # Потоки обработчиков телебота и подключения к БД не переживают fork
+    bot.worker_pool = util.ThreadPool(bot, num_threads=bot.worker_pool.num_threads)
+    db.reset_after_fork()
+    if config.APP_SNAPSHOT_FILE is not None:
+        # Снимок кэшей у каждого процесса свой: процесс с тем же номером обслуживает те же чаты
+        config.APP_SNAPSHOT_FILE = "{}.{}".format(config.APP_SNAPSHOT_FILE, index)
+    if config.APP_SPOOL_DIR is not None:
+        # Журнал обновлений тоже свой: после перезапуска процесс дообрабатывает обновления своих чатов
+        config.APP_SPOOL_DIR = os.path.join(config.APP_SPOOL_DIR, str(index))
+
+
+def spawn(index: int, serve: Callable[[], None]) -> int:
+    """
+    Порождает процесс-обработчик
+
+    :param index: Номер процесса
+    :param serve: Функция, обслуживающая вебхук в процессе. Блокирует процесс до завершения
+    :return: Идентификатор порожденного процесса
+    """
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    code = 0
+    try:
+        start_worker(index)
+        serve()
+    except Exception as e:
+        app_logger.error("Error in webhook worker {}: {}".format(index, str(e)))
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def run(serve: Callable[[], None]):
+    """
+    Запускает процессы-обработчики и перезапускает завершившиеся. Блокирует главный процесс,
+    пока обработчики не завершатся после SIGTERM или SIGINT
+
+    :param serve: Функция, обслуживающая вебхук в процессе
+    """
+    # Миграции применяет главный процесс, чтобы обработчики не применяли их одновременно
+    startup.wait_for_db()
+    if startup.migrate_if_needed():
+        app_logger.info("Database migrated")
+    db.get_engine().dispose()
+    workers = dict()
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(config.APP_WEBHOOK_WORKERS):
+        workers[spawn(index, serve)] = index
+    app_logger.info("Started {} webhook workers".format(len(workers)))
+    while len(workers) > 0:
+        pid, status = os.wait()
+        index = workers.pop(pid, None)
+        if index is None or stopping:
+            continue
+        app_logger.error("Webhook worker {} exited with status {}, restarting".format(index, status))
+        time.sleep(RESPAWN_DELAY)
+        if not stopping:
+            workers[spawn(index, serve)] = index
@@ -0,0 +1,154 @@
+"""
+Чтение данных для горячих путей: голосования и перерисовки кнопок опросов
+
+Сущности ORM попадают в identity map сессии, отслеживают изменения и подгружают связи ленивыми
+запросами (`option.poll`, `poll.options`), хотя на этих путях данные только читаются. Поэтому здесь
+запросы строятся через Core `select`, а строки превращаются в неизменяемые записи `namedtuple`
+со слотами. Записи нельзя изменить и сохранить: для записи по-прежнему используются сущности из `app.repo`.
+
+Запросы вынесены в отдельные функции, чтобы асинхронный режим выполнял те же запросы,
+см. `app.async_read_repo`. Метаданные вариантов ответа и количество голосов читаются из реплики,
+если она задана, см. `app.db.read_session`. Кнопки поста после голоса перерисовываются по данным
+основной БД: голос уже закоммичен, а реплика могла его еще не получить.
+"""
+
+from collections import namedtuple
+from typing import Optional
+
+from sqlalchemy import select, func, distinct
+from sqlalchemy.orm import Session
+
+from app.db import flush_session, read_session
+from app.models import Poll, PollOption, PollVote
+from app.vote_cache import OptionMeta
+
+
+OptionRecord = namedtuple("OptionRecord", ["id", "text", "final_votes"])
+"""
+Вариант ответа опроса
+"""
+
+PollRecord = namedtuple("PollRecord", ["id", "message_id", "is_final", "options"])
+"""
+Опрос с вариантами ответа. `options` - кортеж `OptionRecord` в порядке создания вариантов
+"""
+
+
+def option_meta_query(option_id: int):
+    """
+    Запрос варианта ответа вместе с признаком заморозки опроса одним запросом
+    """
+    return select(PollOption.id, PollOption.poll_id, PollOption.text, Poll.is_final)\
+        .join(Poll, Poll.id == PollOption.poll_id)\
+        .where(PollOption.id == option_id)
+
+
+def poll_query(poll_id: int):
+    """
+    Запрос опроса с вариантами ответа одним запросом
+    """
+    return select(Poll.id, Poll.message_id, Poll.is_final, PollOption.id, PollOption.text, PollOption.final_votes)\
+        .outerjoin(PollOption, PollOption.poll_id == Poll.id)\
+        .where(Poll.id == poll_id)\
+        .order_by(PollOption.id)
+
+
+def votes_count_query(poll_id: int):
+    """
+    Запрос количества голосов по вариантам ответа опроса
+    """
+    return select(PollVote.option_id, func.count(distinct(PollVote.user_id)))\
+        .where(PollVote.poll_id == poll_id)\
+        .group_by(PollVote.option_id)
+
+
+def vote_option_id_query(poll_id: int, user_id: int):
+    """
+    Запрос варианта ответа, за который проголосовал пользователь. Действующим считается последний голос
+    """
+    return select(PollVote.option_id)\
+        .where(PollVote.poll_id == poll_id,
+               PollVote.user_id == user_id)\
+        .order_by(PollVote.id.desc())\
+        .limit(1)
+
+
+def make_option_meta(row) -> Optional[OptionMeta]:
+    if row is None:
+        return None
+    return OptionMeta(*row)
+
+
+def make_poll(rows: list) -> Optional[PollRecord]:
+    if len(rows) == 0:
+        return None
+    poll_id, message_id, is_final = rows[0][:3]
+    options = tuple(OptionRecord(option_id, text, final_votes)
+                    for _, _, _, option_id, text, final_votes in rows
+                    if option_id is not None)
+    return PollRecord(poll_id, message_id, is_final, options)
+
+
+def make_votes_count(poll: PollRecord, rows) -> dict:
+    result = {option.id: 0 for option in poll.options}
+    for option_id, count in rows:
+        if option_id in result:
+            result[option_id] = count
+    return result
+
+
+def final_votes_count(poll: PollRecord) -> dict:
+    # У замороженного опроса голосов уже нет, количество берется из сводки
+    return {option.id: option.final_votes or 0 for option in poll.options}
+
+
+@read_session
+def get_option_meta(option_id: int, session: Session = None) -> Optional[OptionMeta]:
+    """
+    Получить метаданные варианта ответа
+
+    :param option_id: Идентификатор варианта ответа
+    :param session:
+    :return: Метаданные или None, если вариант ответа не найден
+    """
+    return make_option_meta(session.execute(option_meta_query(option_id)).first())
+
+
+@read_session
+def get_poll(poll_id: int, session: Session = None) -> Optional[PollRecord]:
+    """
+    Получить опрос с вариантами ответа
+
+    :param poll_id: Идентификатор опроса
+    :param session:
+    :return: Опрос или None, если опрос не найден
+    """
+    return make_poll(session.execute(poll_query(poll_id)).all())
+
+
+@read_session
+def get_votes_count_by_options(poll: PollRecord, session: Session = None) -> dict:
+    """
+    Возвращает количество голосов по вариантам ответа опроса, см. `app.repo.get_votes_count_by_options`
+
+    :param poll: Опрос
+    :param session:
+    :return: Словарь вида {идентификатор варианта ответа: количество голосов}
+    """
+    if poll.is_final:
+        return final_votes_count(poll)
+    return make_votes_count(poll, session.execute(votes_count_query(poll.id)))
+
+
+@flush_session
+def get_vote_option_id(poll_id: int, user_id: int, session: Session = None) -> Optional[int]:
+    """
+    Получить вариант ответа, за который проголосовал пользователь. Читается из основной БД:
+    по нему решается, добавить голос или снять, и отставание реплики перевернуло бы нажатие
+
+    :param poll_id: Опрос
+    :param user_id: Идентификатор пользователя в телеграме
+    :param session:
+    :return: Идентификатор варианта ответа или None, если пользователь не голосовал
+    """
+    return session.execute(vote_option_id_query(poll_id, user_id)).scalar()
@@ -0,0 +1,230 @@
+"""
+Воспроизведение записанных обновлений для оценки пропускной способности
+
+Обновления из журнала `app.capture` передаются обработчикам бота так же, как при поллинге: обновления
+одного чата обрабатываются по порядку в одном потоке. Запросы бота к Bot API уходят в локальную
+заглушку, которая сразу отвечает правдоподобными ответами, при желании с задержкой, похожей на
+задержку настоящего Bot API. Обновления подаются с исходными интервалами, ускоренными в `speed` раз,
+или без пауз. По итогам считается пропускная способность и задержка обработки: от момента, когда
+обновление должно было прийти, до окончания его обработки.
+
+Обработчики работают с настоящей БД из `APP_DATABASE_URL`, поэтому воспроизводить журнал нужно
+на отдельной БД.
+"""
+
+import gzip
+import json
+import queue
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from itertools import count
+from urllib.parse import urlparse, parse_qs
+
+from telebot import apihelper
+
+from app import updates
+from app.logger import logger as app_logger
+
+
+MESSAGE_METHODS = {"sendMessage", "sendPhoto", "forwardMessage", "editMessageText", "editMessageCaption",
+                   "editMessageReplyMarkup"}
+"""
+Методы Bot API, которые возвращают сообщение
+"""
+
+STUB_CHAT_ID = -1000000000001
+"""
+Идентификатор, который заглушка возвращает для чатов, заданных юзернеймом
+"""
+
+
+def read_log(paths: list):
+    """
+    Читает журналы обновлений по порядку
+
+    :param paths: Файлы журнала, сжатые или нет
+    :return: Генератор пар (время получения, обновление)
+    """
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as file:
+            for line in file:
+                if line.strip() == "":
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Последняя строка файла, который писался при остановке, может быть оборвана
+                    continue
+                yield entry["ts"], entry["update"]
+
+
+class StubBotApi:
+    """
+    Локальная заглушка Bot API
+    """
+
+    def __init__(self, latency: float):
+        """
+        :param latency: Задержка ответа на каждый запрос в секундах
+        """
+        self.latency = latency
+        self.calls = dict()
+        # Параметры последнего запроса по методам
+        self.last_params = dict()
+        # Содержимое файлов по идентификатору. Остальные файлы скачиваются как ответ JSON
+        self.files = dict()
+        self.message_ids = count(1)
+        self.lock = threading.Lock()
+        self.server = None
+
+    def respond(self, method: str, params: dict):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.last_params[method] = params
+        chat_id = params.get("chat_id")
+        if chat_id is not None:
+            chat_id = int(chat_id) if chat_id.lstrip("-").isdigit() else STUB_CHAT_ID
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "replay", "username": "replay_bot"}
+        if method == "getChat":
+            return {"id": chat_id, "type": "private" if chat_id > 0 else "channel",
+                    "title": "replay", "username": "replay", "first_name": "replay"}
+        if method == "getFile":
+            file_id = params.get("file_id")
+            return {"file_id": file_id, "file_unique_id": "replay",
+                    "file_path": file_id if file_id in self.files else "replay.jpg"}
+        if method in MESSAGE_METHODS:
+            message = {"message_id": params.get("message_id") or next(self.message_ids),
+                       "date": int(time.time()),
+                       "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"}}
+            if method == "sendPhoto":
+                message["photo"] = [{"file_id": params.get("photo"), "file_unique_id": "replay",
+                                     "width": 1, "height": 1}]
+            return message
+        return True
+
+    def start(self) -> str:
+        """
+        Запускает заглушку и направляет в нее запросы бота
+
+        :return: Адрес заглушки
+        """
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def handle_request(self):
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > 0:
+                    body = self.rfile.read(length)
+                    if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                        params.update({key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()})
+                if stub.latency > 0:
+                    time.sleep(stub.latency)
+                method = url.path.rstrip("/").split("/")[-1]
+                if url.path.startswith("/file/") and method in stub.files:
+                    payload = stub.files[method]
+                else:
+                    payload = json.dumps({"ok": True, "result": stub.respond(method, params)}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = handle_request
+            do_POST = handle_request
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="stub_bot_api", daemon=True).start()
+        address = "http://127.0.0.1:{}".format(self.server.server_port)
+        apihelper.API_URL = address + "/bot{0}/{1}"
+        apihelper.FILE_URL = address + "/file/bot{0}/{1}"
+        return address
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def percentile(values: list, q: float) -> float:
+    if len(values) == 0:
+        return 0.0
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def replay(entries, speed: float, workers: int, process) -> dict:
+    """
+    Воспроизводит обновления
+
+    :param entries: Пары (время получения, обновление)
+    :param speed: Во сколько раз ускорить исходные интервалы. `0` - подавать без пауз
+    :param workers: Количество потоков обработки
+    :param process: Функция обработки `UpdateInfo`
+    :return: Отчет
+    """
+    queues = [queue.Queue() for _ in range(workers)]
+    latencies = list()
+    errors = [0]
+    lock = threading.Lock()
+
+    def work(worker_queue: queue.Queue):
+        while True:
+            item = worker_queue.get()
+            if item is None:
+                return
+            due, update = item
+            try:
+                process(update)
+            except Exception as e:
+                app_logger.error("Error during replayed update {} processing: {}".format(update.update_id, str(e)))
+                with lock:
+                    errors[0] += 1
+            with lock:
+                latencies.append(time.monotonic() - due)
+
+    threads = [threading.Thread(target=work, args=(worker_queue,), daemon=True) for worker_queue in queues]
+    for thread in threads:
+        thread.start()
+    started = time.monotonic()
+    first_ts = None
+    total = 0
+    for received_at, raw in entries:
+        if first_ts is None:
+            first_ts = received_at
+        due = started
+        if speed > 0:
+            due = started + (received_at - first_ts) / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            due = time.monotonic()
+        update = updates.UpdateInfo(raw)
+        # Обновления одного чата обрабатываются по порядку, как при поллинге
+        partition_key = update.chat_id or update.user_id or update.update_id
+        queues[hash(partition_key) % workers].put((due, update))
+        total += 1
+    for worker_queue in queues:
+        worker_queue.put(None)
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        "updates": total,
+        "errors": errors[0],
+        "seconds": elapsed,
+        "throughput": total / elapsed if elapsed > 0 else 0.0,
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p90": percentile(latencies, 0.9),
+        "latency_p99": percentile(latencies, 0.99),
+        "latency_max": latencies[-1] if len(latencies) > 0 else 0.0,
+    }
@@ -3,13 +3,53 @@
 """
 
 import json
+from collections import namedtuple, OrderedDict
+from datetime import datetime
 from functools import reduce
 from typing import Optional
 
+from sqlalchemy import func, distinct, select, update, or_, tuple_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from app.db import flush_session
-from app.models import AdminState, Poll, PollOption, PollVote, Suggestion
+from app import metrics
+from app.db import flush_session, read_session
+from app.logger import logger as app_logger
+from app.models import AdminState, Poll, PollOption, PollVote, Suggestion, ProcessedUpdate, PollingState, \
+    PhotoHash, Submitter, PollMessage
+
+
+VoteMutation = namedtuple("VoteMutation", ["poll_id", "user_id", "option_id"])
+"""
+Изменение голоса пользователя в опросе для пакетной обработки. Если `option_id` равен None,
+то голос пользователя снимается, иначе голос добавляется или переносится на указанный вариант ответа
+"""
+
+EMOJI_SETS_COUNT = 5
+"""
+Количество последних наборов эмодзи, предлагаемых админу
+"""
+
+EMOJI_SETS_BATCH_SIZE = 20
+"""
+Количество опросов, читаемых за один запрос при поиске последних наборов эмодзи
+"""
+
+BULK_CHUNK_SIZE = 500
+"""
+Максимальное количество идентификаторов в одном условии IN при пакетных операциях
+"""
+
+
+def chunks(items: list, size: int = BULK_CHUNK_SIZE):
+    """
+    Разбивает массив на части не больше указанного размера
+
+    :param items: Массив
+    :param size: Размер части
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
 
 def validate_admin_state(state: str, data: dict) -> bool:
@@ -34,83 +74,152 @@ def validate_admin_state(state: str, data: dict) -> bool:
 
 
 @flush_session
-def sanitize_admin_state(session: Session = None):
+def sanitize_admin_state(moderator_id: int, session: Session = None) -> Optional[AdminState]:
     """
-    Проверяет целостность хранения состояния в БД. В БД в каждый момент времени должно
+    Проверяет целостность хранения состояния в БД. В БД в каждый момент времени у модератора должно
     быть либо 0 строк - нет состояния, либо 1 строка - есть состояние.
 
-    Если хранение состояния не целостно, то очищаем таблицу.
+    Если хранение состояния не целостно, то очищаем состояние модератора.
 
     Проверку выполняем перед каждой попыткой обращения к состоянию и после изменения.
 
+    Строки состояния блокируются до конца транзакции, чтобы несколько экземпляров бота
+    не меняли состояние одновременно.
+
+    :param moderator_id: Идентификатор чата модератора
     :param session:
+    :return: Строка состояния или None, если состояния нет. Повторно состояние не запрашивается
     """
-    states = session.query(AdminState).all()
+    states = session.query(AdminState)\
+        .filter(AdminState.moderator_id == moderator_id)\
+        .with_for_update()\
+        .all()
     if len(states) > 1:
         for state in states:
             session.delete(state)
+        return None
+    return states[0] if len(states) == 1 else None
 
 
 @flush_session
-def get_admin_state(session: Session = None) -> Optional[dict]:
+def get_admin_state(moderator_id: int, session: Session = None) -> Optional[dict]:
     """
-    Возвращает состояние чата админа с ботом
+    Возвращает состояние чата модератора с ботом
+
+    :param moderator_id: Идентификатор чата модератора
     """
-    sanitize_admin_state()
-    admin_state = session.query(AdminState).first()
+    admin_state = sanitize_admin_state(moderator_id)
     if admin_state is None:
         return None
     if admin_state.state is None or admin_state.data is None:
         # Если одно из обязательных полей состояния не заполнено, считаем его невалидным и уничтожаем
-        clear_admin_state()
+        session.delete(admin_state)
         return None
     state = admin_state.state
     data = json.loads(admin_state.data)
     if not validate_admin_state(state, data):
         # Если объект состояния не проходит проверку на целостность, то уничтожаем состояние
-        clear_admin_state()
+        session.delete(admin_state)
         return None
     return {"state": admin_state.state, "data": json.loads(admin_state.data), "_raw": admin_state}
 
 
 @flush_session
-def set_admin_state(state: str, data: dict, session: Session = None):
+def set_admin_state(moderator_id: int, state: str, data: dict, session: Session = None):
     """
-    Задает состояние чата админа с ботом
+    Задает состояние чата модератора с ботом
+
+    :param moderator_id: Идентификатор чата модератора
     """
-    admin_state = get_admin_state()
-    # Удаляем прошлое состояние если есть
+    admin_state = sanitize_admin_state(moderator_id)
     if admin_state is not None:
-        clear_admin_state()
+        # Прошлое состояние заблокировано: перезаписываем его на месте
+        admin_state.state = state
+        admin_state.data = json.dumps(data)
+        return
     admin_state = AdminState()
+    admin_state.moderator_id = moderator_id
     admin_state.state = state
     admin_state.data = json.dumps(data)
     session.add(admin_state)
     session.flush()
-    sanitize_admin_state()
+    # Другой экземпляр бота мог одновременно добавить свое состояние
+    sanitize_admin_state(moderator_id)
 
 
 @flush_session
-def clear_admin_state(session: Session = None):
+def clear_admin_state(moderator_id: int, session: Session = None):
     """
-    Очищает состояние чата админа с ботом
+    Очищает состояние чата модератора с ботом
+
+    :param moderator_id: Идентификатор чата модератора
     """
-    sanitize_admin_state()
-    state = session.query(AdminState).first()
-    session.delete(state)
+    state = sanitize_admin_state(moderator_id)
+    if state is not None:
+        session.delete(state)
 
 
 @flush_session
-def get_suggestion(suggestion_id: int, session: Session = None) -> Optional[Suggestion]:
+def get_suggestion(suggestion_id: int, for_update: bool = False, session: Session = None) -> Optional[Suggestion]:
     """
     Получить предложку по идентификатору в БД
     :param suggestion_id: Идентификатор предложки в БД
+    :param for_update: Заблокировать строку предложки до конца транзакции. Нужно перед
+    сменой состояния предложки, чтобы решение по ней не вынесли дважды на разных экземплярах бота
     :param session
     :return: Предложка
     """
-    return session.query(Suggestion)\
-        .filter(Suggestion.id == suggestion_id)\
-        .first()
+    query = session.query(Suggestion)\
+        .filter(Suggestion.id == suggestion_id)
+    if for_update:
+        query = query.with_for_update()
+    return query.first()
+
+
+@flush_session
+def get_pending_suggestions(moderator_id: int, limit: int, after_id: int = None, before_id: int = None,
+                            session: Session = None) -> list:
+    """
+    Возвращает страницу предложек, ожидающих решения. Страница ищется по индексу (state, id)
+    от идентификатора соседней страницы, поэтому время запроса не зависит от номера страницы
+
+    :param moderator_id: Модератор, которому назначены предложки
+    :param limit: Размер страницы
+    :param after_id: Вернуть предложки после указанной (следующая страница)
+    :param before_id: Вернуть предложки перед указанной (предыдущая страница)
+    :param session:
+    :return: Предложки по возрастанию идентификатора
+    """
+    query = session.query(Suggestion)\
+        .filter(Suggestion.state.in_([Suggestion.STATE_NEW, Suggestion.STATE_WAIT]),
+                Suggestion.moderator_id == moderator_id)
+    if before_id is not None:
+        query = query.filter(Suggestion.id < before_id).order_by(Suggestion.id.desc())
+        return list(reversed(query.limit(limit).all()))
+    if after_id is not None:
+        query = query.filter(Suggestion.id > after_id)
+    return query.order_by(Suggestion.id).limit(limit).all()
+
+
+@flush_session
+def has_pending_suggestions(moderator_id: int, after_id: int = None, before_id: int = None,
+                            session: Session = None) -> bool:
+    """
+    Есть ли ожидающие решения предложки модератора после или перед указанной
+
+    :param moderator_id: Модератор
+    :param after_id: Искать после указанной предложки
+    :param before_id: Искать перед указанной предложкой
+    :param session:
+    """
+    query = session.query(Suggestion.id)\
+        .filter(Suggestion.state.in_([Suggestion.STATE_NEW, Suggestion.STATE_WAIT]),
+                Suggestion.moderator_id == moderator_id)
+    if after_id is not None:
+        query = query.filter(Suggestion.id > after_id)
+    if before_id is not None:
+        query = query.filter(Suggestion.id < before_id)
+    return query.first() is not None
 
 
 @flush_session
@@ -133,30 +242,20 @@ def create_poll(emojis: list, session: Session = None) -> Poll:
 
 
 @flush_session
-def get_poll(poll_id: int, session: Session = None) -> Optional[Poll]:
+def get_poll(poll_id: int, for_update: bool = False, session: Session = None) -> Optional[Poll]:
     """
     Получить опрос по идентификатору
 
     :param poll_id: Идентификатор опроса
+    :param for_update: Заблокировать строку опроса до конца транзакции
     :param session:
     :return: Опрос если найден или None
     """
-    return session.query(Poll)\
-        .filter(Poll.id == poll_id)\
-        .first()
-
-
-@flush_session
-def get_option(option_id: int, session: Session = None) -> Optional[PollOption]:
-    """
-    Получить вариант ответа по идентификатору
-
-    :param option_id: Идентификатор варианта ответа
-    :param session:
-    :return: Вариант ответа или None
-    """
-    return session.query(PollOption).filter(PollOption.id == option_id)\
-        .first()
+    query = session.query(Poll)\
+        .filter(Poll.id == poll_id)
+    if for_update:
+        query = query.with_for_update()
+    return query.first()
 
 
 @flush_session
@@ -166,6 +265,9 @@ def get_vote(poll_id: int, user_id: int, session: Session = None) -> Optional[Po
     удаляем: могло получиться что пользователь быстро нажимал на кнопки или бот завис и сохранилось
     несколько голосов
 
+    Голос блокируется до конца транзакции, чтобы одновременные нажатия пользователя
+    на разных экземплярах бота обрабатывались по очереди
+
     :param poll_id: Опрос
     :param user_id: Идентификатор пользователя в телеграме
     :param session:
@@ -174,6 +276,8 @@ def get_vote(poll_id: int, user_id: int, session: Session = None) -> Optional[Po
     votes = session.query(PollVote)\
         .filter(PollVote.poll_id == poll_id,
                 PollVote.user_id == user_id)\
+        .order_by(PollVote.id)\
+        .with_for_update()\
         .all()
     votes_to_delete = votes[0:-1]
     votes = votes[-1:]
@@ -184,52 +288,657 @@ def get_vote(poll_id: int, user_id: int, session: Session = None) -> Optional[Po
 
 
 @flush_session
-def clear_vote(poll_id: int, user_id: int, session: Session = None):
+def lock_open_poll(poll_id: int, session: Session = None) -> bool:
+    """
+    Блокирует опрос до конца транзакции, если он не заморожен. Голос пишется под этой блокировкой,
+    как в `apply_votes`, поэтому не попадет в опрос, который замораживается в это же время
+
+    :param poll_id: Опрос
+    :param session:
+    :return: False, если опрос не найден или заморожен
+    """
+    row = session.query(Poll.id)\
+        .filter(Poll.id == poll_id,
+                Poll.is_final.is_(False))\
+        .with_for_update()\
+        .first()
+    return row is not None
+
+
+@flush_session
+def clear_vote(poll_id: int, user_id: int, session: Session = None) -> bool:
     """
     Удалить голос пользователя в опросе
 
     :param poll_id: Опрос
     :param user_id: Идентификатор пользователя в телеграме
     :param session:
+    :return: False, если опрос не найден или заморожен
     """
-    vote = get_vote(poll_id, user_id)
-    if vote is None:
-        return
-    session.delete(vote)
+    if not lock_open_poll(poll_id):
+        return False
+    deleted = session.query(PollVote)\
+        .filter(PollVote.poll_id == poll_id,
+                PollVote.user_id == user_id)\
+        .delete(synchronize_session=False)
+    if deleted > 0:
+        change_votes_totals({poll_id: -1})
+    return True
 
 
 @flush_session
-def add_vote(poll_id: int, option_id: int, user_id: int, session: Session = None):
+def add_vote(poll_id: int, option_id: int, user_id: int, session: Session = None) -> bool:
     """
-    Добавить голос пользователя в опрос
+    Добавить голос пользователя в опрос или перенести существующий голос на другой вариант ответа
+
+    Голос пользователя в опросе уникален, поэтому запись выполняется как upsert: сначала
+    обновляем существующий голос, а если его нет, вставляем новый в точке сохранения.
+    Если другой экземпляр бота успел вставить голос раньше, то обновляем его.
 
     :param poll_id: Опрос
     :param option_id: Вариант ответа
     :param user_id: Идентификатор пользователя в телеграме
     :param session:
+    :return: False, если опрос не найден или заморожен
+    """
+    if not lock_open_poll(poll_id):
+        return False
+    updated = session.query(PollVote)\
+        .filter(PollVote.poll_id == poll_id,
+                PollVote.user_id == user_id)\
+        .update({PollVote.option_id: option_id}, synchronize_session=False)
+    if updated > 0:
+        return True
+    try:
+        with session.begin_nested():
+            session.execute(PollVote.__table__.insert(),
+                            {"poll_id": poll_id, "option_id": option_id, "user_id": user_id})
+    except IntegrityError:
+        session.query(PollVote)\
+            .filter(PollVote.poll_id == poll_id,
+                    PollVote.user_id == user_id)\
+            .update({PollVote.option_id: option_id}, synchronize_session=False)
+        return True
+    # Голос добавлен, а не перенесен: проголосовавших стало больше
+    change_votes_totals({poll_id: 1})
+    return True
+
+
+@flush_session
+def get_votes_by_pairs(pairs: list, for_update: bool = False, session: Session = None) -> dict:
+    """
+    Возвращает голоса по парам опрос-пользователь. Голоса читаются по самим парам, а не по всем
+    сочетаниям опросов и пользователей пачки
+
+    :param pairs: Массив пар (опрос, идентификатор пользователя в телеграме)
+    :param for_update: Заблокировать голоса до конца транзакции
+    :param session:
+    :return: Словарь вида {пара: массив пар (идентификатор голоса, вариант ответа) по возрастанию идентификатора}
     """
-    vote = PollVote()
-    vote.poll_id = poll_id
-    vote.option_id = option_id
-    vote.user_id = user_id
-    session.add(vote)
+    votes = dict()
+    # Каждая пара занимает в запросе два параметра
+    for pairs_chunk in chunks(pairs, BULK_CHUNK_SIZE // 2):
+        query = session.query(PollVote.id, PollVote.poll_id, PollVote.user_id, PollVote.option_id)\
+            .filter(tuple_(PollVote.poll_id, PollVote.user_id).in_(pairs_chunk))\
+            .order_by(PollVote.id)
+        if for_update:
+            query = query.with_for_update()
+        for vote_id, poll_id, user_id, option_id in query.all():
+            votes.setdefault((poll_id, user_id), list()).append((vote_id, option_id))
+    return votes
 
 
 @flush_session
+def apply_votes(mutations: list, session: Session = None) -> dict:
+    """
+    Применяет пакет изменений голосов в рамках текущей транзакции. Для каждой пары опрос-пользователь
+    учитывается только последнее изменение в пакете. Существующие голоса читаются по парам пакета,
+    удаляются и добавляются пакетными запросами. Изменения по замороженным опросам и вариантам ответа
+    из чужих опросов пропускаются. Открытые опросы пакета блокируются до конца транзакции, как в
+    `freeze_poll`, поэтому голос не попадет в опрос, который замораживается в это же время
+
+    :param mutations: Массив изменений `VoteMutation`
+    :param session:
+    :return: Словарь изменений количества голосов вида {идентификатор варианта ответа: разница}
+    """
+    targets = OrderedDict()
+    for mutation in mutations:
+        targets[(mutation.poll_id, mutation.user_id)] = mutation.option_id
+    if len(targets) == 0:
+        return dict()
+    # Блокируем опросы по возрастанию идентификатора, чтобы пакеты на разных экземплярах бота
+    # не ждали друг друга по кругу
+    open_poll_ids = set()
+    for poll_ids_chunk in chunks(sorted({poll_id for poll_id, _ in targets.keys()})):
+        rows = session.query(Poll.id)\
+            .filter(Poll.id.in_(poll_ids_chunk),
+                    Poll.is_final.is_(False))\
+            .order_by(Poll.id)\
+            .with_for_update()\
+            .all()
+        open_poll_ids.update(row[0] for row in rows)
+    # Варианты ответа открытых опросов: по ним проверяем, что вариант принадлежит опросу
+    option_polls = dict()
+    for poll_ids_chunk in chunks(list(open_poll_ids)):
+        option_polls.update(session.query(PollOption.id, PollOption.poll_id)
+                            .filter(PollOption.poll_id.in_(poll_ids_chunk))
+                            .all())
+    targets = OrderedDict((pair, option_id) for pair, option_id in targets.items()
+                          if pair[0] in open_poll_ids
+                          and (option_id is None or option_polls.get(option_id) == pair[0]))
+    deltas = dict()
+    poll_deltas = dict()
+    # Текущие голоса: для каждой пары действующим считается последний голос, как в `get_vote`
+    existing = get_votes_by_pairs(list(targets.keys()))
+    ids_to_delete = list()
+    rows_to_insert = list()
+    for (poll_id, user_id), option_id in targets.items():
+        votes = existing.get((poll_id, user_id), list())
+        previous_option_id = votes[-1][1] if len(votes) > 0 else None
+        if previous_option_id == option_id:
+            # Голос не изменился, удаляем только мусорные дубли
+            ids_to_delete.extend(vote_id for vote_id, _ in votes[:-1])
+            continue
+        ids_to_delete.extend(vote_id for vote_id, _ in votes)
+        if previous_option_id is not None:
+            deltas[previous_option_id] = deltas.get(previous_option_id, 0) - 1
+            poll_deltas[poll_id] = poll_deltas.get(poll_id, 0) - 1
+        if option_id is not None:
+            rows_to_insert.append({"poll_id": poll_id, "option_id": option_id, "user_id": user_id})
+            deltas[option_id] = deltas.get(option_id, 0) + 1
+            poll_deltas[poll_id] = poll_deltas.get(poll_id, 0) + 1
+    for ids_chunk in chunks(ids_to_delete):
+        session.query(PollVote)\
+            .filter(PollVote.id.in_(ids_chunk))\
+            .delete(synchronize_session=False)
+    if len(rows_to_insert) > 0:
+        try:
+            with session.begin_nested():
+                session.execute(PollVote.__table__.insert(), rows_to_insert)
+        except IntegrityError:
+            # Другой экземпляр бота записал голос кого-то из пользователей пакета уже после чтения голосов.
+            # Такие голоса перечитываем под блокировкой и переносим, а вставляем только остальные.
+            # Если конфликт повторится, исключение откатит весь пакет
+            metrics.inc("votes_batch_conflicts")
+            app_logger.warning("Vote batch of {} rows conflicts with concurrent votes".format(len(rows_to_insert)))
+            concurrent = get_votes_by_pairs([(row["poll_id"], row["user_id"]) for row in rows_to_insert],
+                                            for_update=True)
+            rows_to_move = [row for row in rows_to_insert if (row["poll_id"], row["user_id"]) in concurrent]
+            rows_to_insert = [row for row in rows_to_insert if (row["poll_id"], row["user_id"]) not in concurrent]
+            for row in rows_to_move:
+                votes = concurrent[(row["poll_id"], row["user_id"])]
+                # Проголосовавший уже учтен тем, кто вставил голос
+                poll_deltas[row["poll_id"]] -= 1
+                deltas[votes[-1][1]] = deltas.get(votes[-1][1], 0) - 1
+                session.query(PollVote)\
+                    .filter(PollVote.id == votes[-1][0])\
+                    .update({PollVote.option_id: row["option_id"]}, synchronize_session=False)
+            if len(rows_to_insert) > 0:
+                session.execute(PollVote.__table__.insert(), rows_to_insert)
+    change_votes_totals(poll_deltas)
+    return {option_id: delta for option_id, delta in deltas.items() if delta != 0}
+
+
+@read_session
 def get_previous_emoji_sets(session: Session = None) -> list:
     """
-    Возвращает 5 последних использованных наборов эмодзи исключая дубли
+    Возвращает 5 последних использованных наборов эмодзи исключая дубли. Опросы читаются пачками
+    с конца, а варианты ответа пачки загружаются одним запросом, поэтому обычно хватает двух запросов
     :param session:
     :return: Массив строк с набором эмодзи
     """
-    pools = session.query(Poll).\
-        order_by(Poll.id.desc())\
-        .all()
     unique = dict()
-    for pool in pools:
-        option_set = reduce(lambda acc, option: acc + option.text, pool.options, "")
-        if option_set not in unique:
-            unique[option_set] = True
-        if len(unique.keys()) >= 5:
+    before_id = None
+    while len(unique.keys()) < EMOJI_SETS_COUNT:
+        query = session.query(Poll)
+        if before_id is not None:
+            query = query.filter(Poll.id < before_id)
+        polls = query.order_by(Poll.id.desc()).limit(EMOJI_SETS_BATCH_SIZE).all()
+        for poll in polls:
+            option_set = reduce(lambda acc, option: acc + option.text, poll.options, "")
+            if option_set not in unique:
+                unique[option_set] = True
+            if len(unique.keys()) >= EMOJI_SETS_COUNT:
+                break
+        if len(polls) < EMOJI_SETS_BATCH_SIZE:
             break
+        before_id = polls[-1].id
     return list(unique.keys())
+
+
+@flush_session
+def get_votes_count_by_options(poll: Poll, session: Session = None) -> dict:
+    """
+    Возвращает количество голосов по вариантам ответа опроса. Голоса считаются запросом
+    с группировкой, без загрузки самих голосов. У замороженного опроса голосов уже нет,
+    поэтому количество берется из сводки вариантов ответа
+
+    :param poll: Опрос
+    :param session:
+    :return: Словарь вида {идентификатор варианта ответа: количество голосов}
+    """
+    if poll.is_final:
+        return {option.id: option.final_votes or 0 for option in poll.options}
+    result = {option.id: 0 for option in poll.options}
+    rows = session.query(PollVote.option_id, func.count(distinct(PollVote.user_id)))\
+        .filter(PollVote.poll_id == poll.id)\
+        .group_by(PollVote.option_id)\
+        .all()
+    for option_id, count in rows:
+        if option_id in result:
+            result[option_id] = count
+    return result
+
+
+@flush_session
+def get_poll_ids_to_freeze(before: datetime, limit: int, session: Session = None) -> list:
+    """
+    Возвращает идентификаторы незамороженных опросов, созданных раньше указанной даты
+
+    :param before: Горизонт хранения
+    :param limit: Максимальное количество опросов
+    :param session:
+    :return: Массив идентификаторов опросов
+    """
+    rows = session.query(Poll.id)\
+        .filter(Poll.is_final.is_(False),
+                Poll.created_at < before)\
+        .order_by(Poll.id)\
+        .limit(limit)\
+        .all()
+    return [row[0] for row in rows]
+
+
+@flush_session
+def freeze_poll(poll_id: int, session: Session = None) -> Optional[Poll]:
+    """
+    Замораживает опрос: сохраняет количество голосов по вариантам ответа в сводку
+    и помечает опрос как завершенный. Сами голоса не удаляются, см. `delete_final_votes`
+
+    :param poll_id: Идентификатор опроса
+    :param session:
+    :return: Замороженный опрос или None, если опрос не найден или уже заморожен
+    """
+    poll = get_poll(poll_id, for_update=True)
+    if poll is None or poll.is_final:
+        return None
+    option_votes = get_votes_count_by_options(poll)
+    for option in poll.options:
+        option.final_votes = option_votes[option.id]
+    poll.is_final = True
+    return poll
+
+
+@flush_session
+def delete_final_votes(limit: int, session: Session = None) -> int:
+    """
+    Удаляет пачку голосов замороженных опросов
+
+    Идентификаторы выбираются отдельным запросом, поскольку MySQL не поддерживает
+    LIMIT в подзапросе внутри IN
+
+    :param limit: Размер пачки
+    :param session:
+    :return: Количество удаленных голосов
+    """
+    rows = session.query(PollVote.id)\
+        .join(Poll, Poll.id == PollVote.poll_id)\
+        .filter(Poll.is_final.is_(True))\
+        .limit(limit)\
+        .all()
+    vote_ids = [row[0] for row in rows]
+    if len(vote_ids) == 0:
+        return 0
+    session.query(PollVote)\
+        .filter(PollVote.id.in_(vote_ids))\
+        .delete(synchronize_session=False)
+    return len(vote_ids)
+
+
+@flush_session
+def mark_updates_processed(keys: list, session: Session = None) -> bool:
+    """
+    Отмечает обновление обработанным. Ключи вставляются в точке сохранения, поэтому
+    конфликт первичного ключа откатывает только их
+
+    :param keys: Ключи обновления
+    :param session:
+    :return: False, если хотя бы один из ключей уже был отмечен
+    """
+    now = datetime.utcnow()
+    try:
+        with session.begin_nested():
+            for key in keys:
+                session.add(ProcessedUpdate(key=key, created_at=now))
+    except IntegrityError:
+        return False
+    return True
+
+
+@flush_session
+def has_processed_updates(keys: list, session: Session = None) -> bool:
+    """
+    Проверяет, что обновление уже отмечено обработанным, не отмечая его
+
+    :param keys: Ключи обновления
+    :param session:
+    :return: True, если хотя бы один из ключей уже был отмечен
+    """
+    return session.query(ProcessedUpdate.key).filter(ProcessedUpdate.key.in_(keys)).first() is not None
+
+
+@flush_session
+def delete_processed_updates(before: datetime, session: Session = None):
+    """
+    Удаляет отметки об обработанных обновлениях старше указанной даты
+
+    :param before: Дата
+    :param session:
+    """
+    session.query(ProcessedUpdate)\
+        .filter(ProcessedUpdate.created_at < before)\
+        .delete(synchronize_session=False)
+
+
+@flush_session
+def get_polling_offset(session: Session = None) -> Optional[int]:
+    """
+    Возвращает сохраненное смещение поллинга
+
+    :param session:
+    :return: Идентификатор первого необработанного обновления или None, если смещение не сохранялось
+    """
+    state = session.query(PollingState).get(PollingState.ROW_ID)
+    return state.update_offset if state is not None else None
+
+
+@flush_session
+def set_polling_offset(offset: int, session: Session = None):
+    """
+    Сохраняет смещение поллинга. Смещение только растет: более старое смещение не сохраняется
+
+    :param offset: Идентификатор первого необработанного обновления
+    :param session:
+    """
+    state = session.query(PollingState).get(PollingState.ROW_ID)
+    if state is None:
+        state = PollingState()
+        state.id = PollingState.ROW_ID
+        session.add(state)
+    if state.update_offset is None or offset > state.update_offset:
+        state.update_offset = offset
+
+
+@flush_session
+def add_photo_hash(photo_hash: int, suggestion_id: int, session: Session = None) -> int:
+    """
+    Сохраняет перцептивный хэш фото предложки
+
+    :param photo_hash: 64-битный хэш
+    :param suggestion_id: Идентификатор предложки
+    :param session:
+    :return: Идентификатор сохраненного хэша
+    """
+    row = PhotoHash()
+    row.hash = "%016x" % photo_hash
+    row.suggestion_id = suggestion_id
+    session.add(row)
+    session.flush()
+    return row.id
+
+
+@flush_session
+def get_photo_hashes(after_id: int, limit: int, session: Session = None) -> list:
+    """
+    Возвращает хэши фото, сохраненные после указанного
+
+    :param after_id: Идентификатор последнего уже загруженного хэша
+    :param limit: Максимальное количество хэшей
+    :param session:
+    :return: Массив пар (идентификатор, хэш) по возрастанию идентификатора
+    """
+    rows = session.query(PhotoHash.id, PhotoHash.hash)\
+        .filter(PhotoHash.id > after_id)\
+        .order_by(PhotoHash.id)\
+        .limit(limit)\
+        .all()
+    return [(row_id, int(row_hash, 16)) for row_id, row_hash in rows]
+
+
+@flush_session
+def get_photo_hashes_by_ids(ids: list, session: Session = None) -> list:
+    """
+    Возвращает сохраненные хэши фото по идентификаторам. Удаленные хэши пропускаются
+
+    :param ids: Идентификаторы хэшей
+    :param session:
+    """
+    if len(ids) == 0:
+        return []
+    return session.query(PhotoHash).filter(PhotoHash.id.in_(ids)).all()
+
+
+@flush_session
+def publish_photo_hash(suggestion_id: int, channel_post_id: int, session: Session = None):
+    """
+    Отмечает хэш фото предложки опубликованным
+
+    :param suggestion_id: Идентификатор предложки
+    :param channel_post_id: Идентификатор поста в канале
+    :param session:
+    """
+    session.query(PhotoHash)\
+        .filter(PhotoHash.suggestion_id == suggestion_id)\
+        .update({PhotoHash.suggestion_id: None, PhotoHash.channel_post_id: channel_post_id},
+                synchronize_session=False)
+
+
+@flush_session
+def delete_photo_hash(suggestion_id: int, session: Session = None):
+    """
+    Удаляет хэш фото отклоненной предложки
+
+    :param suggestion_id: Идентификатор предложки
+    :param session:
+    """
+    session.query(PhotoHash)\
+        .filter(PhotoHash.suggestion_id == suggestion_id)\
+        .delete(synchronize_session=False)
+
+
+@flush_session
+def count_submission(user_id, user_username: Optional[str], user_title: str, session: Session = None):
+    """
+    Увеличивает счетчик предложек отправителя. Счетчик увеличивается в самом запросе, поэтому
+    одновременные предложки на разных экземплярах бота не теряются. Если отправителя еще нет,
+    то он вставляется в точке сохранения, а если его успел вставить другой экземпляр бота, то обновляется
+
+    :param user_id: Идентификатор пользователя в телеграме
+    :param user_username: Юзернейм пользователя
+    :param user_title: Имя пользователя
+    :param session:
+    """
+    values = {
+        Submitter.submitted: Submitter.submitted + 1,
+        Submitter.user_username: user_username,
+        Submitter.user_title: user_title,
+        Submitter.last_activity_at: datetime.utcnow(),
+    }
+    updated = session.query(Submitter)\
+        .filter(Submitter.user_id == str(user_id))\
+        .update(values, synchronize_session=False)
+    if updated > 0:
+        return
+    try:
+        with session.begin_nested():
+            session.execute(Submitter.__table__.insert(),
+                            {"user_id": str(user_id), "user_username": user_username, "user_title": user_title,
+                             "submitted": 1, "accepted": 0, "declined": 0,
+                             "last_activity_at": datetime.utcnow()})
+    except IntegrityError:
+        session.query(Submitter)\
+            .filter(Submitter.user_id == str(user_id))\
+            .update(values, synchronize_session=False)
+
+
+@flush_session
+def count_decision(user_id, accepted: bool, session: Session = None):
+    """
+    Увеличивает счетчик опубликованных или отклоненных предложек отправителя
+
+    :param user_id: Идентификатор пользователя в телеграме
+    :param accepted: Предложка опубликована
+    :param session:
+    """
+    counter = Submitter.accepted if accepted else Submitter.declined
+    session.query(Submitter)\
+        .filter(Submitter.user_id == str(user_id))\
+        .update({counter: counter + 1, Submitter.last_activity_at: datetime.utcnow()},
+                synchronize_session=False)
+
+
+@read_session
+def get_top_submitters(limit: int, session: Session = None) -> list:
+    """
+    Возвращает отправителей с наибольшим количеством опубликованных предложек.
+    Запрос читает первые строки индекса по счетчику опубликованных
+
+    :param limit: Количество отправителей
+    :param session:
+    """
+    return session.query(Submitter)\
+        .order_by(Submitter.accepted.desc())\
+        .limit(limit)\
+        .all()
+
+
+@flush_session
+def change_votes_totals(poll_deltas: dict, session: Session = None):
+    """
+    Изменяет количество проголосовавших в опросах. Значение меняется в самом запросе,
+    поэтому одновременные голоса на разных экземплярах бота не теряются
+
+    :param poll_deltas: Словарь вида {идентификатор опроса: разница}
+    :param session:
+    """
+    for poll_id, delta in poll_deltas.items():
+        if delta == 0:
+            continue
+        session.query(Poll)\
+            .filter(Poll.id == poll_id)\
+            .update({Poll.votes_total: Poll.votes_total + delta}, synchronize_session=False)
+
+
+@read_session
+def get_top_polls(limit: int, since: Optional[datetime] = None, session: Session = None) -> list:
+    """
+    Возвращает опубликованные опросы с наибольшим количеством проголосовавших.
+    Рейтинг за все время читается первыми `limit` строками индекса количества проголосовавших.
+    Рейтинг за период так не читается: по индексу даты создания выбираются все опросы периода,
+    и БД сортирует их по количеству проголосовавших. Это столько строк, сколько постов опубликовано
+    за период (десятки за день и сотни за неделю), поэтому отдельный индекс под каждый период не заводится
+
+    :param limit: Количество опросов
+    :param since: Учитывать только опросы, созданные после указанной даты
+    :param session:
+    """
+    query = session.query(Poll).filter(Poll.message_id.isnot(None))
+    if since is not None:
+        query = query.filter(Poll.created_at >= since)
+    return query.order_by(Poll.votes_total.desc(), Poll.id.desc()).limit(limit).all()
+
+
+@flush_session
+def rebuild_votes_totals(session: Session = None):
+    """
+    Пересчитывает количество проголосовавших во всех опросах: в открытых - по голосам,
+    в замороженных - по сводке вариантов ответа
+    """
+    votes_count = select(func.count(distinct(PollVote.user_id)))\
+        .where(PollVote.poll_id == Poll.id)\
+        .scalar_subquery()
+    final_votes_sum = select(func.coalesce(func.sum(PollOption.final_votes), 0))\
+        .where(PollOption.poll_id == Poll.id)\
+        .scalar_subquery()
+    session.execute(update(Poll).where(Poll.is_final.is_(False)).values(votes_total=votes_count)
+                    .execution_options(synchronize_session=False))
+    session.execute(update(Poll).where(Poll.is_final.is_(True)).values(votes_total=final_votes_sum)
+                    .execution_options(synchronize_session=False))
+
+
+@flush_session
+def get_moderator_loads(moderator_ids: list, session: Session = None) -> dict:
+    """
+    Возвращает количество ожидающих решения предложек у каждого модератора
+
+    :param moderator_ids: Идентификаторы чатов модераторов
+    :param session:
+    :return: Словарь вида {идентификатор чата модератора: количество предложек}
+    """
+    loads = {moderator_id: 0 for moderator_id in moderator_ids}
+    rows = session.query(Suggestion.moderator_id, func.count(Suggestion.id))\
+        .filter(Suggestion.moderator_id.in_(moderator_ids),
+                Suggestion.state.in_([Suggestion.STATE_NEW, Suggestion.STATE_WAIT]))\
+        .group_by(Suggestion.moderator_id)\
+        .all()
+    loads.update(rows)
+    return loads
+
+
+@flush_session
+def get_suggestion_ids_to_reassign(moderator_ids: list, assigned_before: datetime, after_id: int, limit: int,
+                                   session: Session = None) -> list:
+    """
+    Возвращает новые предложки, которые нужно передать другому модератору: назначенные давно,
+    не назначенные никому или назначенные модератору, которого больше нет
+
+    :param moderator_ids: Идентификаторы чатов действующих модераторов
+    :param assigned_before: Предложки, назначенные раньше этой даты, считаются просроченными
+    :param after_id: Вернуть предложки после указанной
+    :param limit: Максимальное количество предложек
+    :param session:
+    :return: Идентификаторы предложек
+    """
+    rows = session.query(Suggestion.id)\
+        .filter(Suggestion.state == Suggestion.STATE_NEW,
+                Suggestion.id > after_id,
+                or_(Suggestion.assigned_at < assigned_before,
+                    Suggestion.assigned_at.is_(None),
+                    Suggestion.moderator_id.is_(None),
+                    Suggestion.moderator_id.notin_(moderator_ids)))\
+        .order_by(Suggestion.id)\
+        .limit(limit)\
+        .all()
+    return [row.id for row in rows]
+
+
+@flush_session
+def add_poll_messages(poll_id: int, messages: list, session: Session = None):
+    """
+    Сохраняет копии поста с опросом
+
+    :param poll_id: Опрос
+    :param messages: Массив пар (идентификатор канала, идентификатор поста)
+    :param session:
+    """
+    if len(messages) == 0:
+        return
+    session.execute(PollMessage.__table__.insert(),
+                    [{"poll_id": poll_id, "chat_id": chat_id, "message_id": message_id}
+                     for chat_id, message_id in messages])
+
+
+@flush_session
+def get_poll_messages(poll_id: int, session: Session = None) -> list:
+    """
+    Возвращает копии поста с опросом
+
+    :param poll_id: Опрос
+    :param session:
+    :return: Массив пар (идентификатор канала, идентификатор поста)
+    """
+    rows = session.query(PollMessage.chat_id, PollMessage.message_id)\
+        .filter(PollMessage.poll_id == poll_id)\
+        .order_by(PollMessage.id)\
+        .all()
+    return [(chat_id, message_id) for chat_id, message_id in rows]
@@ -0,0 +1,115 @@
+"""
+Архивация старых опросов
+
+Опросы старше горизонта хранения замораживаются: количество голосов по вариантам ответа
+сохраняется в сводку, кнопки поста в канале перерисовываются в последний раз, а сами голоса
+удаляются пачками с паузами, чтобы не блокировать БД для текущих голосований.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from telebot.apihelper import ApiException
+
+from app import config, db, repo, vote_cache
+from app.bot import rerender_post_votes
+from app.logger import logger as app_logger
+
+
+FREEZE_BATCH_SIZE = 50
+"""
+Количество опросов, выбираемых для заморозки за один запрос
+"""
+
+
+@db.commit_session
+def freeze_polls(before: datetime, session=None) -> Optional[dict]:
+    """
+    Замораживает пачку опросов, созданных раньше горизонта хранения
+
+    :param before: Горизонт хранения
+    :param session:
+    :return: Словарь вида {идентификатор замороженного опроса: идентификаторы его вариантов ответа}
+    """
+    frozen = dict()
+    for poll_id in repo.get_poll_ids_to_freeze(before, FREEZE_BATCH_SIZE):
+        poll = repo.freeze_poll(poll_id)
+        if poll is not None:
+            frozen[poll_id] = [option.id for option in poll.options]
+    return frozen
+
+
+@db.commit_session
+def finalize_poll_keyboard(poll_id: int, session=None):
+    """
+    Перерисовывает кнопки замороженного опроса итоговыми результатами
+
+    :param poll_id: Идентификатор опроса
+    :param session:
+    """
+    try:
+        rerender_post_votes(poll_id)
+    except ApiException as e:
+        # Пост могли удалить из канала или кнопки уже совпадают с итоговыми
+        app_logger.error("Error during poll {} keyboard finalization: {}".format(poll_id, str(e)))
+
+
+@db.commit_session
+def delete_votes_batch(session=None) -> Optional[int]:
+    """
+    Удаляет пачку голосов замороженных опросов
+
+    :param session:
+    :return: Количество удаленных голосов
+    """
+    return repo.delete_final_votes(config.APP_RETENTION_BATCH_SIZE)
+
+
+def archive_polls():
+    """
+    Замораживает все опросы старше горизонта хранения и удаляет их голоса
+    """
+    before = datetime.utcnow() - timedelta(days=config.APP_POLL_RETENTION_DAYS)
+    while True:
+        frozen = freeze_polls(before)
+        if not frozen:
+            break
+        for poll_id, option_ids in frozen.items():
+            # Кэш вариантов ответа сбрасываем после коммита: иначе нажатие могло бы снова закэшировать
+            # опрос незамороженным, и пользователь еще минуту получал бы ответ о принятом голосе
+            for option_id in option_ids:
+                vote_cache.options.delete(option_id)
+            finalize_poll_keyboard(poll_id)
+    # Голоса удаляем пачками, чтобы не держать долгие блокировки на таблице голосов
+    while True:
+        deleted = delete_votes_batch()
+        if not deleted:
+            break
+        time.sleep(config.APP_RETENTION_BATCH_PAUSE)
+
+
+def run_forever():
+    """
+    Периодически запускает архивацию опросов
+    """
+    while True:
+        try:
+            archive_polls()
+        except Exception as e:
+            app_logger.error("Error during polls archivation: {}".format(str(e)))
+        time.sleep(config.APP_RETENTION_INTERVAL)
+
+
+def start_worker() -> Optional[threading.Thread]:
+    """
+    Запускает архивацию опросов в фоновом потоке, если задан горизонт хранения
+
+    :return: Поток архивации или None, если архивация выключена
+    """
+    if config.APP_POLL_RETENTION_DAYS is None:
+        return None
+    worker = threading.Thread(target=run_forever, name="retention", daemon=True)
+    worker.start()
+    return worker
@@ -0,0 +1,167 @@
+"""
+Снимки кэшей процесса для теплого перезапуска
+
+После перезапуска кэши пусты, и первые минуты бот нагружает БД и Bot API запросами, которые до
+перезапуска отвечались из памяти. Поэтому горячее состояние процесса периодически и при остановке
+сохраняется в сжатый файл, а при старте загружается обратно. В снимок попадают информация о боте,
+админе и канале, метаданные вариантов ответа, записанные в БД голоса пользователей, окно
+обработанных обновлений и последние наборы эмодзи. Каждое значение хранится вместе с возрастом, поэтому после загрузки
+оно устаревает так же, как устарело бы без перезапуска. Слишком старый снимок не загружается.
+"""
+
+import atexit
+import gzip
+import json
+import os
+import threading
+import time
+
+from telebot.types import Chat, User
+
+from app import config, dedup, vote_cache
+from app.bot import identity_cache, emoji_sets_cache
+from app.logger import logger as app_logger
+from app.vote_cache import OptionMeta
+
+
+SNAPSHOT_VERSION = 1
+"""
+Версия формата снимка. Снимок другой версии не загружается
+"""
+
+
+def dump_identity(value):
+    if isinstance(value, User):
+        return {"kind": "user", "data": value.to_dict()}
+    return {"kind": "chat", "data": {"id": value.id, "type": value.type,
+                                     "title": value.title, "username": value.username}}
+
+
+def load_identity(value):
+    if value["kind"] == "user":
+        return User.de_json(value["data"])
+    return Chat.de_json(value["data"])
+
+
+def dump_key(key):
+    # Ключи-кортежи в JSON превращаются в массивы
+    return list(key) if isinstance(key, tuple) else key
+
+
+def load_key(key):
+    return tuple(key) if isinstance(key, list) else key
+
+
+def dump_user_votes():
+    # Сдержанные голоса не записаны в БД и не попадают в снимок: после перезапуска кэш не должен
+    # показывать голос, которого в БД нет
+    entries = vote_cache.user_votes.dump()
+    unsettled = vote_cache.throttle.get_unsettled()
+    return [(dump_key(key), value, age) for key, value, age in entries if key not in unsettled]
+
+
+SECTIONS = {
+    "identities": (
+        lambda: [(dump_key(key), dump_identity(value), age) for key, value, age in identity_cache.dump()
+                 if value is not None],
+        lambda entries: identity_cache.load([(load_key(key), load_identity(value), age)
+                                             for key, value, age in entries]),
+    ),
+    "options": (
+        lambda: [(key, [value.id, value.poll_id, value.text, value.poll_is_final], age)
+                 for key, value, age in vote_cache.options.dump()],
+        lambda entries: vote_cache.options.load([(key, OptionMeta(*value), age) for key, value, age in entries]),
+    ),
+    "user_votes": (
+        lambda: dump_user_votes(),
+        lambda entries: vote_cache.user_votes.load([(load_key(key), value, age) for key, value, age in entries]),
+    ),
+    "updates": (
+        lambda: dedup.window.dump(),
+        lambda entries: dedup.window.load(entries),
+    ),
+    "emoji_sets": (
+        lambda: emoji_sets_cache.dump(),
+        lambda entries: emoji_sets_cache.load(entries),
+    ),
+}
+"""
+Разделы снимка: функции сохранения и загрузки состояния
+"""
+
+__lock = threading.Lock()
+
+
+def save():
+    """
+    Сохраняет снимок. Файл записывается во временный файл и переименовывается,
+    поэтому прерванная запись не портит предыдущий снимок
+    """
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "saved_at": time.time(),
+        "sections": {name: dump() for name, (dump, _) in SECTIONS.items()},
+    }
+    data = gzip.compress(json.dumps(snapshot, separators=(",", ":")).encode("utf-8"))
+    with __lock:
+        temporary_file = config.APP_SNAPSHOT_FILE + ".tmp"
+        with open(temporary_file, "wb") as snapshot_file:
+            snapshot_file.write(data)
+        os.replace(temporary_file, config.APP_SNAPSHOT_FILE)
+
+
+def restore() -> bool:
+    """
+    Загружает снимок, если он есть и не старше `APP_SNAPSHOT_MAX_AGE`
+
+    :return: True, если снимок загружен
+    """
+    try:
+        with open(config.APP_SNAPSHOT_FILE, "rb") as snapshot_file:
+            snapshot = json.loads(gzip.decompress(snapshot_file.read()).decode("utf-8"))
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        app_logger.error("Error during snapshot reading: {}".format(str(e)))
+        return False
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return False
+    # Пока процесс не работал, все значения постарели
+    downtime = time.time() - snapshot["saved_at"]
+    if downtime < 0 or downtime > config.APP_SNAPSHOT_MAX_AGE:
+        return False
+    for name, entries in snapshot["sections"].items():
+        if name not in SECTIONS:
+            continue
+        _, load = SECTIONS[name]
+        try:
+            load([entry[:-1] + [entry[-1] + downtime] for entry in entries])
+        except Exception as e:
+            app_logger.error("Error during snapshot section {} loading: {}".format(name, str(e)))
+    return True
+
+
+def save_quietly():
+    try:
+        save()
+    except Exception as e:
+        app_logger.error("Error during snapshot saving: {}".format(str(e)))
+
+
+def run_forever():
+    while True:
+        time.sleep(config.APP_SNAPSHOT_INTERVAL)
+        save_quietly()
+
+
+def start():
+    """
+    Загружает снимок и запускает его периодическое сохранение и сохранение при остановке,
+    если задан файл снимка
+    """
+    if config.APP_SNAPSHOT_FILE is None:
+        return
+    restore()
+    atexit.register(save_quietly)
+    worker = threading.Thread(target=run_forever, name="snapshot", daemon=True)
+    worker.start()
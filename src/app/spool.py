@@ -0,0 +1,373 @@
+"""
+Надежный журнал входящих обновлений вебхука
+
+Если процесс упадет между ответом телеграму и коммитом обработчика, обновление потеряется, а если
+отвечать только после обработки, телеграм не дождется ответа и доставит обновление повторно. Поэтому
+при заданном `APP_SPOOL_DIR` вебхук только дописывает тело запроса в журнал и отвечает телеграму, как только
+запись надежно оказалась на диске. Обрабатывают журнал потоки-читатели в своем темпе.
+
+Журнал состоит из файлов-сегментов, в которые записи только дописываются. Запись - заголовок
+(длина тела, CRC32 номера и тела, номер записи) и тело запроса. Поток записи забирает все накопившиеся
+записи, пишет их и вызывает `fsync` один раз на всю пачку, поэтому одновременные запросы ждут одного
+сброса на диск. Когда сегмент вырастает до `APP_SPOOL_SEGMENT_SIZE` байт, начинается новый.
+
+Записи распределяются между `APP_SPOOL_WORKERS` потоками-читателями по ключу распределения обновления,
+поэтому порядок обработки обновлений одного чата сохраняется. Номер первой необработанной записи
+периодически сохраняется в файл `checkpoint`, а полностью обработанные сегменты удаляются. При старте
+записи начиная с сохраненного номера обрабатываются заново. Запись, оборванная падением посреди записи,
+не проходит проверку CRC и отбрасывается: телеграму на нее еще не ответили, и он доставит ее повторно.
+Обработка гарантируется хотя бы один раз: записи после последнего сохранения номера после падения
+читаются заново. Обработчик, переданный из `bot.py`, обернут в `app.dedup.mark_after_processing`:
+обновление отмечается обработанным только после обработки, поэтому уже обработанные записи отсеиваются,
+если отметка пережила перезапуск (`APP_DEDUP_SHARED` или окно из снимка), а запись, обработка которой
+оборвалась падением, обрабатывается заново.
+"""
+
+import atexit
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from app import config, metrics, updates
+from app.logger import logger as app_logger
+
+
+HEADER = struct.Struct("<IIQ")
+"""
+Заголовок записи: длина тела, CRC32 номера и тела, номер записи
+"""
+
+SEGMENT_PREFIX = "spool-"
+SEGMENT_SUFFIX = ".log"
+
+CHECKPOINT_FILE = "checkpoint"
+"""
+Файл с номером первой необработанной записи
+"""
+
+CHECKPOINT_INTERVAL = 1
+"""
+Как часто сохраняется номер первой необработанной записи в секундах
+"""
+
+
+def get_segment_name(first_number: int) -> str:
+    return "{}{:020d}{}".format(SEGMENT_PREFIX, first_number, SEGMENT_SUFFIX)
+
+
+def get_checksum(number: int, body: bytes) -> int:
+    return zlib.crc32(body, zlib.crc32(struct.pack("<Q", number)))
+
+
+def encode(number: int, body: bytes) -> bytes:
+    return HEADER.pack(len(body), get_checksum(number, body), number) + body
+
+
+def read_segment(path: str):
+    """
+    Читает целые записи сегмента. Чтение останавливается на первой оборванной или испорченной записи
+
+    :param path: Путь к сегменту
+    :return: Массив пар (номер, тело) и размер целой части сегмента в байтах
+    """
+    entries = list()
+    valid_size = 0
+    with open(path, "rb") as segment:
+        while True:
+            header = segment.read(HEADER.size)
+            if len(header) < HEADER.size:
+                break
+            length, checksum, number = HEADER.unpack(header)
+            body = segment.read(length)
+            if len(body) < length or get_checksum(number, body) != checksum:
+                break
+            entries.append((number, body))
+            valid_size += HEADER.size + length
+    return entries, valid_size
+
+
+class Spool:
+    """
+    Журнал обновлений с пакетным `fsync`, потоками-читателями и сохранением прогресса
+    """
+
+    def __init__(self, directory: str, segment_size: int, workers: int, process: Callable):
+        """
+        :param directory: Каталог журнала
+        :param segment_size: Размер сегмента в байтах, после которого начинается новый
+        :param workers: Количество потоков-читателей
+        :param process: Функция обработки обновления, принимает `updates.UpdateInfo`
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.process = process
+        self.appends = queue.Queue()
+        self.queues = [queue.Queue() for _ in range(workers)]
+        self.segment = None
+        self.segment_written = 0
+        # Номер следующей записи
+        self.next_number = 0
+        # Номера записанных, но еще не обработанных записей по возрастанию: номера выдаются по порядку
+        self.in_flight = deque()
+        # Обработанные записи из `in_flight`, перед которыми есть необработанные
+        self.completed = set()
+        # Номер первой необработанной записи и номер, сохраненный на диске
+        self.checkpoint = 0
+        self.saved_checkpoint = 0
+        self.lock = threading.Lock()
+
+    def get_segments(self) -> list:
+        """
+        Сегменты журнала по возрастанию номера первой записи
+
+        :return: Массив пар (номер первой записи, путь)
+        """
+        segments = list()
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                segments.append((int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]),
+                                 os.path.join(self.directory, name)))
+        return sorted(segments)
+
+    def load_checkpoint(self) -> int:
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT_FILE)) as checkpoint_file:
+                return int(checkpoint_file.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def save_checkpoint(self):
+        """
+        Сохраняет номер первой необработанной записи и удаляет полностью обработанные сегменты
+        """
+        with self.lock:
+            checkpoint = self.checkpoint
+        if checkpoint == self.saved_checkpoint:
+            return
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        with open(path + ".tmp", "w") as checkpoint_file:
+            checkpoint_file.write(str(checkpoint))
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(path + ".tmp", path)
+        self.saved_checkpoint = checkpoint
+        segments = self.get_segments()
+        for (first_number, path), (next_first_number, _) in zip(segments, segments[1:]):
+            # Все записи сегмента меньше первой записи следующего
+            if next_first_number <= checkpoint:
+                os.remove(path)
+
+    def recover(self) -> list:
+        """
+        Читает необработанные записи, оставшиеся с прошлого запуска
+
+        :return: Массив пар (номер, тело)
+        """
+        self.checkpoint = self.saved_checkpoint = self.next_number = self.load_checkpoint()
+        entries = list()
+        for first_number, path in self.get_segments():
+            # Номера не должны повторяться, даже если записи сегмента не сохранились
+            self.next_number = max(self.next_number, first_number)
+            segment_entries, valid_size = read_segment(path)
+            if valid_size < os.path.getsize(path):
+                # Оборванную запись отрезаем, чтобы новые записи не оказались за ней
+                app_logger.warning("Spool segment {} is truncated to {} bytes".format(path, valid_size))
+                with open(path, "r+b") as segment:
+                    segment.truncate(valid_size)
+            for number, body in segment_entries:
+                self.next_number = max(self.next_number, number + 1)
+                if number >= self.checkpoint:
+                    entries.append((number, body))
+        return entries
+
+    def open_segment(self, first_number: int):
+        self.close_segment()
+        # Без буфера: при ошибке записи в памяти не остается хвоста, который допишется при закрытии
+        self.segment = open(os.path.join(self.directory, get_segment_name(first_number)), "ab", buffering=0)
+        self.segment_written = 0
+
+    def close_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def append(self, body: bytes) -> Future:
+        """
+        Ставит тело запроса вебхука в очередь записи
+
+        :param body: Тело запроса
+        :return: Future, который завершается, когда запись надежно на диске
+        """
+        future = Future()
+        self.appends.put((body, future))
+        return future
+
+    def dispatch(self, number: int, body: bytes):
+        update = updates.peek(body)
+        self.queues[update.partition_key() % len(self.queues)].put((number, update))
+
+    def write(self, batch: list):
+        """
+        Пишет пачку записей и сбрасывает ее на диск одним `fsync`
+        """
+        numbered = list()
+        with self.lock:
+            for body, future in batch:
+                numbered.append((self.next_number, body, future))
+                self.in_flight.append(self.next_number)
+                self.next_number += 1
+        started = time.monotonic()
+        size_before = None
+        try:
+            if self.segment is None or self.segment_written >= self.segment_size:
+                self.open_segment(numbered[0][0])
+            size_before = self.segment.tell()
+            data = memoryview(b"".join(encode(number, body) for number, body, _ in numbered))
+            while len(data) > 0:
+                data = data[self.segment.write(data):]
+            os.fsync(self.segment.fileno())
+            self.segment_written += self.segment.tell() - size_before
+        except Exception:
+            # Незаписанную пачку не обрабатываем: телеграм получит ошибку и доставит ее повторно
+            if size_before is not None:
+                self.discard_tail(size_before)
+            with self.lock:
+                for number, _, _ in numbered:
+                    self.completed.add(number)
+                self.advance()
+            self.close_segment()
+            raise
+        metrics.observe("spool_fsync_seconds", time.monotonic() - started)
+        metrics.inc("spool_appended", len(numbered))
+        for number, body, future in numbered:
+            self.dispatch(number, body)
+            future.set_result(number)
+
+    def discard_tail(self, size: int):
+        """
+        Отрезает от текущего сегмента записи неудавшейся пачки. Иначе после перезапуска они обработались бы,
+        хотя телеграм получил ошибку и доставит те же обновления повторно
+
+        :param size: Размер сегмента до пачки в байтах
+        """
+        try:
+            os.ftruncate(self.segment.fileno(), size)
+            os.fsync(self.segment.fileno())
+        except Exception as e:
+            app_logger.error("Error during spool segment truncation: {}".format(str(e)))
+            metrics.inc("spool_truncate_failed")
+
+    def run_writer(self):
+        while True:
+            batch = [self.appends.get()]
+            # Все запросы, пришедшие за время прошлого fsync, ложатся на диск одним fsync
+            while True:
+                try:
+                    batch.append(self.appends.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception as e:
+                app_logger.error("Error during spool append: {}".format(str(e)))
+                metrics.inc("spool_append_failed", len(batch))
+                for _, future in batch:
+                    future.set_exception(e)
+
+    def run_reader(self, reader_queue: queue.Queue):
+        while True:
+            number, update = reader_queue.get()
+            try:
+                self.process(update)
+            except Exception as e:
+                app_logger.error("Error during spooled update {} processing: {}".format(update.update_id, str(e)))
+            self.complete(number)
+
+    def complete(self, number: int):
+        """
+        Отмечает запись обработанной и продвигает номер первой необработанной записи
+        """
+        with self.lock:
+            self.completed.add(number)
+            self.advance()
+
+    def advance(self):
+        # Вызывается под блокировкой. Каждая запись снимается с головы очереди один раз
+        while len(self.in_flight) > 0 and self.in_flight[0] in self.completed:
+            self.completed.discard(self.in_flight.popleft())
+        self.checkpoint = self.in_flight[0] if len(self.in_flight) > 0 else self.next_number
+
+    def run_checkpoints(self):
+        while True:
+            time.sleep(CHECKPOINT_INTERVAL)
+            try:
+                self.save_checkpoint()
+            except Exception as e:
+                app_logger.error("Error during spool checkpoint: {}".format(str(e)))
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = self.recover()
+        if len(entries) > 0:
+            app_logger.info("Replaying {} spooled updates".format(len(entries)))
+            metrics.inc("spool_replayed", len(entries))
+        with self.lock:
+            for number, body in entries:
+                self.in_flight.append(number)
+        for number, body in entries:
+            self.dispatch(number, body)
+        for index, reader_queue in enumerate(self.queues):
+            threading.Thread(target=self.run_reader, args=(reader_queue,), name="spool_reader_{}".format(index),
+                             daemon=True).start()
+        threading.Thread(target=self.run_writer, name="spool_writer", daemon=True).start()
+        threading.Thread(target=self.run_checkpoints, name="spool_checkpoint", daemon=True).start()
+        atexit.register(self.save_checkpoint)
+
+
+__spool = None  # type: Optional[Spool]
+
+
+def is_enabled() -> bool:
+    """
+    Обновления вебхука проходят через журнал
+    """
+    return config.APP_SPOOL_DIR is not None
+
+
+def is_started() -> bool:
+    """
+    Журнал запущен и принимает записи
+    """
+    return __spool is not None
+
+
+def start(process: Callable) -> Optional[Spool]:
+    """
+    Запускает журнал, если задан его каталог, и заново обрабатывает записи, необработанные до остановки
+
+    :param process: Функция обработки обновления, принимает `updates.UpdateInfo`
+    :return: Журнал или None, если он выключен
+    """
+    global __spool
+    if not is_enabled():
+        return None
+    spool = Spool(config.APP_SPOOL_DIR, config.APP_SPOOL_SEGMENT_SIZE, config.APP_SPOOL_WORKERS, process)
+    spool.start()
+    __spool = spool
+    return spool
+
+
+def append(body: bytes) -> Future:
+    """
+    Дописывает тело запроса вебхука в журнал
+
+    :param body: Тело запроса
+    :return: Future, который завершается, когда запись надежно на диске
+    """
+    return __spool.append(body)
@@ -0,0 +1,111 @@
+"""
+Подготовка приложения к работе
+
+При старте дожидаемся доступности БД, применяем миграции только если схема отстает от последней
+ревизии и заранее заполняем кэши, которые нужны почти каждому обработчику. После этого приложение
+считается готовым обслуживать обновления.
+"""
+
+import threading
+import time
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+
+from app import config, db, messages, snapshot, photo_hash
+from app.bot import get_moderator_ids, get_channel, get_me
+from app.logger import logger as app_logger
+
+
+ALEMBIC_CONFIG_FILE = "alembic.ini"
+"""
+Файл конфигурации миграций
+"""
+
+DB_WAIT_INITIAL_DELAY = 0.2
+"""
+Первая пауза между попытками подключения к БД в секундах
+"""
+
+DB_WAIT_MAX_DELAY = 5
+"""
+Максимальная пауза между попытками подключения к БД в секундах
+"""
+
+__ready = threading.Event()
+
+
+def wait_for_db():
+    """
+    Дожидается доступности БД, увеличивая паузу между попытками вдвое.
+    Если БД недоступна дольше `APP_DB_WAIT_TIMEOUT` секунд, выбрасывает исключение
+    """
+    deadline = time.monotonic() + config.APP_DB_WAIT_TIMEOUT
+    delay = DB_WAIT_INITIAL_DELAY
+    while True:
+        try:
+            db.ping()
+            return
+        except Exception as e:
+            if time.monotonic() + delay > deadline:
+                raise Exception("Database is not available: {}".format(str(e)))
+            time.sleep(delay)
+            delay = min(delay * 2, DB_WAIT_MAX_DELAY)
+
+
+def migrate_if_needed() -> bool:
+    """
+    Применяет миграции, если текущая ревизия БД отличается от последней ревизии миграций.
+    Ревизия БД читается одним запросом к таблице `alembic_version`
+
+    :return: True, если миграции применялись
+    """
+    alembic_config = Config(ALEMBIC_CONFIG_FILE)
+    heads = set(ScriptDirectory.from_config(alembic_config).get_heads())
+    with db.get_engine().connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+    if current == heads:
+        return False
+    command.upgrade(alembic_config, "head")
+    return True
+
+
+@db.commit_session
+def load_photo_hashes(session=None):
+    photo_hash.refresh_index()
+
+
+def warm_caches():
+    """
+    Заполняет кэши информации о боте, модераторах и канале, кэш шаблонов сообщений и индекс хэшей фото
+    """
+    messages.warm_up()
+    get_me()
+    get_moderator_ids()
+    get_channel()
+    if photo_hash.is_enabled():
+        load_photo_hashes()
+    elif config.APP_PHOTO_HASH:
+        app_logger.warning("Pillow is not installed, photo duplicates are not detected")
+
+
+def run():
+    """
+    Подготавливает приложение к работе и отмечает его готовым
+    """
+    # Снимок загружаем до заполнения кэшей, чтобы не запрашивать то, что в нем уже есть
+    snapshot.start()
+    wait_for_db()
+    if migrate_if_needed():
+        app_logger.info("Database migrated")
+    warm_caches()
+    __ready.set()
+
+
+def is_ready() -> bool:
+    """
+    Приложение готово обслуживать обновления
+    """
+    return __ready.is_set()
@@ -0,0 +1,114 @@
+"""
+Быстрый разбор входящих обновлений
+
+`telebot.types.Update.de_json` строит полный граф объектов обновления (пользователи, чаты, размеры фото,
+сущности текста), хотя нажатию на кнопку опроса нужны только идентификатор нажатия, пользователь
+и нагрузка кнопки. Поэтому сначала обновление разбирается в словарь быстрым JSON-парсером,
+из него достаются только ключевые поля, а полные объекты телебота строятся лишь для тех
+обработчиков, которым они нужны.
+"""
+
+import json
+from typing import Optional
+
+from telebot import util
+from telebot.types import Update
+
+try:
+    # orjson необязателен: если он не установлен, используется стандартный парсер
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+class UpdateInfo:
+    """
+    Ключевые поля обновления, достаточные для маршрутизации и обработки частых обновлений
+    """
+    __slots__ = ["raw", "update_id", "kind", "chat_id", "user_id", "text", "callback_query_id", "callback_data"]
+
+    def __init__(self, raw: dict):
+        self.raw = raw
+        self.update_id = raw.get("update_id")
+        self.kind = None
+        self.chat_id = None
+        self.user_id = None
+        self.text = None
+        self.callback_query_id = None
+        self.callback_data = None
+        for kind in raw.keys():
+            if kind != "update_id":
+                self.kind = kind
+                break
+        if self.kind == "message":
+            message = raw["message"]
+            self.chat_id = message.get("chat", dict()).get("id")
+            self.user_id = message.get("from", dict()).get("id")
+            self.text = message.get("text")
+        elif self.kind == "callback_query":
+            callback_query = raw["callback_query"]
+            self.callback_query_id = callback_query.get("id")
+            self.user_id = callback_query.get("from", dict()).get("id")
+            self.chat_id = callback_query.get("message", dict()).get("chat", dict()).get("id")
+            self.callback_data = parse_callback_data(callback_query.get("data"))
+
+    def callback_action(self) -> Optional[str]:
+        """
+        Действие нажатой кнопки или None, если обновление не является нажатием на кнопку бота
+        """
+        if self.callback_data is None:
+            return None
+        return self.callback_data.get("a")
+
+    def partition_key(self) -> int:
+        """
+        Ключ распределения обновления между потоками и процессами обработки. У сообщений это чат,
+        у нажатий на кнопки - пользователь: нажатия разных пользователей в одном канале обрабатываются
+        параллельно, а нажатия одного пользователя и сообщения одного чата - по порядку
+        """
+        if self.kind == "callback_query":
+            return self.user_id or self.update_id
+        return self.chat_id or self.user_id or self.update_id
+
+    def command(self) -> Optional[str]:
+        """
+        Команда сообщения без слеша или None, если сообщение не является командой
+        """
+        if self.text is None:
+            return None
+        return util.extract_command(self.text)
+
+    def to_update(self) -> Update:
+        """
+        Строит полный объект обновления телебота
+        """
+        return Update.de_json(self.raw)
+
+
+def parse_callback_data(data: Optional[str]) -> Optional[dict]:
+    """
+    Разбирает нагрузку кнопки. Кнопки бота всегда содержат JSON-объект
+
+    :param data: Нагрузка кнопки
+    :return: Нагрузка в виде словаря или None
+    """
+    if data is None:
+        return None
+    try:
+        callback_data = loads(data)
+    except ValueError:
+        return None
+    if not isinstance(callback_data, dict):
+        return None
+    return callback_data
+
+
+def peek(body: bytes) -> UpdateInfo:
+    """
+    Разбирает тело запроса вебхука
+
+    :param body: Тело запроса
+    :return: Ключевые поля обновления
+    """
+    return UpdateInfo(loads(body))
@@ -1,4 +1,7 @@
 import re
+import threading
+import time
+from collections import OrderedDict
 
 import emoji
 from telebot.types import User as TelebotUser
@@ -33,4 +36,113 @@ def find_emoji_in_text(text):
         if c not in emoji.UNICODE_EMOJI and c not in emoji.UNICODE_EMOJI_ALIAS:
             continue
         emoji_chars.append(c)
-    return emoji_chars
\ No newline at end of file
+    return emoji_chars
+
+
+class TtlCache:
+    """
+    Потокобезопасный кэш значений с временем жизни. Если задан размер, то при переполнении
+    вытесняются давно использованные значения
+    """
+
+    MISSING = object()
+    """
+    Признак отсутствия значения в кэше
+    """
+
+    def __init__(self, ttl: float, size: int = None):
+        """
+        :param ttl: Время жизни значения в секундах
+        :param size: Максимальное количество значений или None, если не ограничено
+        """
+        self.ttl = ttl
+        self.size = size
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def peek(self, key):
+        """
+        Возвращает значение из кэша
+
+        :param key: Ключ
+        :return: Значение или `TtlCache.MISSING`, если значения нет или оно устарело
+        """
+        with self._lock:
+            cached = self._values.get(key)
+            if cached is None or time.monotonic() - cached[1] > self.ttl:
+                return self.MISSING
+            self._values.move_to_end(key)
+            return cached[0]
+
+    def set(self, key, value):
+        """
+        Сохраняет значение в кэш
+
+        :param key: Ключ
+        :param value: Значение
+        """
+        with self._lock:
+            self._put(key, value, time.monotonic())
+
+    def _put(self, key, value, cached_at: float):
+        self._values[key] = (value, cached_at)
+        self._values.move_to_end(key)
+        if self.size is not None:
+            while len(self._values) > self.size:
+                self._values.popitem(last=False)
+
+    def get(self, key, factory):
+        """
+        Возвращает значение из кэша или вычисляет его и сохраняет в кэш
+
+        :param key: Ключ
+        :param factory: Функция без аргументов, вычисляющая значение
+        :return: Значение
+        """
+        value = self.peek(key)
+        if value is not self.MISSING:
+            return value
+        # Значение вычисляем вне блокировки, чтобы не задерживать другие ключи
+        value = factory()
+        self.set(key, value)
+        return value
+
+    def delete(self, key):
+        """
+        Удаляет значение из кэша
+
+        :param key: Ключ
+        """
+        with self._lock:
+            self._values.pop(key, None)
+
+    def clear(self):
+        """
+        Очищает кэш
+        """
+        with self._lock:
+            self._values.clear()
+
+    def dump(self) -> list:
+        """
+        Возвращает неустаревшие значения кэша вместе с их возрастом
+
+        :return: Массив кортежей (ключ, значение, возраст в секундах)
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value, now - cached_at)
+                    for key, (value, cached_at) in self._values.items()
+                    if now - cached_at <= self.ttl]
+
+    def load(self, entries: list):
+        """
+        Загружает значения в кэш с сохранением их возраста. Устаревшие значения пропускаются
+
+        :param entries: Массив кортежей (ключ, значение, возраст в секундах)
+        """
+        now = time.monotonic()
+        with self._lock:
+            for key, value, age in entries:
+                if age <= self.ttl:
+                    self._put(key, value, now - age)
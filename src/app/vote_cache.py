@@ -0,0 +1,207 @@
+"""
+Кэши для быстрого ответа на нажатия кнопок опросов
+
+Чтобы ответить пользователю на нажатие сразу, до записи голоса в БД, нужно знать текст варианта
+ответа и за что пользователь голосовал раньше. Варианты ответа не меняются, поэтому их метаданные
+кэшируются надолго. Голоса пользователей кэшируются ненадолго: кэш обновляется при каждом нажатии,
+а устаревание ограничивает расхождение с БД, если голос изменили на другом экземпляре бота.
+
+Частые нажатия одного пользователя сдерживаются: сверх лимита в скользящем окне голос не пишется
+в БД сразу, а только запоминается в `throttle` до пакетной записи, см. `app.vote_throttle`.
+"""
+
+import threading
+from collections import deque, OrderedDict
+
+from app import config
+from app.utils import TtlCache
+
+
+OPTION_CACHE_TTL = 60
+"""
+Время жизни метаданных варианта ответа в секундах. Ограничивает, как долго после заморозки опроса
+пользователь может получить ответ о принятом голосе
+"""
+
+OPTION_CACHE_SIZE = 10000
+"""
+Максимальное количество вариантов ответа в кэше
+"""
+
+USER_VOTE_CACHE_TTL = 60
+"""
+Время жизни голоса пользователя в кэше в секундах
+"""
+
+USER_VOTE_CACHE_SIZE = 100000
+"""
+Максимальное количество голосов пользователей в кэше
+"""
+
+NO_VOTE = 0
+"""
+Значение в кэше голосов для пользователя, который не голосовал. Идентификаторы вариантов ответа
+всегда положительные
+"""
+
+LOCK_STRIPES = 64
+"""
+Количество блокировок, по которым распределяются пары опрос-пользователь
+"""
+
+
+class OptionMeta:
+    """
+    Метаданные варианта ответа, достаточные для ответа на нажатие
+    """
+    __slots__ = ["id", "poll_id", "text", "poll_is_final"]
+
+    def __init__(self, option_id: int, poll_id: int, text: str, poll_is_final: bool):
+        self.id = option_id
+        self.poll_id = poll_id
+        self.text = text
+        self.poll_is_final = poll_is_final
+
+
+options = TtlCache(OPTION_CACHE_TTL, OPTION_CACHE_SIZE)
+"""
+Метаданные вариантов ответа по идентификатору варианта
+"""
+
+user_votes = TtlCache(USER_VOTE_CACHE_TTL, USER_VOTE_CACHE_SIZE)
+"""
+Вариант ответа, за который проголосовал пользователь, по паре (опрос, пользователь)
+"""
+
+__locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+def get_user_lock(poll_id: int, user_id: int) -> threading.Lock:
+    """
+    Возвращает блокировку пары опрос-пользователь, чтобы одновременные нажатия одного
+    пользователя обрабатывались по очереди
+
+    :param poll_id: Опрос
+    :param user_id: Идентификатор пользователя в телеграме
+    """
+    return __locks[hash((poll_id, user_id)) % LOCK_STRIPES]
+
+
+class VoteThrottle:
+    """
+    Скользящее окно нажатий по паре опрос-пользователь и итоговые голоса сдержанных нажатий
+    """
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        # Время нажатий в окне по паре опрос-пользователь
+        self.taps = dict()
+        # Итоговый голос сдержанных нажатий, еще не записанный в БД
+        self.pending = OrderedDict()
+        # Пары, итоговые голоса которых записываются в БД прямо сейчас
+        self.flushing = set()
+        # Количество неудачных записей итогового голоса по паре опрос-пользователь
+        self.failures = dict()
+        self.lock = threading.Lock()
+
+    def hit(self, key: tuple, now: float) -> bool:
+        """
+        Учитывает нажатие
+
+        :param key: Пара опрос-пользователь
+        :param now: Время нажатия по `time.monotonic`
+        :return: True, если голос можно записать сразу, и False, если нажатие сдержано
+        """
+        if self.limit <= 0:
+            return True
+        with self.lock:
+            taps = self.taps.get(key)
+            if taps is None:
+                taps = deque()
+                self.taps[key] = taps
+            while len(taps) > 0 and taps[0] <= now - self.window:
+                taps.popleft()
+            taps.append(now)
+            # Пока итоговый голос ждет записи, новые голоса тоже ждут, иначе запись обгонит более новый голос
+            return len(taps) <= self.limit and key not in self.pending and key not in self.flushing
+
+    def defer(self, key: tuple, option_id: int):
+        """
+        Запоминает итоговый голос сдержанного нажатия
+
+        :param key: Пара опрос-пользователь
+        :param option_id: Вариант ответа или `NO_VOTE`
+        """
+        with self.lock:
+            self.pending[key] = option_id
+
+    def peek(self, key: tuple):
+        """
+        Возвращает итоговый голос, ожидающий записи, или `TtlCache.MISSING`
+        """
+        with self.lock:
+            return self.pending.get(key, TtlCache.MISSING)
+
+    def take(self, now: float) -> list:
+        """
+        Забирает итоговые голоса для записи в БД и забывает нажатия за пределами окна
+
+        :param now: Текущее время по `time.monotonic`
+        :return: Массив пар (пара опрос-пользователь, вариант ответа)
+        """
+        with self.lock:
+            items = list(self.pending.items())
+            self.pending.clear()
+            self.flushing.update(key for key, _ in items)
+            for key in [key for key, taps in self.taps.items() if taps[-1] <= now - self.window]:
+                del self.taps[key]
+            return items
+
+    def done(self, keys: list):
+        """
+        Отмечает, что итоговые голоса записаны
+        """
+        with self.lock:
+            self.flushing.difference_update(keys)
+            for key in keys:
+                self.failures.pop(key, None)
+
+    def retry(self, items: list, max_attempts: int) -> list:
+        """
+        Возвращает итоговые голоса, которые не удалось записать, в ожидание следующей записи.
+        Если за время записи пользователь успел нажать еще раз, ждет записи более новый голос
+
+        :param items: Массив пар (пара опрос-пользователь, вариант ответа), взятых `take`
+        :param max_attempts: Сколько раз можно не записать голос, прежде чем он будет отброшен
+        :return: Пары опрос-пользователь, голоса которых отброшены
+        """
+        dropped = list()
+        with self.lock:
+            for key, option_id in items:
+                self.flushing.discard(key)
+                attempts = self.failures.get(key, 0) + 1
+                if attempts >= max_attempts and key not in self.pending:
+                    self.failures.pop(key, None)
+                    dropped.append(key)
+                    continue
+                self.failures[key] = attempts
+                self.pending.setdefault(key, option_id)
+        return dropped
+
+    def get_unsettled(self) -> set:
+        """
+        Пары опрос-пользователь, итоговые голоса которых еще не записаны в БД
+        """
+        with self.lock:
+            return set(self.pending) | self.flushing
+
+    def is_idle(self) -> bool:
+        with self.lock:
+            return len(self.pending) == 0 and len(self.flushing) == 0
+
+
+throttle = VoteThrottle(config.APP_VOTE_THROTTLE_LIMIT, config.APP_VOTE_THROTTLE_WINDOW)
+"""
+Сдерживание частых нажатий на кнопки опросов
+"""
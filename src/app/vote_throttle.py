@@ -0,0 +1,108 @@
+"""
+Запись итоговых голосов сдержанных нажатий
+
+Пользователь может быстро нажимать на кнопку опроса, и каждое нажатие переключало бы голос в БД
+и перерисовывало кнопки поста в канале, расходуя общий лимит запросов бота к Bot API. Поэтому нажатия
+каждой пары опрос-пользователь считаются в скользящем окне `APP_VOTE_THROTTLE_WINDOW` секунд: первые
+`APP_VOTE_THROTTLE_LIMIT` нажатий обрабатываются как обычно, а остальные получают ответ по кэшу голосов
+без обращения к БД, и запоминается только итоговый голос. Раз в `FLUSH_INTERVAL` секунд итоговые
+голоса записываются в БД одним пакетом, а кнопки каждого затронутого поста перерисовываются один раз.
+
+Если пакет не записался, его голоса ждут следующей записи (метрика `votes_throttle_retried`), а после
+`MAX_FLUSH_ATTEMPTS` неудач подряд отбрасываются с записью пар опрос-пользователь в лог (`votes_throttle_dropped`).
+
+Сдержанные нажатия считаются в метрике `votes_throttled`, записанные итоговые голоса - в `votes_throttle_flushed`.
+"""
+
+import atexit
+import threading
+import time
+from typing import Optional
+
+from app import db, repo, metrics, vote_cache
+from app.bot import refresh_post_votes
+from app.logger import logger as app_logger
+
+
+FLUSH_INTERVAL = 1
+"""
+Интервал между записями итоговых голосов в секундах
+"""
+
+MAX_FLUSH_ATTEMPTS = 30
+"""
+Сколько раз подряд можно не записать итоговый голос, прежде чем он будет отброшен
+"""
+
+
+@db.commit_session
+def persist_votes(mutations: list, session=None) -> Optional[bool]:
+    """
+    Записывает итоговые голоса одной транзакцией
+
+    :param mutations: Массив изменений `VoteMutation`
+    :param session:
+    :return: True, если голоса записаны
+    """
+    repo.apply_votes(mutations)
+    return True
+
+
+def flush_votes():
+    """
+    Записывает в БД итоговые голоса сдержанных нажатий и перерисовывает кнопки их постов
+    """
+    items = vote_cache.throttle.take(time.monotonic())
+    if len(items) == 0:
+        return
+    keys = [key for key, _ in items]
+    try:
+        mutations = [repo.VoteMutation(poll_id, user_id, option_id if option_id != vote_cache.NO_VOTE else None)
+                     for (poll_id, user_id), option_id in items]
+        persisted = persist_votes(mutations)
+    except Exception as e:
+        app_logger.error("Error during throttled votes persisting: {}".format(str(e)))
+        persisted = False
+    if not persisted:
+        # Голоса не записаны: запишем их следующим пакетом
+        dropped = vote_cache.throttle.retry(items, MAX_FLUSH_ATTEMPTS)
+        metrics.inc("votes_throttle_retried", len(items) - len(dropped))
+        if len(dropped) > 0:
+            # Отброшенные голоса так и не попали в БД: кэш больше ей не соответствует
+            for key in dropped:
+                vote_cache.user_votes.delete(key)
+            metrics.inc("votes_throttle_dropped", len(dropped))
+            app_logger.error("Throttled votes of (poll, user) pairs {} are dropped after {} failed flushes"
+                             .format(dropped, MAX_FLUSH_ATTEMPTS))
+        return
+    vote_cache.throttle.done(keys)
+    metrics.inc("votes_throttle_flushed", len(items))
+    for poll_id in sorted({poll_id for poll_id, _ in keys}):
+        refresh_post_votes(poll_id)
+
+
+def run_forever():
+    """
+    Периодически записывает итоговые голоса
+    """
+    while True:
+        try:
+            flush_votes()
+        except Exception as e:
+            app_logger.error("Error during throttled votes flushing: {}".format(str(e)))
+        time.sleep(FLUSH_INTERVAL)
+
+
+def start_worker() -> Optional[threading.Thread]:
+    """
+    Запускает запись итоговых голосов в фоновом потоке, если сдерживание включено
+
+    :return: Поток записи или None, если сдерживание выключено
+    """
+    if vote_cache.throttle.limit <= 0:
+        return None
+    # Итоговые голоса, не дождавшиеся записи, записываем при остановке процесса
+    atexit.register(flush_votes)
+    worker = threading.Thread(target=run_forever, name="vote_throttle", daemon=True)
+    worker.start()
+    return worker
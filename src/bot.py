@@ -1,33 +1,189 @@
-import telebot
+import asyncio
+import os
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
 from aiohttp import web
-from app.bot import bot, config
+from app import capture, dedup, export, memory, metrics, moderation, polling, prefork, retention, spool, \
+    startup, updates, vote_throttle
+from app.bot import bot, config, process_vote, VOTE_ACTIONS
+from app.logger import logger as app_logger
+
+
+def prepare():
+    """
+    Подготавливает приложение к работе и запускает фоновые задачи
+    """
+    # Запись входящих обновлений включаем до старта, чтобы журнал начинался с первого обновления
+    capture.start()
+    startup.run()
+    if prefork.runs_shared_tasks():
+        # Архивация старых опросов работает в фоне при любом способе запуска
+        retention.start_worker()
+        # Просроченные предложки передаются другим модераторам
+        moderation.start_worker()
+    # Итоговые голоса сдержанных нажатий записываются пакетами. Сдержанные голоса живут в памяти
+    # процесса, поэтому их записывает каждый процесс-обработчик
+    vote_throttle.start_worker()
 
 
 if __name__ == "__main__":
 
     if config.APP_RUN_METHOD == 'polling':
 
+        # При остановке контейнера завершаемся штатно, чтобы сработали обработчики завершения
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        prepare()
         bot.remove_webhook()
-        bot.polling(none_stop=True, timeout=9999)
+        polling.run()
 
     elif config.APP_RUN_METHOD == 'webhook':
 
         app = web.Application()
 
+        async def start_prepare(application):
+            # Сервер начинает слушать порт сразу, а подготовка идет в фоне.
+            # До ее окончания /ready и вебхук отвечают 503
+            loop = asyncio.get_event_loop()
+            application["loop"] = loop
+            application["prepare"] = loop.run_in_executor(None, prepare_webhook)
+            application["prepare"].add_done_callback(exit_if_not_prepared)
+
+        def exit_if_not_prepared(future):
+            if future.exception() is not None:
+                # Без подготовки бот работать не может: завершаемся, чтобы контейнер перезапустили
+                app_logger.error("Error during startup: {}".format(str(future.exception())))
+                os._exit(1)
+
+        def prepare_webhook():
+            prepare()
+            if spool.is_enabled():
+                # Обработчики телебота вызываются прямо в потоках-читателях журнала, чтобы знать,
+                # когда обновление обработано
+                bot.threaded = False
+                spool.start(dedup.mark_after_processing(process_spooled))
+
+        def process_spooled(update: updates.UpdateInfo):
+            """
+            Обрабатывает обновление из журнала в потоке-читателе журнала. Повторы отсеиваются снаружи,
+            см. `dedup.mark_after_processing`
+            """
+            if config.APP_ASYNC and async_bot.is_async(update):
+                asyncio.run_coroutine_threadsafe(async_bot.process_update(update), app["loop"]).result()
+            else:
+                polling.handle_update(update)
+
+        def is_ready() -> bool:
+            return startup.is_ready() and (not spool.is_enabled() or spool.is_started())
+
+        app.on_startup.append(start_prepare)
+
+        if config.APP_ASYNC:
+            # Асинхронный режим импортируем только при необходимости: ему нужны асинхронные драйверы БД
+            from app import async_bot
+
+            async def close_async_bot(application):
+                await async_bot.close()
+
+            app.on_cleanup.append(close_async_bot)
+
+        async def ready(request):
+            if is_ready():
+                return web.Response(text="ready")
+            return web.Response(status=503)
+
+        async def show_metrics(request):
+            if request.match_info.get('token') != bot.token:
+                return web.Response(status=403)
+            return web.Response(text=metrics.render())
+
+        async def profile_memory(request):
+            if request.match_info.get('token') != bot.token:
+                return web.Response(status=403)
+            # Команда как у `/mem` в чате, например `?command=diff 1 2`. Снимки и подсчет объектов
+            # занимают заметное время, поэтому выполняются вне цикла событий
+            arguments = request.query.get("command", "").split()
+            loop = asyncio.get_event_loop()
+            report = await loop.run_in_executor(None, memory.run_command, arguments)
+            return web.Response(text=report)
+
+        async def export_results(request):
+            if request.match_info.get('token') != bot.token:
+                return web.Response(status=403)
+            kind = request.query.get("kind", export.KIND_POLLS)
+            export_format = request.query.get("format", export.FORMAT_CSV)
+            if kind not in export.QUERIES or export_format not in export.RENDERERS:
+                return web.Response(status=400)
+            response = web.StreamResponse(headers={"Content-Type": export.CONTENT_TYPES[export_format]})
+            response.enable_chunked_encoding()
+            await response.prepare(request)
+            # Курсор БД читается в одном отдельном потоке: драйверы не любят, когда соединение
+            # переходит между потоками, а цикл событий не должен ждать БД
+            chunks = export.export(kind, export_format)
+            executor = ThreadPoolExecutor(1)
+            loop = asyncio.get_event_loop()
+            try:
+                while True:
+                    chunk = await loop.run_in_executor(executor, next, chunks, None)
+                    if chunk is None:
+                        break
+                    await response.write(chunk.encode("utf-8"))
+            finally:
+                await loop.run_in_executor(executor, chunks.close)
+                executor.shutdown(wait=False)
+            await response.write_eof()
+            return response
+
         async def handle(request):
             if request.match_info.get('token') == bot.token:
-                request_body_dict = await request.json()
-                update = telebot.types.Update.de_json(request_body_dict)
-                bot.process_new_updates([update])
+                if not is_ready():
+                    # Телеграм повторит доставку обновления позже
+                    return web.Response(status=503)
+                body = await request.read()
+                update = updates.peek(body)
+                if not prefork.is_owner(update):
+                    # Обновления чата обрабатывает один процесс, в котором живут его кэши
+                    return await prefork.forward(update, body)
+                capture.record(update.raw)
+                if spool.is_enabled():
+                    # Отвечаем, как только обновление надежно записано: обработают его читатели журнала
+                    await asyncio.wrap_future(spool.append(body))
+                    return web.Response()
+                # Повторную доставку подтверждаем без обработки, чтобы телеграм перестал ее присылать
+                if await dedup.is_duplicate_async(update.raw):
+                    return web.Response()
+                if config.APP_ASYNC:
+                    await async_bot.process_update(update)
+                elif update.callback_action() in VOTE_ACTIONS:
+                    # Нажатия на кнопки опросов обрабатываем без построения полного объекта обновления
+                    bot.worker_pool.put(process_vote, update.callback_query_id, update.user_id, update.callback_data)
+                else:
+                    bot.process_new_updates([update.to_update()])
                 return web.Response()
             else:
                 return web.Response(status=403)
 
+        app.router.add_get('/ready', ready)
         app.router.add_post('/{token}/', handle)
+        app.router.add_get('/{token}/metrics', show_metrics)
+        app.router.add_get('/{token}/export', export_results)
+        app.router.add_get('/{token}/memory', profile_memory)
+
+        if prefork.is_enabled():
+            # Другие процессы пересылают сюда обновления чатов, которыми владеет этот процесс
+            prefork.serve_forwarded(app, handle)
+
+        def serve():
+            web.run_app(
+                app,
+                host="0.0.0.0",
+                port=443,
+                reuse_port=prefork.is_enabled()
+            )
 
-        web.run_app(
-            app,
-            host="0.0.0.0",
-            port=443
-        )
+        prefork.install_event_loop()
+        if prefork.is_enabled():
+            prefork.run(serve)
+        else:
+            serve()
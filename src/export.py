@@ -0,0 +1,36 @@
+"""
+Выгрузка результатов опросов из командной строки
+
+Например, выгрузить голоса в JSONL:
+```bash
+python export.py votes --format jsonl --output votes.jsonl
+```
+"""
+
+import argparse
+import sys
+
+from app import export
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Выгрузка результатов опросов")
+    parser.add_argument("kind",
+                        choices=[export.KIND_POLLS, export.KIND_VOTES],
+                        help="Опросы с количеством голосов по вариантам ответа или отдельные голоса")
+    parser.add_argument("--format",
+                        choices=[export.FORMAT_CSV, export.FORMAT_JSONL],
+                        default=export.FORMAT_CSV,
+                        help="Формат выгрузки")
+    parser.add_argument("--output",
+                        help="Файл выгрузки. По умолчанию выгрузка пишется в стандартный вывод")
+    args = parser.parse_args()
+
+    output = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        for chunk in export.export(args.kind, args.format):
+            output.write(chunk)
+    finally:
+        if output is not sys.stdout:
+            output.close()
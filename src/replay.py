@@ -0,0 +1,51 @@
+"""
+Воспроизведение записанных обновлений на локальной заглушке Bot API
+
+Например, воспроизвести журнал в 10 раз быстрее на отдельной БД:
+```bash
+APP_DATABASE_URL=sqlite:///../data/replay.db python replay.py ../data/capture/*.jsonl.gz --speed 10
+```
+"""
+
+import argparse
+import logging
+
+# Заглушку нужно поднять до первых запросов бота к Bot API
+from app.replay import StubBotApi, read_log, replay
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных обновлений")
+    parser.add_argument("logs", nargs="+", help="Файлы журнала обновлений")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Во сколько раз ускорить исходные интервалы. 0 - подавать обновления без пауз")
+    parser.add_argument("--workers", type=int, default=4, help="Количество потоков обработки")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="Задержка ответа заглушки Bot API в миллисекундах")
+    args = parser.parse_args()
+
+    stub = StubBotApi(args.api_latency / 1000)
+    stub.start()
+
+    from app import startup, vote_throttle
+    from app.bot import bot, logger
+    from app.polling import process_update
+
+    # Отладочный лог каждого запроса к Bot API искажает замеры
+    logger.setLevel(logging.WARNING)
+
+    startup.run()
+    vote_throttle.start_worker()
+    # Обработчики телебота вызываются прямо в потоках воспроизведения
+    bot.threaded = False
+    report = replay(read_log(args.logs), args.speed, args.workers, process_update)
+    vote_throttle.flush_votes()
+
+    print("Обновлений: {updates}, ошибок: {errors}, время: {seconds:.2f} с, "
+          "пропускная способность: {throughput:.1f} обновлений/с".format(**report))
+    print("Задержка: p50 {:.1f} мс, p90 {:.1f} мс, p99 {:.1f} мс, max {:.1f} мс".format(
+        report["latency_p50"] * 1000, report["latency_p90"] * 1000,
+        report["latency_p99"] * 1000, report["latency_max"] * 1000))
+    print("Запросы к Bot API: " + ", ".join("{} {}".format(method, calls)
+                                            for method, calls in sorted(stub.calls.items())))
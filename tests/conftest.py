@@ -0,0 +1,88 @@
+"""
+Общая подготовка тестов
+
+Приложение читает конфигурацию из переменных окружения при импорте, а шаблоны сообщений и миграции
+ищет относительно `src`, поэтому окружение задается до первого импорта `app`. Тесты работают
+с отдельной БД SQLite во временном каталоге, а запросы бота к Bot API уходят в локальную заглушку
+`app.replay.StubBotApi`.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+DATA_DIR = tempfile.mkdtemp(prefix="cats-bot-tests-")
+
+os.environ.update({
+    "APP_BOT_TOKEN": "1:test",
+    "APP_BOT_ADMIN_ID": "1",
+    "APP_CHANNEL_ID": "@channel",
+    "APP_RUN_METHOD": "polling",
+    "APP_DATABASE_URL": "sqlite:///{}".format(os.path.join(DATA_DIR, "db.db")),
+    "APP_LOG_FILENAME": os.path.join(DATA_DIR, "app.log"),
+})
+for name in ["APP_BOT_ADMIN_IDS", "APP_CHANNEL_IDS", "APP_DATABASE_READ_URL", "APP_DEDUP_SHARED",
+             "APP_SNAPSHOT_FILE", "APP_SPOOL_DIR", "APP_CAPTURE_DIR", "APP_PHOTO_HASH"]:
+    os.environ.pop(name, None)
+sys.path.insert(0, SRC_DIR)
+
+from app import db, models, startup, vote_cache  # noqa: E402
+from app import bot as app_bot  # noqa: E402
+from app.replay import StubBotApi  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def src_dir():
+    """
+    Рабочий каталог приложения
+    """
+    cwd = os.getcwd()
+    os.chdir(SRC_DIR)
+    yield SRC_DIR
+    os.chdir(cwd)
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def bot_api():
+    """
+    Заглушка Bot API на все тесты
+    """
+    stub = StubBotApi(0)
+    stub.start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture(scope="session")
+def schema():
+    """
+    Схема БД, созданная миграциями
+    """
+    startup.migrate_if_needed()
+
+
+@pytest.fixture
+def database(schema, bot_api):
+    """
+    Пустая БД и пустые кэши процесса перед каждым тестом
+    """
+    with db.get_engine().begin() as connection:
+        for table in reversed(models.Base.metadata.sorted_tables):
+            connection.execute(table.delete())
+    for cache in [app_bot.identity_cache, app_bot.emoji_sets_cache, app_bot.poll_messages_cache,
+                  vote_cache.options, vote_cache.user_votes]:
+        cache.clear()
+    vote_cache.throttle.taps.clear()
+    vote_cache.throttle.pending.clear()
+    vote_cache.throttle.flushing.clear()
+    vote_cache.throttle.failures.clear()
+    bot_api.calls.clear()
+    bot_api.last_params.clear()
+    bot_api.files.clear()
+    yield db
@@ -0,0 +1,59 @@
+"""
+Обновления телеграма для тестов
+"""
+
+import json
+from itertools import count
+
+from telebot.types import Message, CallbackQuery
+
+ids = count(1000)
+
+
+def make_user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": "User {}".format(user_id)}
+
+
+def make_message(chat_id: int, text: str = None, photo: bool = False, user_id: int = None) -> Message:
+    """
+    Сообщение в личном чате с ботом
+
+    :param chat_id: Чат
+    :param text: Текст сообщения
+    :param photo: Прикрепить фото
+    :param user_id: Отправитель. По умолчанию совпадает с чатом
+    """
+    message = {
+        "message_id": next(ids),
+        "date": 0,
+        "chat": {"id": chat_id, "type": "private"},
+        "from": make_user(user_id if user_id is not None else chat_id),
+    }
+    if text is not None:
+        message["text"] = text
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    if photo:
+        file_id = "photo-{}".format(next(ids))
+        message["photo"] = [{"file_id": file_id + "-small", "file_unique_id": file_id + "-small",
+                             "width": 90, "height": 90},
+                            {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 1280}]
+    return Message.de_json(message)
+
+
+def make_call(chat_id: int, data: dict, user_id: int = None, message_id: int = 1) -> CallbackQuery:
+    """
+    Нажатие на кнопку под сообщением бота
+
+    :param chat_id: Чат сообщения с кнопкой
+    :param data: Нагрузка кнопки
+    :param user_id: Нажавший пользователь. По умолчанию совпадает с чатом
+    :param message_id: Сообщение с кнопкой
+    """
+    return CallbackQuery.de_json({
+        "id": str(next(ids)),
+        "from": make_user(user_id if user_id is not None else chat_id),
+        "chat_instance": "test",
+        "data": json.dumps(data),
+        "message": {"message_id": message_id, "date": 0, "chat": {"id": chat_id, "type": "private"}},
+    })
@@ -0,0 +1,91 @@
+"""
+Пакетное применение изменений голосов
+"""
+
+from sqlalchemy import select
+
+from app import db, models, repo
+from app.repo import VoteMutation
+
+
+@db.commit_session
+def create_poll(emojis: list, session=None):
+    poll = repo.create_poll(emojis)
+    session.flush()
+    return poll.id, [option.id for option in poll.options]
+
+
+@db.commit_session
+def apply_votes(mutations: list, session=None) -> dict:
+    return repo.apply_votes(mutations)
+
+
+@db.commit_session
+def freeze_poll(poll_id: int, session=None):
+    repo.freeze_poll(poll_id)
+
+
+def get_votes() -> list:
+    table = models.PollVote.__table__
+    with db.get_engine().connect() as connection:
+        return sorted(connection.execute(select(table.c.poll_id, table.c.user_id, table.c.option_id)))
+
+
+def get_votes_totals() -> dict:
+    table = models.Poll.__table__
+    with db.get_engine().connect() as connection:
+        return dict(connection.execute(select(table.c.id, table.c.votes_total)).all())
+
+
+def test_last_mutation_wins(database):
+    poll_id, (first, second) = create_poll(["😺", "😿"])
+    deltas = apply_votes([VoteMutation(poll_id, 1, first), VoteMutation(poll_id, 2, first),
+                          VoteMutation(poll_id, 1, second), VoteMutation(poll_id, 3, second),
+                          VoteMutation(poll_id, 3, None)])
+    assert deltas == {first: 1, second: 1}
+    assert get_votes() == [(poll_id, 1, second), (poll_id, 2, first)]
+    deltas = apply_votes([VoteMutation(poll_id, 1, first), VoteMutation(poll_id, 2, None)])
+    assert deltas == {second: -1}
+    assert get_votes() == [(poll_id, 1, first)]
+    assert get_votes_totals() == {poll_id: 1}
+
+
+def test_skips_frozen_polls_and_foreign_options(database):
+    poll_id, (option_id, _) = create_poll(["😺", "😿"])
+    frozen_poll_id, (frozen_option_id,) = create_poll(["🙀"])
+    freeze_poll(frozen_poll_id)
+    deltas = apply_votes([VoteMutation(frozen_poll_id, 1, frozen_option_id),
+                          VoteMutation(poll_id, 1, frozen_option_id),
+                          VoteMutation(poll_id, 2, option_id)])
+    assert deltas == {option_id: 1}
+    assert get_votes() == [(poll_id, 2, option_id)]
+
+
+def test_pairs_outside_batch_are_untouched(database):
+    first_poll_id, (first_option_id,) = create_poll(["😺"])
+    second_poll_id, (second_option_id,) = create_poll(["😿"])
+    apply_votes([VoteMutation(first_poll_id, 1, first_option_id), VoteMutation(second_poll_id, 2, second_option_id)])
+    # Пары (первый опрос, 2) и (второй опрос, 1) не входят в пакет
+    apply_votes([VoteMutation(first_poll_id, 2, None), VoteMutation(second_poll_id, 1, None)])
+    assert get_votes() == [(first_poll_id, 1, first_option_id), (second_poll_id, 2, second_option_id)]
+
+
+def test_concurrent_vote_is_moved(database, monkeypatch):
+    poll_id, (first, second) = create_poll(["😺", "😿"])
+    apply_votes([VoteMutation(poll_id, 1, first)])
+    get_votes_by_pairs = repo.get_votes_by_pairs
+    reads = list()
+
+    def read_before_concurrent_vote(pairs, for_update=False):
+        reads.append(for_update)
+        if len(reads) == 1:
+            # Голос пользователя 1 записан другим экземпляром бота уже после чтения
+            return dict()
+        return get_votes_by_pairs(pairs, for_update=for_update)
+
+    monkeypatch.setattr(repo, "get_votes_by_pairs", read_before_concurrent_vote)
+    deltas = apply_votes([VoteMutation(poll_id, 1, second), VoteMutation(poll_id, 2, second)])
+    assert reads == [False, True]
+    assert deltas == {first: -1, second: 2}
+    assert get_votes() == [(poll_id, 1, second), (poll_id, 2, second)]
+    assert get_votes_totals() == {poll_id: 2}
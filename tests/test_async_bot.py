@@ -0,0 +1,45 @@
+"""
+Асинхронный режим бота
+"""
+
+import asyncio
+
+import pytest
+from telebot import apihelper, asyncio_helper
+
+from app import bot as sync_bot
+from app import async_bot
+
+
+@pytest.fixture
+def async_bot_api(database, bot_api, monkeypatch):
+    # Асинхронный клиент Bot API ходит в ту же заглушку
+    monkeypatch.setattr(asyncio_helper, "API_URL", apihelper.API_URL)
+    return bot_api
+
+
+def test_help_reuses_identity_cache(async_bot_api):
+    async def send_help_twice():
+        try:
+            await async_bot.send_help(5)
+            await async_bot.send_help(6)
+        finally:
+            await async_bot.close()
+
+    # Канал уже в кэше синхронного бота, например после прогрева при старте или из снимка
+    sync_bot.get_channel()
+    assert async_bot_api.calls == {"getChat": 1}
+    asyncio.run(send_help_twice())
+    assert async_bot_api.calls == {"getChat": 1, "sendMessage": 2}
+
+
+def test_help_fills_identity_cache(async_bot_api):
+    async def send_help():
+        try:
+            await async_bot.send_help(5)
+        finally:
+            await async_bot.close()
+
+    asyncio.run(send_help())
+    sync_bot.get_channel()
+    assert async_bot_api.calls == {"getChat": 1, "sendMessage": 1}
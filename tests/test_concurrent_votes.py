@@ -0,0 +1,95 @@
+"""
+Одновременные нажатия на разных обработчиках: голоса записываются через upsert в общую БД,
+и ни один голос не теряется и не задваивается
+"""
+
+import random
+import threading
+
+from sqlalchemy import select
+
+from app import bot, db, models, repo, vote_cache
+
+WORKERS = 8
+TOGGLES = 40
+USERS = 6
+
+
+@db.commit_session
+def create_poll(emojis: list, session=None):
+    poll = repo.create_poll(emojis)
+    session.flush()
+    return poll.id, [option.id for option in poll.options]
+
+
+def race(target, workers: int = WORKERS) -> list:
+    """
+    Запускает функцию одновременно в нескольких потоках
+
+    :param target: Функция от номера потока, возвращающая массив результатов
+    :return: Результаты всех потоков
+    """
+    barrier = threading.Barrier(workers)
+    results = list()
+    lock = threading.Lock()
+
+    def run(index: int):
+        barrier.wait()
+        worker_results = target(index)
+        with lock:
+            results.extend(worker_results)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def get_votes(poll_id: int) -> list:
+    with db.get_engine().connect() as connection:
+        return list(connection.execute(select(models.PollVote.__table__.c.user_id,
+                                              models.PollVote.__table__.c.option_id)
+                                       .where(models.PollVote.__table__.c.poll_id == poll_id)))
+
+
+def get_votes_total(poll_id: int) -> int:
+    with db.get_engine().connect() as connection:
+        return connection.execute(select(models.Poll.__table__.c.votes_total)
+                                  .where(models.Poll.__table__.c.id == poll_id)).scalar()
+
+
+def test_toggles_race(database):
+    polls = [create_poll(["😺", "😿", "🙀"]), create_poll(["😺", "😿"])]
+
+    def toggle(index: int) -> list:
+        generator = random.Random(index)
+        results = list()
+        for _ in range(TOGGLES):
+            poll_id, option_ids = generator.choice(polls)
+            option_id = generator.choice(option_ids + [vote_cache.NO_VOTE])
+            results.append(bot.persist_vote(poll_id, generator.randrange(USERS), option_id))
+        return results
+
+    results = race(toggle)
+    # Голос не записан только при ошибке транзакции
+    assert results == [True] * WORKERS * TOGGLES
+    for poll_id, _ in polls:
+        votes = get_votes(poll_id)
+        users = [user_id for user_id, _ in votes]
+        assert len(users) == len(set(users))
+        assert get_votes_total(poll_id) == len(votes)
+
+    # Все обработчики одновременно голосуют всеми пользователями за один вариант: каждый голос
+    # вставляется одним и переносится остальными
+    def vote_all(index: int) -> list:
+        return [bot.persist_vote(poll_id, user_id, option_ids[0])
+                for poll_id, option_ids in polls
+                for user_id in range(USERS)]
+
+    results = race(vote_all)
+    assert results == [True] * WORKERS * USERS * len(polls)
+    for poll_id, option_ids in polls:
+        assert sorted(get_votes(poll_id)) == [(user_id, option_ids[0]) for user_id in range(USERS)]
+        assert get_votes_total(poll_id) == USERS
@@ -0,0 +1,40 @@
+"""
+Отсев повторно доставленных обновлений
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from app import config, dedup
+
+
+@pytest.fixture
+def shared_dedup(database, monkeypatch):
+    monkeypatch.setattr(config, "APP_DEDUP_SHARED", True)
+    monkeypatch.setattr(dedup, "window", dedup.UpdateWindow(config.APP_DEDUP_WINDOW_SIZE,
+                                                            config.APP_DEDUP_WINDOW_TTL))
+
+
+def test_shared_mark_runs_off_event_loop(shared_dedup, monkeypatch):
+    threads = list()
+    mark_shared = dedup._mark_shared
+
+    def record_thread(keys: list):
+        threads.append(threading.current_thread())
+        return mark_shared(keys)
+
+    monkeypatch.setattr(dedup, "_mark_shared", record_thread)
+
+    async def check(update: dict) -> bool:
+        return await dedup.is_duplicate_async(update)
+
+    update = {"update_id": 1, "callback_query": {"id": "call"}}
+    assert asyncio.run(check(update)) is False
+    assert asyncio.run(check(update)) is True
+    assert len(threads) == 1 and threads[0] is not threading.current_thread()
+    # Другой экземпляр бота со своим окном видит отметку в общей БД
+    monkeypatch.setattr(dedup, "window", dedup.UpdateWindow(config.APP_DEDUP_WINDOW_SIZE,
+                                                            config.APP_DEDUP_WINDOW_TTL))
+    assert asyncio.run(check({"update_id": 2, "callback_query": {"id": "call"}})) is True
@@ -0,0 +1,22 @@
+"""
+Сообщения приложения: кэш шаблонов ведет себя как `emoji.emojize(i18n.t(...))`
+"""
+
+import emoji
+from i18n import t as i18n_t
+
+from app.messages import t
+
+
+def test_emoji_codes_in_values_are_converted():
+    text = t("app.poll.vote.voted", emoji=":cat_face:")
+    assert text == emoji.emojize(i18n_t("app.poll.vote.voted", emoji=":cat_face:"))
+    assert ":cat_face:" not in text
+
+
+def test_plain_values_match_uncached_translation():
+    assert t("app.poll.vote.voted", emoji="1") == emoji.emojize(i18n_t("app.poll.vote.voted", emoji="1"))
+
+
+def test_translation_arguments_bypass_cache():
+    assert t("app.missing.key", default="fallback") == "fallback"
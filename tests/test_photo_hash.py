@@ -0,0 +1,108 @@
+"""
+Поиск повторно присланных котов через заглушку Bot API
+"""
+
+import io
+import math
+import time
+
+import pytest
+
+from app import bot, config, db, models, photo_hash
+from factories import make_message
+
+Image = pytest.importorskip("PIL.Image")
+
+USER_ID = 5
+
+
+def make_jpeg(size: int) -> bytes:
+    """
+    Картинка с плавными полосами. Копии разного размера дают близкие хэши
+    """
+    image = Image.new("L", (size, size))
+    image.putdata([int(127 + 120 * math.sin(x * 6.0 / size) * math.cos(y * 4.0 / size))
+                   for y in range(size) for x in range(size)])
+    data = io.BytesIO()
+    image.save(data, "JPEG")
+    return data.getvalue()
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Condition is not met in {} seconds".format(timeout)
+        time.sleep(0.01)
+
+
+def get_suggestions() -> list:
+    with db.get_engine().connect() as connection:
+        return connection.execute(models.Suggestion.__table__.select().order_by(models.Suggestion.id)).fetchall()
+
+
+def count_hashes() -> int:
+    with db.get_engine().connect() as connection:
+        return len(connection.execute(models.PhotoHash.__table__.select()).fetchall())
+
+
+@pytest.fixture
+def hashing(database, monkeypatch):
+    monkeypatch.setattr(config, "APP_PHOTO_HASH", True)
+    monkeypatch.setattr(config, "APP_QUERY_BUDGET_STRICT", True)
+    monkeypatch.setattr(photo_hash, "index", photo_hash.HashIndex())
+
+
+def send_photo(bot_api, size: int):
+    message = make_message(USER_ID, photo=True)
+    bot_api.files[message.photo[0].file_id] = make_jpeg(size)
+    bot.catch_photo(message)
+    return message
+
+
+def test_duplicate_is_flagged_after_suggestion_is_sent(hashing, bot_api):
+    send_photo(bot_api, 120)
+    wait_for(lambda: count_hashes() == 1)
+    assert bot_api.calls.get("editMessageCaption") is None
+
+    send_photo(bot_api, 90)
+    # Предложка ушла модератору, не дожидаясь хэша, а пометка о повторе появилась в ее сообщении потом
+    assert bot_api.calls["sendPhoto"] == 2
+    wait_for(lambda: bot_api.calls.get("editMessageCaption") == 1)
+    first, second = get_suggestions()
+    assert second.duplicate_suggestion_id == first.id
+    assert int(bot_api.last_params["editMessageCaption"]["message_id"]) == second.admin_message_id
+    wait_for(lambda: count_hashes() == 2)
+
+
+def test_duplicate_is_rejected(hashing, bot_api, monkeypatch):
+    monkeypatch.setattr(config, "APP_PHOTO_DUPLICATE_REJECT", True)
+    send_photo(bot_api, 120)
+    wait_for(lambda: count_hashes() == 1)
+
+    send_photo(bot_api, 90)
+    wait_for(lambda: len(get_suggestions()) == 1)
+    assert bot_api.calls["editMessageCaption"] == 1
+    assert int(bot_api.last_params["sendMessage"]["chat_id"]) == USER_ID
+    assert count_hashes() == 1
+
+
+def test_index_is_refreshed_on_interval(hashing, bot_api):
+    started = db.get_statement_count()
+    photo_hash.find_duplicate(0)
+    photo_hash.find_duplicate(0)
+    # Второй поиск в пределах INDEX_REFRESH_INTERVAL не догружает индекс из БД
+    assert db.get_statement_count() - started == 1
+
+
+def test_check_duplicate_budget(hashing, bot_api, monkeypatch):
+    # Хэш не считается в фоне: проверку вызываем сами, чтобы посчитать ее запросы
+    monkeypatch.setattr(config, "APP_PHOTO_HASH", False)
+    bot.catch_photo(make_message(USER_ID, photo=True))
+    bot.catch_photo(make_message(USER_ID, photo=True))
+    first, second = get_suggestions()
+    value = photo_hash.dhash(make_jpeg(120))
+    for suggestion in [first, second]:
+        started = db.get_statement_count()
+        bot.check_duplicate(suggestion.id, USER_ID, value)
+        assert db.get_statement_count() - started <= bot.check_duplicate.query_budget
+    assert get_suggestions()[1].duplicate_suggestion_id == first.id
@@ -0,0 +1,56 @@
+"""
+Конвейерный поллинг: продвижение и сохранение смещения
+"""
+
+import threading
+import time
+
+from app import polling
+
+
+def make_poller(update_ids: list) -> polling.Poller:
+    """
+    Поллер, который уже получил указанные обновления
+    """
+    poller = polling.Poller(100, 0, 2)
+    poller.offset = poller.saved_offset = update_ids[0]
+    poller.last_fetched_id = update_ids[-1]
+    poller.in_flight.extend(update_ids)
+    return poller
+
+
+def test_offset_waits_for_earliest_update(database):
+    poller = make_poller(list(range(10, 15)))
+    for update_id, offset in [(12, 10), (10, 11), (11, 13), (14, 13), (13, 15)]:
+        poller.complete(update_id)
+        assert poller.offset == offset
+    assert len(poller.in_flight) == 0 and len(poller.completed) == 0
+    assert polling.load_offset() == 15
+
+
+def test_older_offset_never_saved_last(database, monkeypatch):
+    poller = make_poller([10, 11])
+    saved = list()
+    save_offset = polling.save_offset
+
+    def slow_save(offset: int):
+        if offset == 11:
+            # Первый поток сохраняет смещение дольше, чем второй успевает обработать следующее обновление
+            time.sleep(0.2)
+        saved.append(offset)
+        return save_offset(offset)
+
+    monkeypatch.setattr(polling, "save_offset", slow_save)
+    first = threading.Thread(target=poller.complete, args=(10,))
+    first.start()
+    time.sleep(0.05)
+    poller.complete(11)
+    first.join()
+    assert saved == [11, 12]
+    assert polling.load_offset() == 12
+
+
+def test_stored_offset_only_grows(database):
+    polling.save_offset(20)
+    polling.save_offset(15)
+    assert polling.load_offset() == 20
@@ -0,0 +1,21 @@
+"""
+Фоновые задачи в нескольких процессах
+"""
+
+import pytest
+
+import bot as entrypoint
+from app import capture, moderation, prefork, retention, startup, vote_throttle
+
+
+@pytest.mark.parametrize("worker_index, shared", [(None, True), (0, True), (1, False)])
+def test_shared_workers_start_once(monkeypatch, worker_index, shared):
+    started = list()
+    monkeypatch.setattr(prefork, "worker_index", worker_index)
+    monkeypatch.setattr(capture, "start", lambda: None)
+    monkeypatch.setattr(startup, "run", lambda: None)
+    for module in [retention, moderation, vote_throttle]:
+        monkeypatch.setattr(module, "start_worker", lambda name=module.__name__: started.append(name))
+    entrypoint.prepare()
+    expected = ["app.retention", "app.moderation"] if shared else []
+    assert started == expected + ["app.vote_throttle"]
@@ -0,0 +1,137 @@
+"""
+Бюджеты запросов обработчиков: каждый обработчик проходит свои сценарии с `APP_QUERY_BUDGET_STRICT`
+и холодными кэшами и укладывается в объявленное количество запросов к БД
+"""
+
+import pytest
+from sqlalchemy import select, func
+
+from app import bot, config, db, models
+from factories import make_message, make_call
+
+ADMIN_ID = 1
+USER_ID = 5
+
+
+@pytest.fixture(autouse=True)
+def strict_budget(monkeypatch):
+    monkeypatch.setattr(config, "APP_QUERY_BUDGET_STRICT", True)
+
+
+def run(handler, *args) -> int:
+    """
+    Вызывает обработчик и проверяет, что он уложился в бюджет
+
+    :return: Количество запросов обработчика
+    """
+    started = db.get_statement_count()
+    # Превышение бюджета в строгом режиме выбрасывает QueryBudgetExceeded
+    handler(*args)
+    used = db.get_statement_count() - started
+    assert used <= handler.query_budget, "{} used {} of {} statements".format(handler.__name__, used,
+                                                                               handler.query_budget)
+    return used
+
+
+def count_rows(model, **filters) -> int:
+    with db.get_engine().connect() as connection:
+        query = select(func.count()).select_from(model.__table__)
+        for name, value in filters.items():
+            query = query.where(getattr(model.__table__.c, name) == value)
+        return connection.execute(query).scalar()
+
+
+def suggestion_ids() -> list:
+    with db.get_engine().connect() as connection:
+        return list(connection.execute(select(models.Suggestion.__table__.c.id)
+                                       .order_by(models.Suggestion.__table__.c.id)).scalars())
+
+
+def submit_photos(number: int) -> list:
+    for _ in range(number):
+        run(bot.catch_photo, make_message(USER_ID, photo=True))
+    return suggestion_ids()
+
+
+def publish_with_poll(suggestion_id: int, emojis: str) -> int:
+    run(bot.call_on_admin_suggestion, make_call(ADMIN_ID, {"a": bot.ACTION_ACCEPT_WITH_POLL, "s": suggestion_id}))
+    run(bot.catch_text_message, make_message(ADMIN_ID, emojis))
+    with db.get_engine().connect() as connection:
+        return connection.execute(select(func.max(models.Poll.__table__.c.id))).scalar()
+
+
+def test_every_handler_declares_budget():
+    handlers = bot.bot.message_handlers + bot.bot.callback_query_handlers
+    for handler in handlers:
+        function = handler["function"]
+        if function in [bot.catch_memory_command, bot.callback_handler]:
+            # Команда профилирования не ходит в БД, а нажатия на опросы считаются в `process_vote`
+            continue
+        assert hasattr(function, "query_budget"), function.__name__
+    assert hasattr(bot.process_vote, "query_budget")
+
+
+def test_commands_without_database(database, bot_api):
+    run(bot.send_help, make_message(USER_ID, "/help"))
+    run(bot.catch_any_message, make_message(USER_ID))
+    run(bot.catch_text_message, make_message(USER_ID, "hello"))
+    run(bot.catch_text_message, make_message(ADMIN_ID, "hello"))
+    assert bot_api.calls["sendMessage"] == 4
+
+
+def test_submissions_and_queue(database, bot_api):
+    ids = submit_photos(7)
+    assert len(ids) == 7
+    assert bot_api.calls["sendPhoto"] == 7
+    run(bot.catch_queue_command, make_message(ADMIN_ID, "/queue"))
+    run(bot.call_on_queue, make_call(ADMIN_ID, {"a": bot.ACTION_QUEUE, "n": ids[4]}))
+    run(bot.call_on_queue, make_call(ADMIN_ID, {"a": bot.ACTION_QUEUE, "b": ids[5]}))
+    # Страница опустела: очередь показывается с начала
+    run(bot.call_on_queue, make_call(ADMIN_ID, {"a": bot.ACTION_QUEUE, "n": ids[-1]}))
+    assert bot_api.calls["editMessageText"] == 3
+
+
+def test_decisions(database, bot_api):
+    ids = submit_photos(4)
+    run(bot.call_on_admin_suggestion, make_call(ADMIN_ID, {"a": bot.ACTION_ACCEPT, "s": ids[0]}))
+    run(bot.call_on_admin_suggestion, make_call(ADMIN_ID, {"a": bot.ACTION_DECLINE, "s": ids[1]}))
+    run(bot.call_on_admin_suggestion, make_call(ADMIN_ID, {"a": bot.ACTION_ACCEPT_WITH_POLL, "s": ids[2]}))
+    # Второй опрос отменяет ожидание эмодзи для первого
+    run(bot.call_on_admin_suggestion, make_call(ADMIN_ID, {"a": bot.ACTION_ACCEPT_WITH_POLL, "s": ids[3]}))
+    run(bot.catch_text_message, make_message(ADMIN_ID, "no emoji"))
+    run(bot.catch_cancel_command, make_message(ADMIN_ID, "/cancel"))
+    run(bot.catch_cancel_command, make_message(ADMIN_ID, "/cancel"))
+    assert count_rows(models.Suggestion) == 2
+    assert count_rows(models.Submitter, accepted=1, declined=1) == 1
+
+
+def test_poll_and_votes(database, bot_api):
+    ids = submit_photos(2)
+    poll_id = publish_with_poll(ids[0], "😺😿")
+    publish_with_poll(ids[1], "😺😿🙀")
+    assert count_rows(models.Poll) == 2
+    with db.get_engine().connect() as connection:
+        options = list(connection.execute(select(models.PollOption.__table__.c.id)
+                                          .where(models.PollOption.__table__.c.poll_id == poll_id)
+                                          .order_by(models.PollOption.__table__.c.id)).scalars())
+    for user_id in range(10, 13):
+        # Голос, перенос голоса и отмена голоса
+        for option_id in [options[0], options[1], options[1]]:
+            run(bot.process_vote, "call", user_id, {"a": bot.ACTION_VOTE, "o": option_id})
+    run(bot.process_vote, "call", 13, {"a": bot.ACTION_VOTE, "o": options[0]})
+    assert count_rows(models.PollVote, poll_id=poll_id) == 1
+    run(bot.catch_stats_command, make_message(ADMIN_ID, "/stats"))
+    run(bot.catch_top_command, make_message(ADMIN_ID, "/top"))
+    run(bot.catch_top_command, make_message(ADMIN_ID, "/top week"))
+    run(bot.catch_top_command, make_message(ADMIN_ID, "/top rebuild"))
+    run(bot.catch_top_command, make_message(ADMIN_ID, "/top never"))
+
+
+def test_budget_exceeded_is_raised(database):
+    @db.query_budget(0)
+    @db.commit_session
+    def handler(session=None):
+        session.execute(select(1))
+
+    with pytest.raises(db.QueryBudgetExceeded):
+        handler()
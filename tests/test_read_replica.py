@@ -0,0 +1,39 @@
+"""
+Чтения из реплики: кнопки поста после голоса перерисовываются по основной БД
+"""
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from app import bot, db, read_repo, repo
+
+
+@db.commit_session
+def create_poll(emojis: list, session=None):
+    poll = repo.create_poll(emojis)
+    poll.message_id = 1
+    session.flush()
+    return poll.id, [option.id for option in poll.options]
+
+
+@pytest.fixture
+def empty_replica(database, monkeypatch):
+    """
+    Реплика, которая еще не получила ни одной таблицы: любое чтение из нее падает
+    """
+    engine = create_engine("sqlite://")
+    monkeypatch.setattr(db, "__ReadSession", scoped_session(sessionmaker(bind=engine)))
+    yield
+    engine.dispose()
+
+
+def test_post_votes_are_read_from_primary(empty_replica, bot_api):
+    poll_id, option_ids = create_poll(["a", "b"])
+    with pytest.raises(Exception):
+        # Обычное чтение идет в реплику
+        read_repo.get_poll(poll_id)
+    assert bot.persist_vote(poll_id, 7, option_ids[0])
+    bot.refresh_post_votes(poll_id)
+    assert bot_api.calls.get("editMessageReplyMarkup") == 1
+    assert '"a 1"' in bot_api.last_params["editMessageReplyMarkup"]["reply_markup"]
@@ -0,0 +1,51 @@
+"""
+Заморозка опросов: голоса не попадают в замороженный опрос
+"""
+
+from sqlalchemy import select
+
+from app import bot, config, db, models, repo, retention, vote_cache
+
+
+@db.commit_session
+def create_poll(emojis: list, session=None):
+    poll = repo.create_poll(emojis)
+    poll.message_id = 1
+    session.flush()
+    return poll.id, [option.id for option in poll.options]
+
+
+@db.commit_session
+def freeze_poll(poll_id: int, session=None):
+    repo.freeze_poll(poll_id)
+
+
+def get_votes_total(poll_id: int) -> int:
+    with db.get_engine().connect() as connection:
+        return connection.execute(select(models.Poll.__table__.c.votes_total)
+                                  .where(models.Poll.__table__.c.id == poll_id)).scalar()
+
+
+def count_votes(poll_id: int) -> int:
+    with db.get_engine().connect() as connection:
+        return len(connection.execute(select(models.PollVote.__table__.c.id)
+                                      .where(models.PollVote.__table__.c.poll_id == poll_id)).fetchall())
+
+
+def test_vote_is_not_written_to_frozen_poll(database):
+    poll_id, option_ids = create_poll(["a", "b"])
+    assert bot.persist_vote(poll_id, 7, option_ids[0])
+    freeze_poll(poll_id)
+    assert not bot.persist_vote(poll_id, 8, option_ids[1])
+    assert not bot.persist_vote(poll_id, 7, vote_cache.NO_VOTE)
+    assert count_votes(poll_id) == 1
+    assert get_votes_total(poll_id) == 1
+
+
+def test_archive_drops_cached_options(database, bot_api, monkeypatch):
+    monkeypatch.setattr(config, "APP_POLL_RETENTION_DAYS", -1)
+    monkeypatch.setattr(config, "APP_RETENTION_BATCH_PAUSE", 0)
+    poll_id, option_ids = create_poll(["a", "b"])
+    assert not bot.get_option_meta(option_ids[0]).poll_is_final
+    retention.archive_polls()
+    assert bot.get_option_meta(option_ids[0]).poll_is_final
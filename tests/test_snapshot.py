@@ -0,0 +1,28 @@
+"""
+Снимки кэшей процесса
+"""
+
+import os
+
+from app import config, snapshot, vote_cache
+
+
+def test_deferred_votes_are_not_saved(database, monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "APP_SNAPSHOT_FILE", os.path.join(str(tmp_path), "snapshot.gz"))
+    vote_cache.user_votes.set((1, 10), 100)
+    vote_cache.user_votes.set((1, 11), 101)
+    vote_cache.user_votes.set((1, 12), 102)
+    # Голос пользователя 11 сдержан и ждет записи, голос пользователя 12 записывается прямо сейчас
+    vote_cache.throttle.defer((1, 11), 101)
+    vote_cache.throttle.defer((1, 12), 102)
+    vote_cache.throttle.take(0)
+    vote_cache.throttle.defer((1, 11), 101)
+    snapshot.save()
+
+    vote_cache.user_votes.clear()
+    vote_cache.throttle.pending.clear()
+    vote_cache.throttle.flushing.clear()
+    assert snapshot.restore()
+    assert vote_cache.user_votes.peek((1, 10)) == 100
+    assert vote_cache.user_votes.peek((1, 11)) is vote_cache.user_votes.MISSING
+    assert vote_cache.user_votes.peek((1, 12)) is vote_cache.user_votes.MISSING
@@ -0,0 +1,98 @@
+"""
+Журнал обновлений: падение посреди обработки записи
+"""
+
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import Future
+
+import pytest
+
+from app import spool
+
+WORKER = """
+import os
+import sys
+import time
+
+from app import dedup, spool
+
+mode, directory, applied = sys.argv[1:]
+done = []
+
+
+def handle(update):
+    if mode == "crash":
+        # Процесс убит посреди обработчика: обработчик ничего не успел записать
+        os._exit(3)
+    with open(applied, "a") as applied_file:
+        applied_file.write("{}\\n".format(update.update_id))
+    done.append(update.update_id)
+
+
+journal = spool.Spool(directory, 1 << 20, 1, dedup.mark_after_processing(handle))
+journal.start()
+if mode == "crash":
+    journal.append(sys.stdin.buffer.read()).result()
+    time.sleep(10)
+    sys.exit(1)
+deadline = time.monotonic() + 10
+# Запись, оборванная падением, обрабатывается заново, а ее повторная доставка отсеивается
+while len(done) == 0 and time.monotonic() < deadline:
+    time.sleep(0.01)
+journal.append(sys.stdin.buffer.read()).result()
+while journal.checkpoint < journal.next_number and time.monotonic() < deadline:
+    time.sleep(0.01)
+journal.save_checkpoint()
+"""
+
+UPDATE = json.dumps({"update_id": 77, "message": {"message_id": 1, "date": 0, "text": "cat",
+                                                  "chat": {"id": 5, "type": "private"}}}).encode("utf-8")
+
+
+def run_worker(src_dir: str, mode: str, directory: str, applied: str) -> int:
+    environment = dict(os.environ, APP_DEDUP_SHARED="1")
+    return subprocess.run([sys.executable, "-c", WORKER, mode, directory, applied], input=UPDATE, cwd=src_dir,
+                          env=environment, timeout=30).returncode
+
+
+def test_update_in_handler_at_crash_is_applied_after_restart(src_dir, database, tmp_path):
+    # Отметки об обработанных обновлениях в общей БД переживают перезапуск
+    directory = str(tmp_path / "spool")
+    applied = str(tmp_path / "applied")
+    assert run_worker(src_dir, "crash", directory, applied) == 3
+    assert not os.path.exists(applied)
+    assert run_worker(src_dir, "restart", directory, applied) == 0
+    with open(applied) as applied_file:
+        assert applied_file.read().split() == ["77"]
+
+
+def test_failed_batch_is_cut_from_segment(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    journal = spool.Spool(directory, 1 << 20, 1, None)
+    journal.write([(UPDATE, Future())])
+
+    def fail(fd):
+        raise OSError("disk failed")
+
+    monkeypatch.setattr(os, "fsync", fail)
+    with pytest.raises(OSError):
+        journal.write([(UPDATE, Future()), (UPDATE, Future())])
+    monkeypatch.undo()
+    # Телеграм получил ошибку и доставит пачку повторно, поэтому после перезапуска ее записей нет
+    assert [number for number, _ in spool.Spool(directory, 1 << 20, 1, None).recover()] == [0]
+
+
+def test_checkpoint_waits_for_oldest_record(tmp_path):
+    journal = spool.Spool(str(tmp_path), 1 << 20, 1, None)
+    journal.write([(UPDATE, Future()) for _ in range(4)])
+    journal.complete(1)
+    journal.complete(3)
+    assert journal.checkpoint == 0
+    journal.complete(0)
+    assert journal.checkpoint == 2
+    journal.complete(2)
+    assert journal.checkpoint == 4
+    assert len(journal.in_flight) == 0 and len(journal.completed) == 0
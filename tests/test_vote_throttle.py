@@ -0,0 +1,65 @@
+"""
+Запись итоговых голосов сдержанных нажатий: неудачная запись не теряет голоса
+"""
+
+from sqlalchemy import select
+
+from app import db, metrics, models, repo, vote_cache, vote_throttle
+
+
+@db.commit_session
+def create_poll(emojis: list, session=None):
+    poll = repo.create_poll(emojis)
+    poll.message_id = 1
+    session.flush()
+    return poll.id, [option.id for option in poll.options]
+
+
+def get_vote_option_id(poll_id: int, user_id: int):
+    with db.get_engine().connect() as connection:
+        return connection.execute(select(models.PollVote.__table__.c.option_id)
+                                  .where(models.PollVote.__table__.c.poll_id == poll_id)
+                                  .where(models.PollVote.__table__.c.user_id == user_id)).scalar()
+
+
+def test_failed_flush_is_retried(database, bot_api, monkeypatch):
+    poll_id, option_ids = create_poll(["a", "b"])
+    key = (poll_id, 7)
+    vote_cache.throttle.defer(key, option_ids[0])
+    persist_votes = vote_throttle.persist_votes
+    monkeypatch.setattr(vote_throttle, "persist_votes", lambda mutations: None)
+    retried = metrics.get_counter("votes_throttle_retried")
+    vote_throttle.flush_votes()
+    assert metrics.get_counter("votes_throttle_retried") == retried + 1
+    assert vote_cache.throttle.peek(key) == option_ids[0]
+    assert get_vote_option_id(*key) is None
+
+    monkeypatch.setattr(vote_throttle, "persist_votes", persist_votes)
+    vote_throttle.flush_votes()
+    assert get_vote_option_id(*key) == option_ids[0]
+    assert vote_cache.throttle.is_idle()
+    assert len(vote_cache.throttle.failures) == 0
+
+
+def test_newer_vote_wins_over_failed_one(database):
+    key = (1, 7)
+    vote_cache.throttle.defer(key, 10)
+    items = vote_cache.throttle.take(0)
+    # Пока пакет записывался, пользователь нажал еще раз
+    vote_cache.throttle.defer(key, 11)
+    assert vote_cache.throttle.retry(items, vote_throttle.MAX_FLUSH_ATTEMPTS) == []
+    assert vote_cache.throttle.peek(key) == 11
+
+
+def test_vote_is_dropped_after_max_attempts(database, monkeypatch):
+    key = (1, 7)
+    vote_cache.user_votes.set(key, 10)
+    vote_cache.throttle.defer(key, 10)
+    monkeypatch.setattr(vote_throttle, "persist_votes", lambda mutations: None)
+    monkeypatch.setattr(vote_throttle, "MAX_FLUSH_ATTEMPTS", 2)
+    dropped = metrics.get_counter("votes_throttle_dropped")
+    vote_throttle.flush_votes()
+    vote_throttle.flush_votes()
+    assert metrics.get_counter("votes_throttle_dropped") == dropped + 1
+    assert vote_cache.throttle.is_idle()
+    assert vote_cache.user_votes.peek(key) is vote_cache.user_votes.MISSING